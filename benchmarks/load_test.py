@@ -0,0 +1,190 @@
+"""
+Load test of the prediction server (`instacartlib.PredictionServer`).
+
+`--concurrency` clients (one keep-alive connection each) send `--n-requests`
+POST /predict requests in total for random users, then client-side latency
+percentiles, throughput and server metrics (mean batch size) are printed.
+
+Usage (running server):
+    python -m instacartlib.PredictionServer --data-dir instacart_data \\
+        --model model.dump --port 8080
+    python benchmarks/load_test.py --port 8080 --max-user-id 200000
+
+Usage (in-process server, compare batch sizes):
+    python benchmarks/load_test.py --data-dir instacart_data \\
+        --model model.dump --batch-sizes 1 16 64 --output results.json
+    python benchmarks/load_test.py --data-dir instacart_data \\
+        --model model.dump --workers 4 --client-processes 4
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+from instacartlib.PredictionServer import HttpJsonClient, PredictionServer
+from instacartlib.prefork import get_prefork_server
+
+
+async def run_client(host, port, user_ids_batches, latencies):
+    async with HttpJsonClient(host, port) as client:
+        for user_ids in user_ids_batches:
+            start = time.perf_counter()
+            status, _ = await client.request('POST', '/predict',
+                {'user_ids': user_ids})
+            if status != 200:
+                raise RuntimeError(f'Request failed with status {status}.')
+            latencies.append(time.perf_counter() - start)
+
+
+async def run_clients(host, port, requests, concurrency):
+    latencies = []
+    await asyncio.gather(*(
+        run_client(host, port, requests[i::concurrency], latencies)
+        for i in range(concurrency)))
+    return latencies
+
+
+def _run_clients_process(host, port, requests, concurrency):
+    return asyncio.run(run_clients(host, port, requests, concurrency))
+
+
+async def run_load(host, port, user_ids, n_requests, concurrency,
+        users_per_request=1, seed=0, client_processes=1):
+    """
+    client_processes: int
+        Split clients between processes (a single client process may be
+        the bottleneck for a multi-process server).
+
+    Returns
+    -------
+    results: dict
+        Client-side throughput and latency, server metrics.
+    """
+    rng = np.random.default_rng(seed)
+    requests = rng.choice(user_ids, size=(n_requests, users_per_request))
+    requests = [row.tolist() for row in requests]
+    start = time.perf_counter()
+    if client_processes == 1:
+        latencies = await run_clients(host, port, requests, concurrency)
+    else:
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ProcessPoolExecutor(
+                client_processes) as executor:
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(executor, _run_clients_process, host,
+                    port, requests[i::client_processes],
+                    max(concurrency // client_processes, 1))
+                for i in range(client_processes)))
+        latencies = [latency for part in parts for latency in part]
+    elapsed = time.perf_counter() - start
+
+    async with HttpJsonClient(host, port) as client:
+        _, server_metrics = await client.request('GET', '/metrics')
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'n_requests': n_requests,
+        'concurrency': concurrency,
+        'users_per_request': users_per_request,
+        'seconds': elapsed,
+        'requests_per_second': n_requests / elapsed,
+        'latency_ms': dict(zip(['p50', 'p90', 'p99'],
+            np.percentile(latencies_ms, [50, 90, 99]).tolist())),
+        'server': server_metrics,
+    }
+
+
+async def run_in_process(nbp, batch_sizes, max_wait, workers=1,
+        **load_kwargs):
+    user_ids = nbp.icds_predict.df_trns.uid.unique()
+    results = []
+    for batch_size in batch_sizes:
+        if workers == 1:
+            server = await PredictionServer(nbp, port=0,
+                batch_size=batch_size, max_wait=max_wait).start()
+        else:
+            server = get_prefork_server(nbp, workers, port=0,
+                batch_size=batch_size, max_wait=max_wait).start()
+        try:
+            result = await run_load(server.host, server.port, user_ids,
+                **load_kwargs)
+        finally:
+            if workers == 1:
+                await server.stop()
+            else:
+                server.stop()
+        result['batch_size'] = batch_size
+        result['workers'] = workers
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result):
+    latency = result['latency_ms']
+    server = result['server']
+    print(f'workers={result.get("workers", "?"):>3} '
+          f'batch_size={result.get("batch_size", "?"):>5} '
+          f'rps={result["requests_per_second"]:9.1f} '
+          f'p50={latency["p50"]:7.2f}ms p99={latency["p99"]:7.2f}ms '
+          f'batches={server["n_batches"]:6d} '
+          f'requests/batch={server["batch_requests_mean"]:6.1f}')
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-user-id', type=int, default=1000,
+        help='Users are drawn from 1..max-user-id (running server).')
+    parser.add_argument('--data-dir', default=None,
+        help='Start an in-process server with data from this directory.')
+    parser.add_argument('--model', default=None,
+        help='Model file for the in-process server.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[64],
+        help='In-process server batch sizes to compare.')
+    parser.add_argument('--workers', type=int, default=1,
+        help='In-process server worker processes (pre-fork if > 1).')
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    parser.add_argument('--n-requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--users-per-request', type=int, default=1)
+    parser.add_argument('--client-processes', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+        help='Write results to JSON file.')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    load_kwargs = dict(n_requests=args.n_requests,
+        concurrency=args.concurrency,
+        users_per_request=args.users_per_request, seed=args.seed,
+        client_processes=args.client_processes)
+    if args.data_dir is None:
+        result = asyncio.run(run_load(args.host, args.port,
+            np.arange(1, args.max_user_id + 1), **load_kwargs))
+        print_result(result)
+        results = [result]
+    else:
+        from instacartlib.NextBasketPrediction import NextBasketPrediction
+        nbp = NextBasketPrediction().add_data(args.data_dir)
+        nbp.load_model(path=args.model)
+        results = asyncio.run(run_in_process(nbp, args.batch_sizes,
+            args.max_wait_ms / 1000, args.workers, **load_kwargs))
+
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Benchmark the whole pipeline on synthetic data of increasing size.
+
+For every scale point (number of transactions rows) a synthetic dataset is
+generated (see `instacartlib.synthetic`, cached in `--data-dir`), then a model
+is trained and predictions are made and exported. Wall time of every
+recorded stage (ingest, preprocessing, each feature extractor, training,
+prediction, export) is taken from `Profiler` events.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scales 10000 100000 \\
+        --output results.json
+    python benchmarks/run_benchmarks.py --scales 10000 100000 \\
+        --baseline benchmarks/baseline.json --tolerance 0.2
+
+With `--baseline` stages slower than baseline by more than `--tolerance`
+(relative) and `--min-seconds` (absolute) are reported as regressions and the
+script exits with code 1.
+"""
+
+import argparse
+from collections import defaultdict
+import json
+from pathlib import Path
+import platform
+import sys
+import tempfile
+
+from sklearn.ensemble import GradientBoostingClassifier
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+from instacartlib.NextBasketPrediction import NextBasketPrediction
+from instacartlib.Profiler import Profiler
+from instacartlib.synthetic import write_synthetic_dataset
+
+
+def get_stage_times(profiler):
+    """ Total wall time (seconds) per stage name. """
+    stage_times = defaultdict(float)
+    for event in profiler.events:
+        stage_times[event.name] += event.wall_time
+    return dict(stage_times)
+
+
+def get_dataset_dir(data_dir, n_rows, seed):
+    path_dir = Path(data_dir) / f'synthetic_{n_rows}_seed{seed}'
+    # Written last (see `write_synthetic_dataset`): complete dataset
+    if not (path_dir / 'transactions.csv').exists():
+        print(f'Generating dataset: {path_dir}')
+        write_synthetic_dataset(path_dir, n_rows, seed=seed,
+            show_progress=True)
+    return path_dir
+
+
+def run_scale_point(path_dir, n_estimators, random_state=0):
+    profiler = Profiler()
+    model = GradientBoostingClassifier(n_estimators=n_estimators,
+        random_state=random_state)
+    nbp = NextBasketPrediction(model=model, profiler=profiler)
+    nbp.add_data(path_dir)
+    nbp.train_model()
+    nbp.update_predictions()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        nbp.predictions_to_csv(Path(tmp_dir) / 'predictions.csv')
+    return get_stage_times(profiler)
+
+
+def compare_to_baseline(results, baseline, tolerance=.2, min_seconds=.05):
+    """
+    Returns
+    -------
+    regressions: list of dict
+        Keys: scale, stage, baseline, current, ratio
+    """
+    regressions = []
+    for scale, stage_times in results['scales'].items():
+        baseline_times = baseline['scales'].get(scale, {})
+        for stage, current in stage_times.items():
+            if stage not in baseline_times:
+                continue
+            previous = baseline_times[stage]
+            if (current > previous * (1 + tolerance)
+                    and current - previous > min_seconds):
+                regressions.append({
+                    'scale': scale,
+                    'stage': stage,
+                    'baseline': previous,
+                    'current': current,
+                    'ratio': current / max(previous, 1e-9),
+                })
+    return regressions
+
+
+def print_results(results, baseline=None):
+    for scale, stage_times in results['scales'].items():
+        print(f'\n{scale} rows')
+        baseline_times = (baseline or {}).get('scales', {}).get(scale, {})
+        for stage, seconds in stage_times.items():
+            line = f'  {stage:<55} {seconds:10.3f}s'
+            if stage in baseline_times:
+                previous = baseline_times[stage]
+                line += f'  (baseline {previous:.3f}s, ' \
+                    f'x{seconds / max(previous, 1e-9):.2f})'
+            print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark instacartlib pipeline on synthetic data.')
+    parser.add_argument('--scales', type=int, nargs='+',
+        default=[10_000, 100_000], help='Numbers of transactions rows.')
+    parser.add_argument('--data-dir', default='instacart_temp/benchmarks',
+        help='Directory for generated datasets (reused between runs).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-estimators', type=int, default=10,
+        help='Number of boosting stages of the trained model.')
+    parser.add_argument('--output', default=None,
+        help='Write results to JSON file (can be used as a baseline).')
+    parser.add_argument('--baseline', default=None,
+        help='JSON file with results of a previous run.')
+    parser.add_argument('--tolerance', type=float, default=.2)
+    parser.add_argument('--min-seconds', type=float, default=.05)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'n_estimators': args.n_estimators,
+            'seed': args.seed,
+        },
+        'scales': {},
+    }
+    for n_rows in args.scales:
+        path_dir = get_dataset_dir(args.data_dir, n_rows, args.seed)
+        print(f'Running benchmark: {n_rows} rows')
+        results['scales'][str(n_rows)] = run_scale_point(path_dir,
+            args.n_estimators, random_state=args.seed)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'wt') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline,
+            tolerance=args.tolerance, min_seconds=args.min_seconds)
+        for r in regressions:
+            print(f'REGRESSION {r["scale"]} rows, {r["stage"]}: '
+                  f'{r["baseline"]:.3f}s -> {r["current"]:.3f}s '
+                  f'(x{r["ratio"]:.2f})')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Features quantization to uint8 bin codes, fitted once (on train features)
+and saved with the model.
+
+Capabilities:
+* Fit bin edges column by column: midpoints between distinct values if a
+  feature has at most `max_bins` of them (lossless for tree models),
+  quantiles otherwise.
+* Build the uint8 codes matrix of a frame (or of any columns container
+  with `columns`, `len()` and `[name]`, e.g. `FeaturesStore`) with a
+  single allocation, column by column (no float matrix of all features is
+  built). Features themselves aren't replaced: the codes matrix is built
+  on every call, in addition to the features frame.
+* Codes keep the order of values, so tree models trained on codes split
+  them the same way: `x <= edges[k]` is `code <= k`. Missing values get
+  the highest code (`NAN_CODE`).
+"""
+
+import numpy as np
+
+
+NAN_CODE = 255
+
+
+def _get_midpoint_quantiles(values, quantiles):
+    """ `np.quantile(values, quantiles, method='midpoint')`, also for numpy
+    < 1.22 (which has `interpolation` keyword instead of `method`). """
+    values = np.sort(values)
+    positions = np.asarray(quantiles) * (len(values) - 1)
+    return (values[np.floor(positions).astype('int64')]
+        + values[np.ceil(positions).astype('int64')]) / 2
+
+
+class FeatureQuantizer:
+    """
+    max_bins: int
+        Bins per feature for non-missing values (at most `NAN_CODE`).
+
+    Attributes (after `fit`):
+        columns - list of feature names (order of the matrix columns)
+        edges - float64 bin edges of all features, concatenated
+        edges_offsets - (n_features + 1,) int64, edges of feature `i` are
+            `edges[edges_offsets[i]:edges_offsets[i + 1]]`
+    """
+    def __init__(self, max_bins=255):
+        if not 2 <= max_bins <= NAN_CODE:
+            raise ValueError(f'max_bins expected to be in [2, {NAN_CODE}], '
+                f'got: {max_bins}')
+        self.max_bins = max_bins
+        self.columns = None
+        self.edges = None
+        self.edges_offsets = None
+
+
+    def __repr__(self):
+        n_features = 0 if self.columns is None else len(self.columns)
+        return (f'<{self.__class__.__name__} features={n_features} '
+                f'max_bins={self.max_bins}>')
+
+
+    def _get_edges(self, values):
+        values = values[~np.isnan(values)]
+        unique = np.unique(values)
+        if len(unique) > self.max_bins:
+            quantiles = np.linspace(0, 1, self.max_bins + 1)[1:-1]
+            return np.unique(_get_midpoint_quantiles(values, quantiles))
+        return (unique[:-1] + unique[1:]) / 2
+
+
+    def fit(self, df, columns=None):
+        """
+        df: DataFrame
+            Features (numeric columns).
+        columns: None or list of str
+            Features to use (all columns of `df` if None).
+        """
+        self.columns = list(df.columns if columns is None else columns)
+        edges = [self._get_edges(df[name].values.astype('float64'))
+            for name in self.columns]
+        self.edges = np.concatenate([np.empty(0), *edges])
+        self.edges_offsets = np.r_[0, np.cumsum(
+            [len(column_edges) for column_edges in edges])].astype('int64')
+        return self
+
+
+    def get_edges(self, name):
+        return self._get_column_edges(self.columns.index(name))
+
+
+    def _get_column_edges(self, i):
+        return self.edges[self.edges_offsets[i]:self.edges_offsets[i + 1]]
+
+
+    def transform(self, df):
+        """
+        df: DataFrame or FeaturesStore
+            Has all `self.columns` (in any order).
+
+        Returns
+        -------
+        codes: np.ndarray
+            (len(df), n_features) uint8 bin codes.
+        """
+        if self.columns is None:
+            raise ValueError('FeatureQuantizer is not fitted. Use '
+                '`.fit(df)`.')
+        available = set(df.columns)
+        missing = [name for name in self.columns if name not in available]
+        if missing:
+            raise ValueError(f'Missing features: {missing}')
+        codes = np.empty((len(df), len(self.columns)), dtype='uint8')
+        for i, name in enumerate(self.columns):
+            values = np.asarray(df[name]).astype('float64')
+            edges = self._get_column_edges(i)
+            # Number of edges below the value: x <= edges[k] - code <= k
+            codes[:, i] = np.searchsorted(edges, values, side='left')
+            codes[np.isnan(values), i] = NAN_CODE
+        return codes
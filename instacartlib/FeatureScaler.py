@@ -0,0 +1,84 @@
+"""
+Features standardization fitted once (on train features) and saved with the
+model.
+
+Capabilities:
+* Fit mean / std column by column (the features matrix is never copied as
+  a whole).
+* Build the scaled float64 matrix of a frame or of a chunk of rows with a
+  single allocation, scaling in place (no statistics computed at predict
+  time, so predictions don't depend on which users are scored together).
+"""
+
+import numpy as np
+
+
+class FeatureScaler:
+    """
+    min_std: float
+        Columns with lower std are only centered.
+
+    Attributes (after `fit`):
+        columns - list of feature names (order of the matrix columns)
+        mean, std - (n_features,) float64
+    """
+    def __init__(self, min_std=1e-6):
+        self.min_std = min_std
+        self.columns = None
+        self.mean = None
+        self.std = None
+
+
+    def __repr__(self):
+        n_features = 0 if self.columns is None else len(self.columns)
+        return f'<{self.__class__.__name__} features={n_features}>'
+
+
+    def fit(self, df, columns=None):
+        """
+        df: DataFrame
+            Features (numeric columns).
+        columns: None or list of str
+            Features to use (all columns of `df` if None).
+        """
+        self.columns = list(df.columns if columns is None else columns)
+        self.mean = np.empty(len(self.columns), dtype='float64')
+        self.std = np.empty(len(self.columns), dtype='float64')
+        for i, name in enumerate(self.columns):
+            column = df[name].values.astype('float64')
+            self.mean[i] = column.mean()
+            self.std[i] = column.std()
+        self.std[self.std < self.min_std] = 1.
+        return self
+
+
+    def transform(self, df):
+        """
+        df: DataFrame
+            Has all `self.columns` (in any order).
+
+        Returns
+        -------
+        x: np.ndarray
+            (len(df), n_features) float64 scaled features.
+        """
+        if self.columns is None:
+            raise ValueError('FeatureScaler is not fitted. Use `.fit(df)`.')
+        missing = [name for name in self.columns if name not in df]
+        if missing:
+            raise ValueError(f'Missing features: {missing}')
+        x = np.empty((len(df), len(self.columns)), dtype='float64')
+        for i, name in enumerate(self.columns):
+            x[:, i] = df[name].values
+        return self.transform_array(x)
+
+
+    def transform_array(self, x):
+        """
+        x: np.ndarray
+            float64 features matrix (columns in `self.columns` order),
+            scaled in place and returned.
+        """
+        x -= self.mean
+        x /= self.std
+        return x
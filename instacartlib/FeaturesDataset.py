@@ -5,7 +5,8 @@ Generation process: extract features from transactions and products dataframes,
 and cache them to files.
 
 Capabilities:
-* Register feature extractors.
+* Register feature extractors, use only some of them (e.g. the ones a
+  loaded model needs, see `ModelBundle`).
 * Generate (and cache) features for classification task.
 * Combine dataset from extracted features.
 
@@ -21,10 +22,21 @@ Types of features:
     fsds = FeaturesDataset(verbose=1)
     df_features = fsds.extract_features(*instacart_dataset_train.frames)
 ```
+
+Sharded (out-of-core) extraction:
+* UI and U features are user-local: extractors can process users shard by
+  shard (`extract_features_sharded`). Every shard's features are written to
+  disk right away and the result is available as memory-mapped
+  `FeaturesStore`.
+* I features are global: they are computed by a pre-pass over all shards
+  (see `ItemStats`) and passed to extractors as `df_i` dataframe.
 """
 
 from .feature_extractors import exports as feature_extractors
 from .DataFrameFileCache import DataFrameFileCache
+from .FeaturesStore import FeaturesStore, FeaturesStoreWriter
+from .ItemStats import ItemStats
+from .Profiler import Profiler
 from .utils import get_df_info, increment_counter_suffix
 
 from pathlib import Path
@@ -90,6 +102,55 @@ def _new_ui_index(df_trns):
         return df_trns.set_index(['uid', 'iid']).index.drop_duplicates()
 
 
+def _get_users_shards_bounds(uids, n_shards):
+    """
+    Split sorted unique user ids into `n_shards` contiguous ranges.
+
+    Returns
+    -------
+    bounds: np.ndarray
+        The first uid of each (non-empty) shard.
+    """
+    uids = np.unique(uids)
+    return np.array([shard[0]
+        for shard in np.array_split(uids, n_shards)
+        if len(shard) > 0], dtype=uids.dtype)
+
+
+def _get_shards_positions(uids, bounds):
+    """
+    Returns
+    -------
+    positions: list of np.ndarray
+        Row positions (ascending) of each shard.
+    """
+    shard_ids = np.searchsorted(bounds, uids, side='right') - 1
+    shard_ids = shard_ids.clip(min=0)
+    order = np.argsort(shard_ids, kind='stable')
+    shard_sizes = np.bincount(shard_ids, minlength=len(bounds))
+    return np.split(order, np.cumsum(shard_sizes)[:-1])
+
+
+def _iter_shards_dataframes(dataframes, n_shards):
+    """
+    Yield `dataframes` dict for each user shard. Frames without `uid` column
+    (like `df_prod`) are passed to every shard as is.
+    """
+    bounds = _get_users_shards_bounds(dataframes['df_trns'].uid.values,
+        n_shards)
+    frames_positions = {
+        name: _get_shards_positions(df.uid.values, bounds)
+        for name, df in dataframes.items()
+        if isinstance(df, pd.DataFrame) and 'uid' in df
+    }
+    for i_shard in range(len(bounds)):
+        yield {
+            name: (df.iloc[frames_positions[name][i_shard]]
+                   if name in frames_positions else df)
+            for name, df in dataframes.items()
+        }
+
+
 class FeaturesDataset:
     """
     ui_index : None or pd.Multiindex
@@ -97,16 +158,25 @@ class FeaturesDataset:
         automatically at first`add_feature` call.
     features_cache_dir : None, str or Path
         Use this directory for feature caching. Set to None to disable caching.
+    profiler: None or Profiler
+        Record "features.*" stages.
     """
-    def __init__(self, ui_index=None, features_cache_dir=None, verbose=0):
+    def __init__(self, ui_index=None, features_cache_dir=None, verbose=0,
+            profiler=None):
         self.features_cache_dir = features_cache_dir
         self.verbose = verbose
+        self.profiler = (Profiler(enabled=False) if profiler is None
+            else profiler)
 
         self._ui_index_created = ui_index is not None
+        self._ui_index_given = ui_index is not None
         self.df_ui = pd.DataFrame(index=ui_index)
 
         self._feature_extractors = {}
+        self._used_extractors = None
         self._feature_registry = {}
+        self.item_stats = None
+        self.features_store = None
 
         self.cache_enabled = self.features_cache_dir is not None
         if self.features_cache_dir is not None:
@@ -141,6 +211,41 @@ class FeaturesDataset:
         return self
 
 
+    def use_feature_extractors(self, names=None):
+        """
+        names: None or list of str
+            Use only these registered extractors (all if None), features of
+            other extractors aren't computed.
+        """
+        if names is not None:
+            unknown = set(names) - set(self._feature_extractors)
+            if unknown:
+                raise ValueError(f'Unknown feature extractors: {unknown}')
+            names = set(names)
+        self._used_extractors = names
+        return self
+
+
+    @property
+    def feature_extractors(self):
+        """ {name: function} of extractors in use. """
+        return {name: function
+            for name, function in self._feature_extractors.items()
+            if self._used_extractors is None or name in self._used_extractors}
+
+
+    def clear_features(self):
+        """
+        Drop extracted features before extracting them again (`ui_index` is
+        created again as well, unless it was given).
+        """
+        self._ui_index_created = self._ui_index_given
+        self.df_ui = pd.DataFrame(
+            index=self.df_ui.index if self._ui_index_given else None)
+        self._feature_registry = {}
+        return self
+
+
     def extract_features(self, **dataframes):
         if len(self._feature_extractors) == 0:
             self._print(
@@ -154,12 +259,28 @@ class FeaturesDataset:
                     'automatically.')
             self._create_df_ui_index(dataframes['df_trns'])
 
-        for extractor_name, function in self._feature_extractors.items():
+        for output in self._iter_extractors_outputs(self.df_ui.index,
+                dataframes, self._feature_registry):
+            self.df_ui = self.df_ui.join(output)
+        return self
+
+
+    def _iter_extractors_outputs(self, index, dataframes, feature_registry):
+        """
+        Use every registered extractor on `index`. Yield valid outputs with
+        features renamed to be unique within `feature_registry` (updated
+        in place).
+        """
+        for extractor_name, function in self.feature_extractors.items():
             self._print(f'Using extractor: "{extractor_name}"')
 
             try:
-                output = _use_extractor(function, self.df_ui.index, dataframes)
-                _assert_extractor_output(output, self.df_ui.index)
+                with self.profiler.stage(
+                        f'features.extractor.{extractor_name}',
+                        rows_in=len(index)) as event:
+                    output = _use_extractor(function, index, dataframes)
+                    _assert_extractor_output(output, index)
+                    event.rows_out = len(output)
             except Exception as e:
                 self._print(e, indent=2)
                 continue
@@ -167,37 +288,178 @@ class FeaturesDataset:
             self._print(f'Extracted features: {list(output.columns)}',
                 indent=2)
             output, old_new_names_dict = (
-                _process_extractor_output(output, self._feature_registry))
-            self._warn_renamed_features(old_new_names_dict)
-            self._add_features_to_registry(extractor_name, output.columns)
+                _process_extractor_output(output, feature_registry))
+            self._warn_renamed_features(old_new_names_dict, feature_registry)
+            for feature_name in output.columns:
+                feature_registry[feature_name] = extractor_name
+            yield output
+
+
+    def _extract_index_features(self, index, dataframes,
+            feature_registry=None):
+        """
+        Features for given `index` as a new DataFrame (`self.df_ui` is not
+        changed).
+        """
+        if feature_registry is None:
+            feature_registry = {}
+        df = pd.DataFrame(index=index)
+        for output in self._iter_extractors_outputs(index, dataframes,
+                feature_registry):
+            df = df.join(output)
+        return df
+
+
+    def extract_features_sharded(self, path_dir, n_shards, **dataframes):
+        """
+        Extract features shard by shard, each shard containing ~1/n_shards of
+        users. Memory usage is limited by the largest shard's features instead
+        of the whole `df_ui`.
+
+        Pre-pass computes global item statistics (`ItemStats`) and the size
+        of every shard. Main pass uses registered extractors on each shard
+        (global item features are passed to extractors as `df_i`) and writes
+        the result to `path_dir`.
+
+        Result is available as memory-mapped `self.features_store`
+        (`self.df_ui` is not changed).
+
+        path_dir: str or pathlib.Path
+            Directory for `FeaturesStore` files.
+        n_shards: int
+            Number of user shards.
+        """
+        if 'df_trns' not in dataframes:
+            raise ValueError('`df_trns` is required to split users into '
+                'shards.')
+        if n_shards < 1:
+            raise ValueError(f'n_shards expected to be >= 1, got: {n_shards}')
+
+        self._print(f'Pre-pass: item statistics ({n_shards} shards) ...')
+        item_stats = ItemStats()
+        n_rows = 0
+        with self.profiler.stage('features.item_stats',
+                rows_in=len(dataframes['df_trns'])) as event:
+            for shard_dataframes in _iter_shards_dataframes(dataframes,
+                    n_shards):
+                df_trns = shard_dataframes['df_trns']
+                item_stats += ItemStats.from_df_trns(df_trns)
+                n_rows += len(_new_ui_index(df_trns))
+            event.rows_out = n_rows
+        self.item_stats = item_stats
+        dataframes = {**dataframes, 'df_i': item_stats.get_features()}
+
+        writer = FeaturesStoreWriter(path_dir, n_rows)
+        feature_registry = {}
+        for i_shard, shard_dataframes in enumerate(
+                _iter_shards_dataframes(dataframes, n_shards)):
+            self._print(f'Shard {i_shard + 1}/{n_shards}:')
+            with self.profiler.stage('features.shard') as event:
+                index = _new_ui_index(shard_dataframes['df_trns'])
+                shard_registry = {}
+                df_shard = self._extract_index_features(index,
+                    shard_dataframes, shard_registry)
+                writer.write(df_shard)
+                feature_registry.update(shard_registry)
+                event.rows_out = len(df_shard)
+
+        self.features_store = writer.close()
+        self._feature_registry.update(feature_registry)
+        self._print(self.features_store)
+        return self
 
-            self.df_ui = self.df_ui.join(output)
+
+    def update_users(self, user_ids, df_trns_removed, **dataframes):
+        """
+        Extract features for given users only and replace their rows in
+        `df_ui` (updated rows are moved to the end).
+
+        Global item statistics are updated by delta: `df_trns_removed`
+        (users' previous transactions) is subtracted from `self.item_stats`
+        and users' new transactions are added. Item features of other users'
+        rows are not updated.
+
+        user_ids: list-like
+            Users to update.
+        df_trns_removed: DataFrame
+            Transactions of `user_ids` used for current `df_ui` rows and
+            `self.item_stats`.
+        **dataframes:
+            Dataframes limited to `user_ids` rows (see
+            `InstacartDataset.get_users_dataframes`).
+        """
+        if self.item_stats is None:
+            raise ValueError('Item statistics are required to update users. '
+                'Set `item_stats` attribute first (see `ItemStats`).')
+        if 'df_trns' not in dataframes:
+            raise ValueError('`df_trns` is required to update users.')
+
+        df_trns = dataframes['df_trns']
+        with self.profiler.stage('features.item_stats_delta',
+                rows_in=len(df_trns_removed) + len(df_trns)):
+            self.item_stats = (self.item_stats
+                - ItemStats.from_df_trns(df_trns_removed)
+                + ItemStats.from_df_trns(df_trns))
+
+        df_users = self.extract_users_features(**dataframes)
+        if len(self.df_ui.columns) > 0:
+            if df_users.columns.to_list() != self.df_ui.columns.to_list():
+                raise ValueError(f'Expected features '
+                    f'{self.df_ui.columns.to_list()}, '
+                    f'got: {df_users.columns.to_list()}')
+
+        is_updated = self.df_ui.index.get_level_values('uid').isin(user_ids)
+        self.df_ui = pd.concat([self.df_ui[~is_updated], df_users])
+        self._ui_index_created = True
         return self
 
 
+    def extract_users_features(self, **dataframes):
+        """
+        Features of users present in `dataframes['df_trns']` as a new
+        DataFrame (`self.df_ui` is not changed). Global item features are
+        taken from `self.item_stats`, so the values are the same as
+        extracted for all users at once.
+
+        **dataframes:
+            Dataframes limited to some users' rows (see
+            `InstacartDataset.get_users_dataframes`).
+        """
+        if self.item_stats is None:
+            raise ValueError('Item statistics are required to extract '
+                'features of a subset of users. Set `item_stats` attribute '
+                'first (see `ItemStats`).')
+        if 'df_trns' not in dataframes:
+            raise ValueError('`df_trns` is required to extract users\' '
+                'features.')
+
+        df_trns = dataframes['df_trns']
+        df_i = self.item_stats.get_features(iids=df_trns.iid.unique())
+        return self._extract_index_features(_new_ui_index(df_trns),
+            {**dataframes, 'df_i': df_i})
+
+
     def _create_df_ui_index(self, df_trns):
         try:
-            self.df_ui.index = _new_ui_index(df_trns)
+            with self.profiler.stage('features.ui_index',
+                    rows_in=len(df_trns)) as event:
+                self.df_ui.index = _new_ui_index(df_trns)
+                event.rows_out = len(self.df_ui.index)
         except Exception as e:
             raise ValueError('Unable to automatically generate `ui_index` '
                 'from `df_trns`.') from e
         self._ui_index_created = True
 
 
-    def _warn_renamed_features(self, old_new_names_dict):
+    def _warn_renamed_features(self, old_new_names_dict, feature_registry):
         for old_name, new_name in old_new_names_dict.items():
             self._print(
                 f'Feature has been renamed "{old_name}" -> "{new_name}", '
                 f'because it has been already extracted by extractor '
-                f'"{self._feature_registry[old_name]}".',
+                f'"{feature_registry[old_name]}".',
                 indent=2)
 
 
-    def _add_features_to_registry(self, extractor_name, feature_names):
-        for feature_name in feature_names:
-            self._feature_registry[feature_name] = extractor_name
-
-
     def info(self):
         cols = self.df_ui.columns.to_list()
         info_message = [
@@ -0,0 +1,194 @@
+"""
+On-disk storage for UI features.
+
+Capabilities:
+1. Write (uid, iid)-indexed features frame by frame (e.g. user shard by user
+   shard) into preallocated column files.
+2. Open stored features as memory-mapped columns without reading them into
+   memory.
+
+Directory layout:
+    meta.json     - number of rows, column names and dtypes
+    uid.npy       - index level 0
+    iid.npy       - index level 1
+    <column>.npy  - one file per feature column
+"""
+
+from .utils import format_size
+
+from pathlib import Path
+import json
+
+import numpy as np
+import pandas as pd
+
+
+META_FILENAME = 'meta.json'
+INDEX_NAMES = ['uid', 'iid']
+
+
+def _get_column_path(path_dir, name):
+    return Path(path_dir) / f'{name}.npy'
+
+
+class FeaturesStoreWriter:
+    """
+    Writes DataFrames with (uid, iid) index one after another into column
+    files. Column set and dtypes are taken from the first written frame.
+    `meta.json` is written on `close()`, so an unfinished store can't be
+    opened with `FeaturesStore`.
+
+    path_dir: str or pathlib.Path
+        Directory for column files (created if doesn't exist).
+    n_rows: int
+        Total number of rows in all frames to be written.
+    """
+    def __init__(self, path_dir, n_rows):
+        self.path_dir = Path(path_dir)
+        self.n_rows = n_rows
+        self.n_written = 0
+        self.columns = None
+        self._arrays = {}
+
+
+    def _create_arrays(self, df):
+        self.path_dir.mkdir(parents=True, exist_ok=True)
+        (self.path_dir / META_FILENAME).unlink(missing_ok=True)
+        self.columns = df.columns.to_list()
+        dtypes = {
+            **{name: df.index.get_level_values(name).dtype
+               for name in INDEX_NAMES},
+            **df.dtypes.to_dict(),
+        }
+        for name, dtype in dtypes.items():
+            self._arrays[name] = np.lib.format.open_memmap(
+                _get_column_path(self.path_dir, name), mode='w+',
+                dtype=dtype, shape=(self.n_rows,))
+
+
+    def write(self, df):
+        if self.columns is None:
+            self._create_arrays(df)
+        if df.columns.to_list() != self.columns:
+            raise ValueError(f'Expected columns {self.columns}, '
+                f'got: {df.columns.to_list()}')
+        start, stop = self.n_written, self.n_written + len(df)
+        if stop > self.n_rows:
+            raise ValueError(f'Store has been created for {self.n_rows} rows, '
+                f'got: {stop}')
+
+        for name in INDEX_NAMES:
+            self._arrays[name][start:stop] = df.index.get_level_values(name)
+        for name in self.columns:
+            self._arrays[name][start:stop] = df[name].values
+        self.n_written = stop
+        return self
+
+
+    def close(self):
+        if self.n_written != self.n_rows:
+            raise ValueError(f'Expected {self.n_rows} rows to be written, '
+                f'got: {self.n_written}')
+        for array in self._arrays.values():
+            array.flush()
+        meta = {
+            'n_rows': self.n_rows,
+            'columns': self.columns or [],
+        }
+        with open(self.path_dir / META_FILENAME, 'wt') as f:
+            json.dump(meta, f, indent=2)
+        self._arrays = {}
+        return FeaturesStore(self.path_dir)
+
+
+class FeaturesStore:
+    """
+    Memory-mapped features created with `FeaturesStoreWriter`.
+
+    path_dir: str or pathlib.Path
+        Directory with `meta.json` and column files.
+    mmap_mode: {'r', 'r+', 'c', None}
+        Passed to `np.load`. None reads all columns into memory.
+    """
+    def __init__(self, path_dir, mmap_mode='r'):
+        self.path_dir = Path(path_dir)
+        self.mmap_mode = mmap_mode
+
+        meta_path = self.path_dir / META_FILENAME
+        if not meta_path.exists():
+            raise FileNotFoundError(
+                f'Features store not found at "{self.path_dir.absolute()}".')
+        with open(meta_path, 'rt') as f:
+            meta = json.load(f)
+
+        self.n_rows = meta['n_rows']
+        self.columns = meta['columns']
+        self._arrays = {
+            name: np.load(_get_column_path(self.path_dir, name),
+                mmap_mode=self.mmap_mode)
+            for name in [*INDEX_NAMES, *self.columns]
+        }
+
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return (f'<{class_name} shape={(self.n_rows, len(self.columns))} '
+                f'size=\'{format_size(self.nbytes)}\'>')
+
+
+    def __len__(self):
+        return self.n_rows
+
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+
+    @property
+    def uid(self):
+        return self._arrays['uid']
+
+
+    @property
+    def iid(self):
+        return self._arrays['iid']
+
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays.values())
+
+
+    def get_index(self, start=None, stop=None):
+        return pd.MultiIndex.from_arrays(
+            [self.uid[start:stop], self.iid[start:stop]], names=INDEX_NAMES)
+
+
+    def get_frame(self, start=None, stop=None, columns=None):
+        """
+        Read rows [start, stop) into DataFrame indexed by (uid, iid).
+        """
+        if columns is None:
+            columns = self.columns
+        return pd.DataFrame(
+            {name: np.asarray(self._arrays[name][start:stop])
+             for name in columns},
+            index=self.get_index(start, stop),
+        )
+
+
+    def get_values(self, start=None, stop=None, columns=None, dtype=None):
+        """
+        Read rows [start, stop) into 2d array (rows x columns), same as
+        `get_frame(...).values` without building the frame.
+        """
+        if columns is None:
+            columns = self.columns
+        arrays = [self._arrays[name][start:stop] for name in columns]
+        if dtype is None:
+            dtype = np.result_type(*arrays)
+        n_rows = len(arrays[0]) if arrays else 0
+        values = np.empty((n_rows, len(columns)), dtype=dtype)
+        for i, array in enumerate(arrays):
+            values[:, i] = array
+        return values
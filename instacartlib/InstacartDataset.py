@@ -7,6 +7,7 @@ Capabilities:
 * Load raw data and preprocess.
 * Make train dataset.
 * Make test dataset.
+* Update dataframes for a subset of users (e.g. users with new orders).
 """
 
 from .Transactions import Transactions
@@ -18,6 +19,8 @@ from .transactions_utils import split_last_order
 from .Products import Products
 from .Products import _preprocess_raw_products
 from .utils import get_df_info, format_size, get_df_size_bytes
+from .Profiler import Profiler
+from .ranking import get_segments_positions
 
 import numpy as np
 import pandas as pd
@@ -60,6 +63,51 @@ def _preprocess_raw_transactions(df_raw, create_target=False,
     return (df_ord, df_trns, df_trns_target)
 
 
+def _add_order_r(df_ord, df_trns):
+    # cumcount starts from 0
+    order_r = (
+        df_ord
+        .set_index('order_id')
+        .groupby('uid')
+        .cumcount(ascending=False)
+    )
+    order_r += 1
+    order_r = order_r.astype('uint8').rename('order_r')
+    return df_trns.join(order_r, on='order_id')
+
+
+def _add_days_until_same_item(df_ord, df_trns):
+    order_days_until_target = get_order_days_until_target(df_ord)
+    df_trns_days_until_target = df_trns.join(order_days_until_target,
+        on='order_id')
+
+    srs_days_until_target = get_days_until_same_item(
+        df_trns_days_until_target)
+    return df_trns.join(srs_days_until_target)
+
+
+def _replace_users_rows(df, df_users, user_ids):
+    """
+    Drop rows of `user_ids` from `df` and append `df_users` instead.
+    """
+    return pd.concat([df[~df.uid.isin(user_ids)], df_users],
+        ignore_index=True)
+
+
+def _get_users_rows(df, user_ids, sorted_by_uid=False):
+    """
+    Rows of `df` with uid in `user_ids`. Binary search if `df` is sorted by
+    uid (cost depends on the number of users, not on `len(df)`).
+    """
+    if not sorted_by_uid:
+        return df[df.uid.isin(user_ids)]
+    uids = df.uid.values
+    user_ids = np.unique(np.asarray(user_ids))
+    starts = np.searchsorted(uids, user_ids, side='left')
+    stops = np.searchsorted(uids, user_ids, side='right')
+    return df.iloc[get_segments_positions(starts, stops - starts)]
+
+
 class InstacartDataset:
     """
     train : {False, True}
@@ -67,14 +115,21 @@ class InstacartDataset:
         prediction task. These orders will be available as `df_trns_target`.
     n_orders_limit: None or int
         Limit transactions to n most recent orders.
+    profiler: None or Profiler
+        Record "ingest.*" and "preprocess.*" stages.
     """
-    def __init__(self, train=False, n_orders_limit=None, verbose=0):
+    def __init__(self, train=False, n_orders_limit=None, verbose=0,
+            profiler=None):
         self.train = train
         self.n_orders_limit = n_orders_limit
         self.verbose = verbose
+        self.profiler = (Profiler(enabled=False) if profiler is None
+            else profiler)
 
-        self._transactions = Transactions(show_progress=self.verbose > 0)
-        self._products = Products(show_progress=self.verbose > 0)
+        self._transactions = Transactions(show_progress=self.verbose > 0,
+            profiler=self.profiler)
+        self._products = Products(show_progress=self.verbose > 0,
+            profiler=self.profiler)
 
         self.df_ord = pd.DataFrame()
         self.df_trns = pd.DataFrame()
@@ -89,6 +144,7 @@ class InstacartDataset:
         self.n_departments = 0
         self.n_users_target = 0
         self.n_items_target = 0
+        self._sorted_by_uid = {}
 
 
     def get_dataframes(self):
@@ -149,23 +205,31 @@ class InstacartDataset:
         self._print('Updating dynamic columns ...', indent=2)
         self._update_dynamic_columns()
         self._print('Updating stats ...', indent=2)
-        self._update_stats()
+        with self.profiler.stage('preprocess.stats'):
+            self._update_stats()
+        self._sorted_by_uid = {}
         return self
 
 
     def _preprocess_raw_transactions(self):
-        frames = _preprocess_raw_transactions(
-            self._transactions.df,
-            create_target=self.train,
-            n_orders_limit=self.n_orders_limit,
-            verbose=self.verbose,
-        )
-        (self.df_ord, self.df_trns, self.df_trns_target) = frames
+        with self.profiler.stage('preprocess.transactions',
+                rows_in=len(self._transactions.df)) as event:
+            frames = _preprocess_raw_transactions(
+                self._transactions.df,
+                create_target=self.train,
+                n_orders_limit=self.n_orders_limit,
+                verbose=self.verbose,
+            )
+            (self.df_ord, self.df_trns, self.df_trns_target) = frames
+            event.rows_out = len(self.df_trns) + len(self.df_trns_target)
 
 
     def _preprocess_raw_products(self):
-        self.df_prod = _preprocess_raw_products(self._products.df,
-            verbose=self.verbose)
+        with self.profiler.stage('preprocess.products',
+                rows_in=len(self._products.df)) as event:
+            self.df_prod = _preprocess_raw_products(self._products.df,
+                verbose=self.verbose)
+            event.rows_out = len(self.df_prod)
 
 
     def _update_dynamic_columns(self):
@@ -174,26 +238,71 @@ class InstacartDataset:
 
 
     def _update_order_r(self):
-        # cumcount starts from 0
-        order_r = (
-            self.df_ord
-            .set_index('order_id')
-            .groupby('uid')
-            .cumcount(ascending=False)
-        )
-        order_r += 1
-        order_r = order_r.astype('uint8').rename('order_r')
-        self.df_trns = self.df_trns.join(order_r, on='order_id')
+        with self.profiler.stage('preprocess.order_r',
+                rows_in=len(self.df_trns)) as event:
+            self.df_trns = _add_order_r(self.df_ord, self.df_trns)
+            event.rows_out = len(self.df_trns)
 
 
     def _update_days_until_same_item(self):
-        order_days_until_target = get_order_days_until_target(self.df_ord)
-        df_trns_days_until_target = self.df_trns.join(order_days_until_target,
-            on='order_id')
+        with self.profiler.stage('preprocess.days_until_same_item',
+                rows_in=len(self.df_trns)) as event:
+            self.df_trns = _add_days_until_same_item(self.df_ord,
+                self.df_trns)
+            event.rows_out = len(self.df_trns)
+
+
+    def update_users(self, user_ids):
+        """
+        Preprocess raw transactions of given users only and replace their
+        rows in `df_ord`, `df_trns` and `df_trns_target`. Preprocessing is
+        user-local, so the result is the same as after `read_dir`, but the
+        cost depends on the number of updated users.
+
+        Updated users' rows are moved to the end of the dataframes. Dataset
+        stats (see `info()`) are not updated.
+
+        user_ids: list-like
+            Users whose raw transactions have changed (see
+            `Transactions.append`).
+        """
+        df_raw = self._transactions.df
+        df_raw_users = df_raw[df_raw.user_id.isin(user_ids)]
+        with self.profiler.stage('preprocess.update_users',
+                rows_in=len(df_raw_users)) as event:
+            df_ord, df_trns, df_trns_target = _preprocess_raw_transactions(
+                df_raw_users,
+                create_target=self.train,
+                n_orders_limit=self.n_orders_limit,
+                verbose=self.verbose,
+            )
+            df_trns = _add_order_r(df_ord, df_trns)
+            df_trns = _add_days_until_same_item(df_ord, df_trns)
+
+            self.df_ord = _replace_users_rows(self.df_ord, df_ord, user_ids)
+            self.df_trns = _replace_users_rows(self.df_trns, df_trns,
+                user_ids)
+            if self.train:
+                self.df_trns_target = _replace_users_rows(
+                    self.df_trns_target, df_trns_target, user_ids)
+            event.rows_out = len(df_trns) + len(df_trns_target)
+        self._sorted_by_uid = {}
+        return self
+
 
-        srs_days_until_target = get_days_until_same_item(
-            df_trns_days_until_target)
-        self.df_trns = self.df_trns.join(srs_days_until_target)
+    def get_users_dataframes(self, user_ids):
+        """
+        Same as `dataframes`, but limited to rows of given users.
+        """
+        dataframes = self.get_dataframes()
+        for name, df in dataframes.items():
+            if 'uid' in df and name not in self._sorted_by_uid:
+                self._sorted_by_uid[name] = df.uid.is_monotonic_increasing
+        return {
+            name: (_get_users_rows(df, user_ids, self._sorted_by_uid[name])
+                   if 'uid' in df else df)
+            for name, df in dataframes.items()
+        }
 
 
     def info(self):
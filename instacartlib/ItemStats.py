@@ -0,0 +1,171 @@
+"""
+Item-level (global) statistics kept as histograms of user contributions.
+
+Capabilities:
+* Compute item features (`i_*`) exactly as feature extractors do, but from
+  histograms that can be summed across user shards and updated by delta
+  (subtract old user histories, add new ones).
+* Item features frame (`df_i`) can be passed to extractors along with a
+  subset of users' transactions to get the same values as for all users.
+
+Histograms:
+- orders_hist - index: (iid, n), value: number of users who bought item `iid`
+  exactly `n` times.
+- delays_hist - index: (iid, days_until_same_item), value: number of
+  transactions of item `iid` with given `days_until_same_item`.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _empty_hist(value_name):
+    index = pd.MultiIndex.from_arrays([[], []], names=['iid', value_name])
+    return pd.Series([], index=index, dtype='int64')
+
+
+def _add_hists(hist_a, hist_b, sign=1):
+    hist = hist_a.add(sign * hist_b, fill_value=0).astype('int64')
+    if (hist < 0).any():
+        raise ValueError('Histogram counts became negative: subtracted '
+            'statistics were not included into the base statistics.')
+    hist = hist[hist != 0]
+
+    # Index alignment may upcast levels (e.g. uint32 -> uint64)
+    hist_dtypes = hist_a if len(hist_a) > 0 else hist_b
+    hist.index = pd.MultiIndex.from_arrays([
+        hist.index.get_level_values(i).astype(
+            hist_dtypes.index.get_level_values(i).dtype)
+        for i in range(2)
+    ], names=hist_dtypes.index.names)
+    return hist
+
+
+def _median_from_hist(hist):
+    """
+    Median value per `iid` (level 0) from sorted histogram of values
+    (level 1). Even number of values gives the mean of two middle values, as
+    `pandas` median does.
+
+    Returns
+    -------
+    median: pd.Series
+        Index: iid
+        Value: float64
+    """
+    if len(hist) == 0:
+        return pd.Series([], index=pd.Index([], name='iid'), dtype='float64')
+    hist = hist.sort_index()
+    iids = hist.index.get_level_values(0).values
+    values = hist.index.get_level_values(1).values.astype('float64')
+    counts_cumsum = np.cumsum(hist.values)
+
+    starts = np.flatnonzero(np.r_[True, iids[1:] != iids[:-1]])
+    ends = np.r_[starts[1:], len(iids)]
+    n_before = np.r_[0, counts_cumsum][starts]
+    n_total = counts_cumsum[ends - 1] - n_before
+
+    pos_lo = np.searchsorted(counts_cumsum, n_before + (n_total - 1) // 2,
+        side='right')
+    pos_hi = np.searchsorted(counts_cumsum, n_before + n_total // 2,
+        side='right')
+    median = (values[pos_lo] + values[pos_hi]) / 2
+    return pd.Series(median, index=pd.Index(iids[starts], name='iid'))
+
+
+class ItemStats:
+    """
+    Accumulated item statistics. Use `ItemStats.from_df_trns(df_trns)` to
+    compute statistics for given transactions, `+` and `-` to combine
+    statistics of disjoint sets of users.
+
+    orders_hist: None or pd.Series
+    delays_hist: None or pd.Series
+        See module docstring.
+    """
+    def __init__(self, orders_hist=None, delays_hist=None):
+        if orders_hist is None:
+            orders_hist = _empty_hist('n')
+        if delays_hist is None:
+            delays_hist = _empty_hist('days_until_same_item')
+        self.orders_hist = orders_hist
+        self.delays_hist = delays_hist
+
+
+    @classmethod
+    def from_df_trns(cls, df_trns):
+        """
+        df_trns: DataFrame
+            Required columns (3): uid, iid, days_until_same_item
+        """
+        orders_hist = (
+            df_trns
+            .value_counts(['uid', 'iid'], sort=False)
+            .rename('n')
+            .reset_index()
+            .value_counts(['iid', 'n'], sort=False)
+            .astype('int64')
+        )
+        delays_hist = (
+            df_trns
+            .value_counts(['iid', 'days_until_same_item'], sort=False)
+            .astype('int64')
+        )
+        return cls(orders_hist, delays_hist)
+
+
+    def __add__(self, other):
+        return ItemStats(
+            _add_hists(self.orders_hist, other.orders_hist),
+            _add_hists(self.delays_hist, other.delays_hist),
+        )
+
+
+    def __sub__(self, other):
+        return ItemStats(
+            _add_hists(self.orders_hist, other.orders_hist, sign=-1),
+            _add_hists(self.delays_hist, other.delays_hist, sign=-1),
+        )
+
+
+    def __repr__(self):
+        n_items = self.orders_hist.index.get_level_values('iid').nunique()
+        return f'<{self.__class__.__name__} items={n_items}>'
+
+
+    def get_features(self, iids=None):
+        """
+        iids: None or list-like
+            Compute features only for given items (faster than for all
+            items, e.g. for a few users' items).
+
+        Returns
+        -------
+        df_i: DataFrame
+            Index: iid
+            Columns (3): i_n_popularity, i_n_orders_mid,
+                i_days_delay_global_mid
+        """
+        orders_hist = self.orders_hist
+        delays_hist = self.delays_hist
+        if iids is not None:
+            orders_hist = orders_hist[
+                orders_hist.index.get_level_values(0).isin(iids)]
+            delays_hist = delays_hist[
+                delays_hist.index.get_level_values(0).isin(iids)]
+
+        i_n_popularity = (
+            orders_hist
+            .groupby(level='iid')
+            .sum()
+            .astype('uint32')
+        )
+        i_n_orders_mid = _median_from_hist(orders_hist).astype('float32')
+        i_days_delay_global_mid = (
+            _median_from_hist(delays_hist).astype('float32'))
+        return pd.DataFrame({
+            'i_n_popularity': i_n_popularity,
+            'i_n_orders_mid': i_n_orders_mid,
+            'i_days_delay_global_mid': i_days_delay_global_mid,
+        })
+
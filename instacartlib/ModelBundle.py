@@ -0,0 +1,308 @@
+"""
+Self-describing model file: estimator with everything needed to use it.
+
+Capabilities:
+* Keep the estimator with its `FeatureScaler` or `FeatureQuantizer`, the
+  exact list of features (name, dtype, extractor) in model's order,
+  versions of feature extractors (hashes of their source code) and a
+  fingerprint of the training data.
+* Save as one uncompressed joblib file, so numpy arrays inside it can be
+  memory-mapped at load (`mmap_mode='r'`): processes loading the same file
+  share one copy of the pages and startup doesn't copy arrays.
+* Schema checks before scoring (missing features, changed dtypes, changed
+  extractors) and features matrix in model's columns order: extra features
+  are ignored, only extractors the model needs can be used (pruning, see
+  `FeaturesDataset.use_feature_extractors`).
+* Loads previous formats: bare estimator (`joblib.dump(model)`) and
+  {'model': ..., 'scaler': ...} dict, schema is unknown for them.
+* Compiled model (`compile`): gradient boosting as numpy arrays
+  (`TreeEnsemble`), faster batch scoring, identical predictions.
+"""
+
+from .TreeEnsemble import TreeEnsemble
+from .utils import drop_duplicates
+
+import hashlib
+import inspect
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+
+FORMAT_NAME = 'instacartlib.ModelBundle'
+FORMAT_VERSION = 1
+
+
+def _get_extractor_function(function):
+    """ Unwrap `DataFrameFileCache` (bound `wrapper`) and decorators. """
+    function = getattr(getattr(function, '__self__', None), '__wrapped__',
+        function)
+    return inspect.unwrap(function)
+
+
+def get_extractors_versions(feature_extractors):
+    """
+    feature_extractors: dict
+        {extractor name: function}, see `FeaturesDataset`.
+
+    Returns
+    -------
+    versions: dict
+        {extractor name: sha256 of extractor's module source (first 16 hex
+        digits)}, None if source isn't available.
+    """
+    versions = {}
+    for name, function in feature_extractors.items():
+        function = _get_extractor_function(function)
+        try:
+            module = inspect.getmodule(function)
+            source = inspect.getsource(module or function)
+        except (OSError, TypeError):
+            versions[name] = None
+            continue
+        versions[name] = hashlib.sha256(source.encode()).hexdigest()[:16]
+    return versions
+
+
+def get_data_fingerprint(df_ui, target='ui_in_target'):
+    """
+    df_ui: DataFrame
+        Train features indexed by (uid, iid).
+
+    Returns
+    -------
+    fingerprint: dict
+        Sizes, positive rate and sha256 of (uid, iid, target) arrays.
+    """
+    uids = df_ui.index.get_level_values('uid').values
+    iids = df_ui.index.get_level_values('iid').values
+    hash_algo = hashlib.sha256()
+    for array in [uids, iids]:
+        hash_algo.update(np.ascontiguousarray(array, dtype='int64').data)
+    fingerprint = {
+        'n_rows': len(df_ui),
+        'n_users': int(len(np.unique(uids))),
+        'n_items': int(len(np.unique(iids))),
+    }
+    if target in df_ui:
+        y = df_ui[target].values
+        hash_algo.update(np.ascontiguousarray(y, dtype='uint8').data)
+        fingerprint['positive_rate'] = float(y.mean()) if len(y) else 0.
+    fingerprint['sha256'] = hash_algo.hexdigest()
+    return fingerprint
+
+
+class ModelBundle:
+    """
+    model: estimator
+    scaler: None or FeatureScaler
+    quantizer: None or FeatureQuantizer
+        Model is fitted on uint8 bin codes of features.
+    features: None or list of (name, dtype, extractor)
+        Model's features in the order of its input columns (None - unknown,
+        columns of scored frames are used as they are).
+    extractors: None or dict
+        {extractor name: version}, see `get_extractors_versions`.
+    fingerprint: None or dict
+        See `get_data_fingerprint`.
+    """
+    def __init__(self, model, scaler=None, features=None, extractors=None,
+            fingerprint=None, created_at=None, quantizer=None):
+        self.model = model
+        self.scaler = scaler
+        self.quantizer = quantizer
+        self.features = (None if features is None
+            else [tuple(feature) for feature in features])
+        self.extractors = extractors
+        self.fingerprint = fingerprint
+        self.created_at = time.time() if created_at is None else created_at
+
+
+    def __repr__(self):
+        n_features = '?' if self.features is None else len(self.features)
+        return (f'<{self.__class__.__name__} '
+                f'model={self.model.__class__.__name__} '
+                f'features={n_features}>')
+
+
+    @classmethod
+    def from_features(cls, model, df_ui, feature_registry=None,
+            feature_extractors=None, scaler=None, target='ui_in_target',
+            quantizer=None):
+        """
+        Bundle for `model` trained on `df_ui` (features + `target`).
+
+        feature_registry: None or dict
+            {feature name: extractor name}, see `FeaturesDataset`.
+        feature_extractors: None or dict
+            {extractor name: function} to record versions of.
+        """
+        feature_registry = feature_registry or {}
+        features = [
+            (name, str(dtype), feature_registry.get(name))
+            for name, dtype in df_ui.dtypes.items() if name != target
+        ]
+        extractors = None
+        if feature_extractors is not None:
+            used = {extractor for _, _, extractor in features}
+            extractors = get_extractors_versions({name: function
+                for name, function in feature_extractors.items()
+                if name in used})
+        return cls(model, scaler=scaler, features=features,
+            extractors=extractors,
+            fingerprint=get_data_fingerprint(df_ui, target),
+            quantizer=quantizer)
+
+
+    @property
+    def feature_names(self):
+        if self.features is None:
+            return None
+        return [name for name, _, _ in self.features]
+
+
+    @property
+    def extractor_names(self):
+        """ Extractors producing model's features (None if unknown). """
+        if self.features is None or any(
+                extractor is None for _, _, extractor in self.features):
+            return None
+        return drop_duplicates(extractor for _, _, extractor in self.features)
+
+
+    def to_dict(self):
+        return {
+            'format': FORMAT_NAME,
+            'format_version': FORMAT_VERSION,
+            'model': self.model,
+            'scaler': self.scaler,
+            'quantizer': self.quantizer,
+            'features': self.features,
+            'extractors': self.extractors,
+            'fingerprint': self.fingerprint,
+            'created_at': self.created_at,
+        }
+
+
+    def save(self, path):
+        """ Uncompressed (arrays can be memory-mapped at load). """
+        joblib.dump(self.to_dict(), path)
+        return self
+
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        mmap_mode: None or {'r', 'c'}
+            Memory-map numpy arrays of the file (see `joblib.load`). Ignored
+            for compressed files.
+        """
+        with warnings.catch_warnings():
+            # Compressed files (pretrained models) are loaded without mmap
+            warnings.filterwarnings('ignore', message='.*mmap_mode.*',
+                category=UserWarning)
+            obj = joblib.load(path, mmap_mode=mmap_mode)
+        return cls.from_object(obj)
+
+
+    @classmethod
+    def from_object(cls, obj):
+        """ Bundle from a loaded object of any supported format. """
+        if isinstance(obj, cls):
+            return obj
+        if not isinstance(obj, dict):
+            return cls(obj)
+        if obj.get('format') != FORMAT_NAME:
+            return cls(obj['model'], scaler=obj.get('scaler'))
+        if obj['format_version'] > FORMAT_VERSION:
+            raise ValueError(f'Model bundle format version '
+                f'{obj["format_version"]} is newer than supported '
+                f'({FORMAT_VERSION}). Update instacartlib.')
+        return cls(obj['model'], scaler=obj['scaler'],
+            features=obj['features'], extractors=obj['extractors'],
+            fingerprint=obj['fingerprint'], created_at=obj['created_at'],
+            quantizer=obj.get('quantizer'))
+
+
+    def check_features(self, df_ui):
+        """
+        Raise ValueError if any of model's features is missing in `df_ui` or
+        has a different dtype.
+        """
+        if self.features is None:
+            return
+        missing = [name for name, _, _ in self.features if name not in df_ui]
+        if missing:
+            raise ValueError(f'Features missing for the model: {missing}')
+        dtypes = df_ui.dtypes
+        changed = [
+            f'{name}: {dtype} -> {dtypes[name]}'
+            for name, dtype, _ in self.features
+            if str(dtypes[name]) != dtype
+        ]
+        if changed:
+            raise ValueError(f'Features dtypes differ from the model\'s: '
+                f'{changed}')
+
+
+    def check_extractors(self, feature_extractors):
+        """
+        Warn if extractors the model was trained with have changed (their
+        features may have different meaning now).
+
+        Returns
+        -------
+        changed: list of str
+            Names of changed or missing extractors.
+        """
+        if self.extractors is None:
+            return []
+        versions = get_extractors_versions({name: function
+            for name, function in feature_extractors.items()
+            if name in self.extractors})
+        changed = [name for name, version in self.extractors.items()
+            if versions.get(name, 'missing') != version]
+        if changed:
+            warnings.warn(f'Feature extractors changed since the model was '
+                f'trained: {changed}')
+        return changed
+
+
+    def compile(self):
+        """
+        Bundle of the same model compiled to `TreeEnsemble` (see
+        `TreeEnsemble.from_sklearn` for supported models).
+        """
+        if isinstance(self.model, TreeEnsemble):
+            return self
+        return self.with_model(TreeEnsemble.from_sklearn(self.model))
+
+
+    def with_model(self, model):
+        """ Same bundle with a model making the same kind of predictions
+        (e.g. compiled or approximate version of the model). """
+        return self.__class__(model, scaler=self.scaler,
+            features=self.features, extractors=self.extractors,
+            fingerprint=self.fingerprint, created_at=self.created_at,
+            quantizer=self.quantizer)
+
+
+    def get_x(self, df_ui):
+        """
+        Returns
+        -------
+        x: np.ndarray
+            Features matrix in model's columns order (scaled, if the bundle
+            has a scaler, uint8 bin codes if it has a quantizer).
+        """
+        self.check_features(df_ui)
+        if self.quantizer is not None:
+            return self.quantizer.transform(df_ui)
+        if self.scaler is not None:
+            return self.scaler.transform(df_ui)
+        names = self.feature_names
+        if names is None or list(df_ui.columns) == names:
+            return df_ui.values
+        return df_ui[names].values
@@ -9,7 +9,45 @@ Capabilities:
 5. Model train.
 6. Model save load.
 7. Predict products for given user ids.
-8. Write predictions to csv file.
+8. Write predictions to csv file (or Parquet, Feather, npz).
+9. Refresh predictions incrementally for users with new orders.
+10. Per-stage timing and memory instrumentation (`nbp.profiler`).
+11. Memory-bounded scoring in user-aligned chunks, top-K products per user.
+12. Lazy mode (`load_model(lazy=True)`): features and predictions of
+    requested users only, memoised (the dataset is still read and
+    preprocessed in full, once).
+13. Thread-safe reads with hot model swap: `get_predictions` reads one
+    immutable `ServingState` snapshot (no locks), new models / predictions
+    are built off to the side and published atomically.
+14. Cold start (`get_predictions(cold_start=True)`): users without
+    predictions (e.g. new users) get popular products, optionally
+    conditioned on a partial cart (see `PopularProducts.recommend`).
+15. Features scaling (`scale_features=True`) fitted on train features and
+    saved with the model (`FeatureScaler`), applied chunk by chunk at
+    predict time.
+16. Self-describing model files (`ModelBundle`): features schema checked
+    before scoring, only extractors the model needs are used, arrays are
+    memory-mapped at load.
+17. Warm restart: `save_snapshot` / `load_snapshot` write and reopen the
+    whole prepared state (see `snapshot`) without reading CSV files,
+    preprocessing, extracting features or scoring.
+18. Compiled model (`compile_model`): gradient boosting scored as numpy
+    arrays (`TreeEnsemble`), faster, identical predictions.
+19. Approximate early-exit scoring (`update_predictions(early_exit_margin)`)
+    with accuracy / top-10 agreement report against full scoring
+    (`get_early_exit_report`).
+20. Distillation (`distill_model`): compact student model fitted on the
+    model's probabilities, saved as a regular model, with a report of
+    accuracy and top-10 agreement vs the model.
+21. Features quantization (`quantize_features=True`): model is fitted and
+    scored on uint8 bin codes of features (`FeatureQuantizer`).
+22. Negative downsampling (`negative_rate`): model is fitted on all
+    positive and a share of negative rows of every user, its probabilities
+    are corrected back (`sampling.DownsampledModel`), with a report of
+    accuracy and top-10 impact (`get_negative_sampling_report`).
+23. Real-time predictions for an order history, e.g. with a fresh basket
+    (`get_history_predictions`): features computed from the history alone
+    (`UserHistory`), no dataframes pipeline.
 """
 
 """
@@ -41,19 +79,39 @@ predicted_item_ids = nbp.predict(user_ids=[...])
 
 from instacartlib import InstacartDataset
 from instacartlib import FeaturesDataset
-from .utils import format_size, hash_for_file, download_from_info
-
+from .FeatureQuantizer import FeatureQuantizer
+from .FeatureScaler import FeatureScaler
+from .ItemStats import ItemStats
+from .distillation import distill
+from .ModelBundle import ModelBundle
+from .Profiler import Profiler
+from .PopularProducts import PopularProducts
+from .PredictionsStore import PredictionsStore
+from .ProductCatalog import ProductCatalog
+from .ServingState import ServingState
+from .snapshot import save_snapshot, load_snapshot
+from .predictions_export import write_predictions_csv, get_format
+from .predictions_export import write_predictions_parquet
+from .predictions_export import write_predictions_feather
+from .predictions_export import write_predictions_npz
+from .ranking import TopKAccumulator, select_top_k, get_top_k_agreement
+from .ranking import get_chunks_bounds, get_segments_offsets
+from .UserHistory import UserHistory
+from .sampling import DownsampledModel, get_negative_sample_mask
+from .sampling import get_negative_rate, get_negative_sampling_report
+from .utils import format_size, download_from_info
+
+import copy
 from pathlib import Path
+import threading
+import time
 
 import numpy as np
 import pandas as pd
-import joblib
 
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import GradientBoostingClassifier
 
-from tqdm import tqdm
-
 
 class GBC_MODEL_DOWNLOAD_INFO:
     NAME = "gbc__shape_3451744_21.dump"  # 176KB
@@ -86,23 +144,126 @@ def _download_pretrained_model(id, path_dir='./instacart_pretrained_model',
 
 def _update_datasets(instacart_dataset, features_dataset, path_dir):
     instacart_dataset.read_dir(path_dir)
+    features_dataset.clear_features()
     features_dataset.extract_features(**instacart_dataset.dataframes)
 
 
+def _add_cold_start(predictions, user_ids, iids):
+    """
+    predictions: DataFrame
+        Columns (3): uid, iid, in_target_prob. Sorted by uid.
+    iids: np.ndarray
+        Products for every user of `user_ids` missing in `predictions`.
+
+    Returns
+    -------
+    predictions: DataFrame
+        Sorted by uid.
+    """
+    uid_dtype = predictions.uid.dtype
+    missing = np.setdiff1d(np.asarray(user_ids, dtype='int64'),
+        predictions.uid.values.astype('int64'))
+    if len(missing) == 0 or len(iids) == 0:
+        return predictions
+    predictions = pd.concat([
+        predictions,
+        pd.DataFrame({
+            'uid': np.repeat(missing, len(iids)).astype(uid_dtype),
+            'iid': np.tile(iids, len(missing)).astype(
+                predictions.iid.dtype),
+            'in_target_prob': np.full(len(missing) * len(iids), np.nan,
+                dtype=predictions.in_target_prob.dtype),
+        }),
+    ], ignore_index=True)
+    order = np.argsort(predictions.uid.values, kind='stable')
+    return predictions.iloc[order].reset_index(drop=True)
+
+
 class NextBasketPrediction:
-    def __init__(self, model=None, scale_features=False, verbose=0):
+    """
+    model: None or estimator
+        Scikit-learn-compatible classifier. If None, untrained
+        `GradientBoostingClassifier` is used.
+    scale_features: {False, True}
+        Standardize features before fitting: a `FeatureScaler` is fitted on
+        train features, saved with the model (`self.scaler`) and used for
+        every prediction with this model.
+    quantize_features: {False, True}
+        Fit and score the model on uint8 bin codes of features: bin edges
+        are fitted on train features (`FeatureQuantizer`, saved with the
+        model as `self.quantizer`). Stored features stay float, codes are
+        built from them for every fitting and scoring call (an extra uint8
+        matrix, no memory is saved). Compiled models score codes with
+        integer thresholds (see `TreeEnsemble`), sklearn models convert
+        them to float32.
+    negative_rate: None or float
+        Fit the model on all positive rows and `negative_rate` share of
+        negative rows of every user (all rows if None). Fitting is about
+        `1 / negative_rate` times faster, the fitted model is wrapped in
+        `DownsampledModel` to keep probabilities calibrated. See
+        `get_negative_sampling_report` to choose the rate.
+    verbose: int
+        If verbose > 0 print additional information.
+    profiler: None or Profiler
+        Records every stage of the pipeline (see `Profiler`). If None, a new
+        profiler is created (available as `self.profiler`), it keeps the
+        last `Profiler.max_events` events only.
+    chunk_size: None or int
+        Score features in user-aligned chunks of about `chunk_size` rows
+        (all rows at once if None), so scores of all candidates are never
+        held in memory at the same time.
+    top_k: None or int
+        Keep only `top_k` most probable products per user in predictions
+        (all candidates if None). Users with less than 10 predictions get
+        popular products added, so values below 10 change predictions.
+
+    `train_model` and `load_model` set `self.model_bundle` (see
+    `ModelBundle`): the model with its features list, scaler, extractors
+    versions and training data fingerprint, saved by `save_model`.
+    `compile_model` keeps the model as is and sets `self.compiled_bundle`,
+    which is served and saved instead until the model changes.
+
+    Predictions are kept in `self.predictions_store` (see
+    `PredictionsStore`), `self.predictions` is a frame built from it.
+
+    Serving model, predictions and product names are published together as
+    an immutable snapshot `self.state` (see `ServingState`). Methods
+    changing them (`load_model`, `update_predictions`, `refresh_users`,
+    `add_transactions`) are serialized with a lock and publish a new
+    snapshot when it's complete, so `get_predictions` can be called from
+    other threads meanwhile.
+    """
+    def __init__(self, model=None, scale_features=False, verbose=0,
+            profiler=None, chunk_size=None, top_k=None,
+            quantize_features=False, negative_rate=None):
+        if scale_features and quantize_features:
+            raise ValueError('Use either `scale_features` or '
+                '`quantize_features` (scaling doesn\'t change bin codes).')
+        if negative_rate is not None and not 0 < negative_rate <= 1:
+            raise ValueError(f'negative_rate expected to be in (0, 1], '
+                f'got: {negative_rate}')
         self.scale_features = scale_features
+        self.quantize_features = quantize_features
+        self.negative_rate = negative_rate
+        self.chunk_size = chunk_size
+        self.top_k = top_k
         self.verbose = verbose
+        self.profiler = Profiler() if profiler is None else profiler
 
         self.icds_train = InstacartDataset(train=True, n_orders_limit=5,
-            verbose=self.verbose)
+            verbose=self.verbose, profiler=self.profiler)
         self.icds_predict = InstacartDataset(train=False, n_orders_limit=5,
-            verbose=self.verbose)
+            verbose=self.verbose, profiler=self.profiler)
         self.features_train = FeaturesDataset(features_cache_dir=None,
-            verbose=self.verbose)
+            verbose=self.verbose, profiler=self.profiler)
         self.features_predict = FeaturesDataset(features_cache_dir=None,
-            verbose=self.verbose)
-        self.predictions = pd.DataFrame()
+            verbose=self.verbose, profiler=self.profiler)
+        self._state = ServingState()
+        self._write_lock = threading.RLock()
+        self.popular_products = None
+        self.lazy = False
+        self._lazy_loaded = False
+        self._lazy_user_ids = set()
 
         if model is None:
             self.model = GradientBoostingClassifier(verbose=self.verbose)
@@ -110,6 +271,12 @@ class NextBasketPrediction:
         else:
             self.model = model
             self._model_trained = True
+        self.scaler = None
+        self.quantizer = None
+        self.model_bundle = None
+        self.compiled_bundle = None
+        self._compiled_bundle_source = None
+        self.student_bundle = None
 
         self.path_dir = None
         self._update_trainset_needed = True
@@ -120,6 +287,28 @@ class NextBasketPrediction:
         return f'<{self.__class__.__name__} model={self.model}>'
 
 
+    @property
+    def state(self):
+        """ Current `ServingState` snapshot. """
+        return self._state
+
+
+    def _publish(self, **changes):
+        """ Replace the snapshot (single assignment - atomic for readers). """
+        with self._write_lock:
+            self._state = self._state.replace(**changes)
+
+
+    @property
+    def predictions_store(self):
+        return self._state.predictions_store
+
+
+    @predictions_store.setter
+    def predictions_store(self, store):
+        self._publish(predictions_store=store)
+
+
     def _print(self, message, indent=0):
         if self.verbose > 0:
             message = str(message)
@@ -133,44 +322,198 @@ class NextBasketPrediction:
         self.path_dir = path_dir
         self._update_trainset_needed = True
         self._update_predictset_needed = True
+        self._lazy_loaded = False
+        self._lazy_user_ids = set()
         return self
 
 
     def train_model(self):
+        """
+        Fit `self.model`. Served predictions don't change until the model is
+        published with `update_predictions()`.
+
+        A model that can't be fitted (compiled model of a snapshot or a model
+        file, e.g. a distilled student) is replaced with an untrained
+        `GradientBoostingClassifier`.
+        """
         if self.path_dir is None:
             raise ValueError('Model needs data to be trainded on. '
                 'Use `.add_data(path_dir)` to set path to directory with data.')
 
         self._extract_features_for_train()
-        x_train, x_val, y_train, y_val = self._get_xy_train_split()
-
-        self.model.fit(x_train, y_train)
+        with self.profiler.stage('train.split') as event:
+            (x_train, x_val, y_train, y_val, scaler, quantizer,
+                negative_rate) = self._get_xy_train_split()
+            event.rows_out = len(x_train)
+
+        model = self._get_model_to_fit()
+        with self.profiler.stage('train.fit', rows_in=len(x_train)):
+            model.fit(x_train, y_train)
+        if negative_rate is not None:
+            model = DownsampledModel(model, negative_rate)
+        self.model = model
+        self.scaler = scaler
+        self.quantizer = quantizer
+        self.model_bundle = ModelBundle.from_features(model,
+            self.features_train.df_ui,
+            feature_registry=self.features_train._feature_registry,
+            feature_extractors=self.features_train.feature_extractors,
+            scaler=scaler, quantizer=quantizer)
         self._model_trained = True
 
         self._print_models_accuracy(x_val, y_val)
         return self
 
 
+    def distill_model(self, path=None, student=None, holdout=.1,
+            n_limit=10):
+        """
+        Fit a compact student on the model's (teacher's) probabilities over
+        train features, see `distillation.distill`. The model isn't
+        replaced: the student is kept as `self.student_bundle`.
+
+        path: None or str
+            Save the student (load it with `.load_model(path=path)`).
+        student: None or sklearn.ensemble.GradientBoostingRegressor
+            Unfitted regressor of log-odds (shallow trees by default).
+        holdout: float
+            Share of train users left out for the report.
+
+        Returns
+        -------
+        report: DataFrame
+            Teacher vs student on held-out users (see `distill`).
+        """
+        if self._model_trained == False:
+            raise ValueError('Model has to be trained to be distilled. '
+                'Use `.train_model()` or `.load_model(path)`.')
+        if self.path_dir is None:
+            raise ValueError('Model needs data to be distilled on. '
+                'Use `.add_data(path_dir)` to set path to directory with data.')
+
+        self._extract_features_for_train()
+        with self.profiler.stage('train.distill',
+                rows_in=len(self.features_train.df_ui)):
+            self.student_bundle, report = distill(self._get_model_bundle(),
+                self.features_train.df_ui, student=student, holdout=holdout,
+                n_limit=n_limit)
+        if path is not None:
+            self.student_bundle.save(path)
+        self._print(report)
+        return report
+
+
+    def _get_model_to_fit(self):
+        """ Estimator to fit in place of `self.model` (unwrapped from
+        `DownsampledModel`, a copy if the model is published). """
+        model = self.model
+        if model is self._state.model:
+            # Published model may be in use, fit a copy
+            model = copy.deepcopy(model)
+        if isinstance(model, DownsampledModel):
+            model = model.model
+        if not hasattr(model, 'fit'):
+            self._print(f'{model.__class__.__name__} can\'t be fitted '
+                '(compiled model), untrained GradientBoostingClassifier is '
+                'used instead.')
+            model = GradientBoostingClassifier(verbose=self.verbose)
+        return model
+
+
     def _extract_features_for_train(self):
         # Preprocess raw transactions for train (if not already)
         # Update self.features_train
         if self._update_trainset_needed:
-            _update_datasets(self.icds_train, self.features_train,
-                self.path_dir)
+            with self.profiler.stage('dataset.train'):
+                _update_datasets(self.icds_train, self.features_train,
+                    self.path_dir)
             self._update_trainset_needed = False
 
 
-    def _get_xy_train_split(self):
-        x = self.features_train.df_ui.drop(columns='ui_in_target').values
-        y = self.features_train.df_ui['ui_in_target'].values
-
+    def _get_xy_train(self):
+        """
+        Returns
+        -------
+        x, y: np.ndarray
+            All train features and target.
+        scaler: None or FeatureScaler
+            Fitted on all train features if `self.scale_features`.
+        quantizer: None or FeatureQuantizer
+            Fitted on all train features if `self.quantize_features` (then
+            `x` is uint8 bin codes).
+        """
+        df_ui = self.features_train.df_ui
+        y = df_ui['ui_in_target'].values
+        columns = df_ui.columns.drop('ui_in_target')
+        scaler = quantizer = None
         if self.scale_features:
-            x_std = x.std(axis=0)
-            x_std[x_std < 1e-6] = 1.
-            x_mean = x.mean(axis=0)
-            x = (x - x_mean) / x_std
+            scaler = FeatureScaler().fit(df_ui, columns=columns)
+            x = scaler.transform(df_ui)
+        elif self.quantize_features:
+            quantizer = FeatureQuantizer().fit(df_ui, columns=columns)
+            x = quantizer.transform(df_ui)
+        else:
+            x = df_ui.drop(columns='ui_in_target').values
+        return x, y, scaler, quantizer
 
-        return train_test_split(x, y, test_size=.01, stratify=y)
+
+    def _get_xy_train_split(self):
+        """
+        Returns
+        -------
+        x_train, x_val, y_train, y_val: np.ndarray
+            Train rows are downsampled if `self.negative_rate` is set
+            (validation rows are not).
+        scaler, quantizer:
+            See `_get_xy_train`.
+        negative_rate: None or float
+            Share of negative train rows kept (None - no sampling).
+        """
+        x, y, scaler, quantizer = self._get_xy_train()
+        uids = self.features_train.df_ui.index.get_level_values('uid').values
+        x_train, x_val, y_train, y_val, uids_train, _ = train_test_split(
+            x, y, uids, test_size=.01, stratify=y)
+        negative_rate = None
+        if self.negative_rate is not None:
+            mask = get_negative_sample_mask(uids_train, y_train,
+                self.negative_rate)
+            negative_rate = get_negative_rate(y_train, mask)
+            x_train, y_train = x_train[mask], y_train[mask]
+        return (x_train, x_val, y_train, y_val, scaler, quantizer,
+            negative_rate)
+
+
+    def get_negative_sampling_report(self, negative_rates=(.5, .25, .1),
+            holdout=.1, n_limit=10):
+        """
+        Fit copies of the (unfitted) model on train features with all
+        negative rows and with each of `negative_rates` of them, score
+        held-out users (see `sampling.get_negative_sampling_report`).
+        Nothing is published, `self.model` isn't changed. The model is
+        chosen as in `train_model`.
+
+        Returns
+        -------
+        report: DataFrame
+            One row per rate: fitting time and speedup, accuracy, log loss,
+            calibration, top-`n_limit` recall and agreement with no
+            sampling.
+        """
+        if self.path_dir is None:
+            raise ValueError('Model needs data to be trained on. '
+                'Use `.add_data(path_dir)` to set path to directory with data.')
+
+        self._extract_features_for_train()
+        model = self._get_model_to_fit()
+        with self.profiler.stage('train.sampling_report',
+                rows_in=len(self.features_train.df_ui)):
+            x, y, _, _ = self._get_xy_train()
+            uids = self.features_train.df_ui.index.get_level_values(
+                'uid').values
+            report = get_negative_sampling_report(model, x, y, uids,
+                negative_rates, holdout=holdout, n_limit=n_limit)
+        self._print(report)
+        return report
 
 
     def _print_models_accuracy(self, x_val, y_val):
@@ -180,11 +523,65 @@ class NextBasketPrediction:
 
 
     def save_model(self, path):
-        joblib.dump(self.model, path)
+        """ Save `ModelBundle` of the model (see `ModelBundle.save`). """
+        self._get_model_bundle().save(path)
+        return self
+
+
+    def save_snapshot(self, path_dir):
+        """
+        Write prepared state (data, features, predictions, model) to
+        directory of memory-mappable files, see `snapshot`.
+        """
+        save_snapshot(self, path_dir)
+        return self
+
+
+    def load_snapshot(self, path_dir, mmap_mode='r'):
+        """
+        Reopen state written by `save_snapshot` (replaces `add_data` +
+        `load_model`): nothing is parsed or computed, predictions are served
+        right away. Training data is read from the snapshot's data
+        directory (if it still exists) when needed.
+        """
+        return load_snapshot(self, path_dir, mmap_mode)
+
+
+    def _get_model_bundle(self):
+        """ Bundle of `self.model` (features schema unknown if the model
+        wasn't trained or loaded here), its compiled version if
+        `compile_model` was called for it. """
+        bundle = self.model_bundle
+        if bundle is None or bundle.model is not self.model:
+            bundle = self.model_bundle = ModelBundle(self.model,
+                scaler=self.scaler, quantizer=self.quantizer)
+        if (self.compiled_bundle is not None
+                and self._compiled_bundle_source is bundle):
+            return self.compiled_bundle
+        return bundle
+
+
+    def compile_model(self):
+        """
+        Serve the model compiled (`TreeEnsemble`, kept as
+        `self.compiled_bundle`): identical probabilities, faster scoring,
+        saved model is loaded without sklearn. Published predictions are
+        kept (they don't change). `self.model` isn't replaced, so it can be
+        retrained (the retrained model isn't compiled).
+        """
+        with self._write_lock:
+            source = self._get_model_bundle()
+            if source is self.compiled_bundle:
+                return self
+            bundle = source.compile()
+            self.compiled_bundle = bundle
+            self._compiled_bundle_source = source
+            if self._state.model is source.model:
+                self._publish(model=bundle.model, bundle=bundle)
         return self
 
 
-    def load_model(self, id='gbc', path=None):
+    def load_model(self, id='gbc', path=None, lazy=False, mmap_mode='r'):
         """
         id: {'gbc', 'catboost'}
             Automatically download and use one of pretrained models. `id` is
@@ -193,6 +590,23 @@ class NextBasketPrediction:
             (use `pip install catboost` to install).
         path: str
             Load model from save file (created with `.save_model()`).
+        lazy: {False, True}
+            Don't make predictions for all users. `get_predictions` computes
+            features and predictions of requested users only and memoises
+            them (use `.update_predictions()` to predict for all users).
+            The first `get_predictions` call still reads and preprocesses
+            the whole dataset and computes item statistics of all
+            transactions (features of the requested users depend on them),
+            so it costs about as much as the preprocessing of a full
+            `update_predictions`. Scoring is what is saved.
+        mmap_mode: None or {'r', 'c'}
+            Memory-map arrays of the model file (see `ModelBundle.load`).
+
+        Only feature extractors the model needs are used, features schema
+        is checked before predicting (see `ModelBundle`).
+
+        Hot swap: previous model and its predictions are served until the
+        new model's predictions are complete (or if loading fails).
         """
         if self.path_dir is None:
             raise ValueError('Model needs data to make predictions. '
@@ -202,58 +616,307 @@ class NextBasketPrediction:
             path = _download_pretrained_model(id,
                 show_progress=self.verbose > 0)
 
-        self.model = joblib.load(path)
-        self._model_trained = True
+        bundle = ModelBundle.load(path, mmap_mode=mmap_mode)
+        with self._write_lock:
+            self._use_model_features(bundle)
+            if lazy:
+                self.lazy = True
+                self._lazy_loaded = False
+                self._lazy_user_ids = set()
+                self._publish(model=bundle.model, bundle=bundle,
+                    predictions_store=PredictionsStore.empty())
+            else:
+                self._update_predictions(bundle)
+            self.model = bundle.model
+            self.scaler = bundle.scaler
+            self.quantizer = bundle.quantizer
+            self.model_bundle = bundle
+            self._model_trained = True
+        return self
+
 
-        self.update_predictions()
+    def update_predictions(self, early_exit_margin=None,
+            early_exit_every=None):
+        """
+        early_exit_margin: None or float
+            Approximate scoring: stages of a compiled copy of the model are
+            scored in blocks and rows stop once their |log-odds| reaches the
+            margin (see `TreeEnsemble.with_early_exit`). The approximate
+            model is served until the next model update. See
+            `get_early_exit_report` to choose the margin.
+        early_exit_every: None or int
+            Stages between early exit checks (`TreeEnsemble` default if
+            None).
+        """
+        with self._write_lock:
+            bundle = self._get_model_bundle()
+            if early_exit_margin is not None:
+                bundle = bundle.compile()
+                bundle = bundle.with_model(
+                    bundle.model.with_early_exit(early_exit_margin,
+                        early_exit_every))
+            self._update_predictions(bundle)
         return self
 
 
-    def update_predictions(self):
-        self._extract_features_for_prediction()
-        x_pred = self._get_x_pred()
-        y_prob = self.model.predict_proba(x_pred)[:, 1]
+    def get_early_exit_report(self, margins=(1., 2., 3., 4.), n_limit=10,
+            every=None):
+        """
+        Score prediction features fully and with early exit at each of
+        `margins` (see `update_predictions`), nothing is published.
+
+        every: None or int
+            Stages between early exit checks (`TreeEnsemble` default if
+            None).
+
+        Returns
+        -------
+        report: DataFrame
+            One row per margin, the first row is full scoring:
+                margin - NaN for full scoring
+                stages - mean share of stages scored per row
+                seconds, speedup - scoring time, full time / time
+                accuracy - share of rows with the same predicted class as
+                    with full scoring
+                max_prob_diff - max absolute difference of probabilities
+                top_k_agreement - share of top-`n_limit` products per user
+                    kept (see `ranking.get_top_k_agreement`)
+        """
+        if self._update_predictset_needed:
+            raise ValueError('Prediction features are not extracted yet. '
+                'Use `.update_predictions()` or `.load_model()` first.')
+        df_ui = self.features_predict.df_ui
+        bundle = self._get_model_bundle().compile()
+        x = bundle.get_x(df_ui)
+        uids = df_ui.index.get_level_values('uid').values
+
+        results = []
+        for margin in [None, *margins]:
+            model = bundle.model.with_early_exit(margin, every)
+            time_start = time.perf_counter()
+            raw, n_stages = model.score_stages(x)
+            seconds = time.perf_counter() - time_start
+            results.append((margin, model.raw_to_proba(raw), n_stages,
+                seconds))
+
+        _, prob_full, _, seconds_full = results[0]
+        report = []
+        for margin, prob, n_stages, seconds in results:
+            report.append({
+                'margin': margin,
+                'stages': np.mean(n_stages) / bundle.model.n_trees,
+                'seconds': seconds,
+                'speedup': seconds_full / seconds,
+                'accuracy': np.mean((prob > .5) == (prob_full > .5)),
+                'max_prob_diff': np.abs(prob - prob_full).max(),
+                'top_k_agreement': get_top_k_agreement(uids, prob_full,
+                    prob, n_limit),
+            })
+        return pd.DataFrame(report)
+
+
+    def _use_model_features(self, bundle):
+        """
+        Use only extractors of `bundle`'s features for prediction (all if
+        unknown). Features of other extractors are dropped, features are
+        extracted again if an extractor wasn't used before.
+        """
+        features = self.features_predict
+        used_before = set(features.feature_extractors)
+        features.use_feature_extractors(bundle.extractor_names)
+        used = set(features.feature_extractors)
+        bundle.check_extractors(features.feature_extractors)
+        if self._update_predictset_needed:
+            return
+        if not used <= used_before:
+            self._update_predictset_needed = True
+        elif used != used_before:
+            registry = features._feature_registry
+            features.df_ui = features.df_ui[[name
+                for name in features.df_ui.columns
+                if registry.get(name) in used]]
+
+
+    def _update_predictions(self, bundle):
+        """ Predict for all users with `bundle`, then publish both. """
+        catalog = self._extract_features_for_prediction()
+        store = PredictionsStore.from_frame(
+            self._predict_df_ui(self.features_predict.df_ui, bundle))
+        changes = {'model': bundle.model, 'bundle': bundle,
+            'predictions_store': store,
+            'popular_products': copy.copy(self._get_popular_products())}
+        if catalog is not None:
+            changes['catalog'] = catalog
+        self._publish(**changes)
+        self.lazy = False
+
+
+    @property
+    def predictions(self):
+        """
+        Predictions frame built from `self.predictions_store`.
+            Columns (3): uid, iid, in_target_prob
+        """
+        return self.predictions_store.to_frame()
 
-        self.predictions = (
-            pd.Series(
-                y_prob,
-                index=self.features_predict.df_ui.index,
-                name='in_target_prob'
-            )
-            .reset_index()
-            .sort_values(['uid', 'in_target_prob'], ascending=[True, False])
-        )
-        self._add_popular_products()
-        self.predictions = (
-            self.predictions
-            .reset_index()
-            .sort_values(['uid', 'index'])
-            .drop(columns='index')
-            .reset_index(drop=True)
-        )
+
+    def _predict_df_ui(self, df_ui, bundle=None):
+        """
+        bundle: None or ModelBundle
+            Model to score with (published one if None).
+        """
+        if bundle is None:
+            bundle = self._state.bundle
+        if self.chunk_size is None:
+            predictions = self._score_df_ui(df_ui, bundle)
+        else:
+            predictions = self._score_df_ui_chunked(df_ui, bundle)
+
+        with self.profiler.stage('predict.fallback_fill',
+                rows_in=len(predictions)) as event:
+            predictions = self._add_popular_products(predictions)
+            event.rows_out = len(predictions)
+        with self.profiler.stage('predict.rank', rows_in=len(predictions)):
+            # Added products go after user's predictions
+            order = np.argsort(predictions.uid.values, kind='stable')
+            predictions = predictions.iloc[order].reset_index(drop=True)
+        return predictions
+
+
+    def _score_df_ui(self, df_ui, bundle):
+        with self.profiler.stage('predict.score', rows_in=len(df_ui)):
+            x_pred = bundle.get_x(df_ui)
+            y_prob = bundle.model.predict_proba(x_pred)[:, 1]
+
+        with self.profiler.stage('predict.rank', rows_in=len(df_ui)):
+            uids = df_ui.index.get_level_values('uid').values
+            iids = df_ui.index.get_level_values('iid').values
+            positions = select_top_k(uids, y_prob, self.top_k)
+            predictions = pd.DataFrame({
+                'uid': uids[positions],
+                'iid': iids[positions],
+                'in_target_prob': y_prob[positions],
+            })
+        return predictions
+
+
+    def _score_df_ui_chunked(self, df_ui, bundle):
+        """
+        Score `df_ui` in user-aligned chunks of `self.chunk_size` rows and
+        keep `self.top_k` products per user. Same ordering as `_score_df_ui`.
+        """
+        uids = df_ui.index.get_level_values('uid').values
+        iids = df_ui.index.get_level_values('iid').values
+        chunk_size = (
+            len(df_ui) if self.chunk_size is None else self.chunk_size)
+
+        accumulator = TopKAccumulator(self.top_k)
+        for start, stop in get_chunks_bounds(get_segments_offsets(uids),
+                chunk_size):
+            with self.profiler.stage('predict.score', rows_in=stop - start):
+                x_pred = bundle.get_x(df_ui.iloc[start:stop])
+                y_prob = bundle.model.predict_proba(x_pred)[:, 1]
+            with self.profiler.stage('predict.rank', rows_in=stop - start):
+                accumulator.add(uids[start:stop], iids[start:stop], y_prob)
+
+        with self.profiler.stage('predict.rank') as event:
+            predictions = accumulator.to_frame('in_target_prob')
+            event.rows_out = len(predictions)
+        return predictions
+
+
+    def add_transactions(self, df_raw, write_delta=False):
+        """
+        Append new orders to the data used for predictions and refresh
+        predictions of users who made them (see `refresh_users`).
+
+        df_raw: DataFrame
+            Raw transactions (same columns as `transactions.csv`). New orders
+            have to continue users' `order_number` progression.
+        write_delta: {False, True}
+            Also write new orders to data directory as a delta segment (see
+            `Transactions.append`), so they are used for training and after
+            restart.
+        """
+        if self._update_predictset_needed:
+            raise ValueError('Predictions have to be made before adding '
+                'transactions. Use `.update_predictions()` or '
+                '`.load_model()`.')
+
+        with self._write_lock:
+            self.icds_predict._transactions.append(df_raw,
+                path_dir=self.path_dir if write_delta else None)
+            if self.popular_products is not None:
+                self.popular_products.add_transactions(df_raw)
+            self._update_trainset_needed = True
+            self.refresh_users(df_raw.user_id.unique())
+            if self.popular_products is not None:
+                self._publish(
+                    popular_products=copy.copy(self.popular_products))
         return self
 
 
-    def _extract_features_for_prediction(self):
-        # Preprocess raw transactions for predict (if not already)
-        # Update self.features_predict
+    def refresh_users(self, user_ids):
+        """
+        Incremental alternative to `update_predictions` for users whose raw
+        transactions have changed: preprocess their transactions, extract
+        their features and predict their products. Cost depends on the number
+        of given users, not on the dataset size.
+
+        Global item features are updated by delta, but only for given users'
+        rows. Use `update_predictions` periodically to update the rest.
+        """
         if self._update_predictset_needed:
-            _update_datasets(self.icds_predict, self.features_predict,
-                self.path_dir)
-            self._update_predictset_needed = False
+            raise ValueError('Predictions have to be made before refreshing '
+                'users. Use `.update_predictions()` or `.load_model()`.')
 
+        with self._write_lock:
+            self._refresh_users(np.unique(user_ids))
+        return self
 
-    def _get_x_pred(self):
-        x_pred = self.features_predict.df_ui.values
-        if self.scale_features:
-            x_std = x_pred.std(axis=0)
-            x_std[x_std < 1e-6] = 1.
-            x_mean = x_pred.mean(axis=0)
-            x_pred = (x_pred - x_mean) / x_std
-        return x_pred
 
+    def _refresh_users(self, user_ids):
+        icds = self.icds_predict
+        features = self.features_predict
+        if features.item_stats is None:
+            with self.profiler.stage('features.item_stats',
+                    rows_in=len(icds.df_trns)):
+                features.item_stats = ItemStats.from_df_trns(icds.df_trns)
 
-    def _add_popular_products(self):
+        df_trns_removed = icds.df_trns[icds.df_trns.uid.isin(user_ids)]
+        icds.update_users(user_ids)
+        features.update_users(user_ids, df_trns_removed,
+            **icds.get_users_dataframes(user_ids))
+
+        is_updated = (
+            features.df_ui.index.get_level_values('uid').isin(user_ids))
+        predictions = self._predict_df_ui(features.df_ui[is_updated])
+        self.predictions_store = self.predictions_store.update(
+            PredictionsStore.from_frame(predictions), user_ids=user_ids)
+
+
+    def _extract_features_for_prediction(self):
+        """
+        Preprocess raw transactions for predict and update
+        `self.features_predict` (if not already).
+
+        Returns
+        -------
+        catalog: None or ProductCatalog
+            Catalog of the new data (None if data hasn't been read).
+        """
+        if not self._update_predictset_needed:
+            return None
+        with self.profiler.stage('dataset.predict'):
+            _update_datasets(self.icds_predict, self.features_predict,
+                self.path_dir)
+            catalog = ProductCatalog.from_frame(self.icds_predict.df_prod)
+        self.popular_products = None
+        self._update_predictset_needed = False
+        return catalog
+
+
+    def _add_popular_products(self, predictions):
         """
         Take all users with less then 10 predicted products and add most
         popular products. This function ensures that each user will have no
@@ -266,141 +929,264 @@ class NextBasketPrediction:
            predicted product.
         3. Add 10 overall most popular products.
         4. Drop duplicated products.
+
+        Popularity tables are computed once per dataset (see
+        `PopularProducts`).
         """
-        df_prod = (
-            self.icds_predict._products.df
-            .set_index('product_id')
-            .loc[:, ['aisle_id', 'department_id']]
-        )
-        #             aisle_id  department_id
-        # product_id
-        # 49688             73             11
-
-        df_prod_n = (
-            self.icds_predict._transactions.df
-            .value_counts('product_id', sort=False)
-            .to_frame('n')
-            .join(df_prod)
-        )
-        #              n  aisle_id  department_id
-        # product_id
-        # 49688       55        73             11
-
-        aisle_id_top3_prod = (
-            df_prod_n
-            .groupby('aisle_id', sort=False)
-            .n.nlargest(3)
-            .reset_index()
-            .groupby('aisle_id')
-            .product_id.apply(list)
-        )
-        # aisle_id
-        # 134    [37923, 10607, 36885]
-
-        dept_id_top3_prod = (
-            df_prod_n
-            .groupby('department_id', sort=False)
-            .n.nlargest(3)
-            .reset_index()
-            .groupby('department_id')
-            .product_id.apply(list)
-        )
-        # department_id
-        # 21     [41149, 7035, 14010]
+        uid_fill, iid_fill = self._get_popular_products().get_fill(
+            predictions.uid.values, predictions.iid.values)
+        return pd.concat([
+            predictions,
+            pd.DataFrame({'uid': uid_fill, 'iid': iid_fill}),
+        ], ignore_index=True)
 
-        top10_prod = df_prod_n.nlargest(10, 'n').index.to_list()
 
-        uid_n_predictions = self.predictions.value_counts('uid')
-        uid_add_predictions = uid_n_predictions[uid_n_predictions < 10].index
+    def _get_popular_products(self):
+        """ Popularity tables of the predict dataset (computed once). """
+        if self.popular_products is None:
+            self.popular_products = PopularProducts().fit(
+                self.icds_predict._transactions.df,
+                self.icds_predict._products.df)
+        return self.popular_products
 
-        uid_predicted_products = (
-            self.predictions
-            .drop_duplicates('uid', keep='first')
-            .set_index('uid')
-            .loc[uid_add_predictions, ['iid']]  # frame
-            # add `aisle_id` and `department_id` columns
-            .join(df_prod, on='iid')
-        )
 
-        aisle_top3 = (
-            uid_predicted_products
-            .aisle_id.map(aisle_id_top3_prod)
-            .explode()
-            .rename('iid')
-            .reset_index()
-        )
-        department_top3 = (
-            uid_predicted_products
-            .department_id.map(dept_id_top3_prod)
-            .explode()
-            .rename('iid')
-            .reset_index()
-        )
-        top10 = (
-            pd.Series(
-                [top10_prod] * len(uid_predicted_products),
-                index=uid_predicted_products.index)
-            .explode()
-            .rename('iid')
-            .reset_index()
-        )
+    def get_predictions(self, user_ids, n_limit=10, cold_start=False,
+            cart=None):
+        """
+        user_ids: int or list-like
+        n_limit: None or int
+            Maximum number of products per user.
+        cold_start: {False, True}
+            Recommend popular products to users without predictions (new
+            users or users without transactions), `in_target_prob` is NaN
+            for them. Tables are precomputed, the cost doesn't depend on the
+            dataset size.
+        cart: None or list-like
+            Products already in the cart of cold start users: popular
+            products of the same aisles / departments go first.
+
+        Returns
+        -------
+        predictions: DataFrame
+            Columns (4): uid, iid, in_target_prob, product_name.
+            Sorted by uid.
+        """
+        if self._model_trained == False:
+            raise ValueError('Model has to be trained to make predictions. '
+                'Use `.train_model()` or `.load_model(path)`.')
 
-        self.predictions = (
-            pd.concat([self.predictions, aisle_top3, department_top3, top10],
-                axis='rows', ignore_index=True)
-            .drop_duplicates(['uid', 'iid'])
-        )
+        # Sets and iterators too (used more than once below)
+        user_ids = [user_ids] if np.isscalar(user_ids) else list(user_ids)
+        if self.lazy:
+            self._predict_users_lazily(user_ids)
+        # Everything below is read from one snapshot
+        state = self._state
+        predictions = state.predictions_store.get_frame(user_ids,
+            n_limit=n_limit)
+        if cold_start and state.popular_products is not None:
+            predictions = _add_cold_start(predictions, user_ids,
+                state.popular_products.recommend(cart, n_limit))
+        predictions['product_name'] = state.catalog.get_names(
+            predictions.iid.values)
+        return predictions
 
 
-    def get_predictions(self, user_ids, n_limit=10):
+    def get_user_history(self, user_id):
+        """
+        `UserHistory` of a user of prediction data (no orders if the user
+        is unknown), e.g. to add a fresh basket to:
+        `nbp.get_history_predictions(nbp.get_user_history(1).add_order(
+        [196, 12427], days_since_prior_order=3))`.
+        """
+        self._prepare_history_predictions()
+        dataframes = self.icds_predict.get_users_dataframes([user_id])
+        if len(dataframes['df_trns']) == 0:
+            return UserHistory.from_orders([], uid=user_id)
+        return UserHistory.from_frames(dataframes['df_ord'],
+            dataframes['df_trns'], uid=user_id)
+
+
+    def get_history_predictions(self, history, n_limit=10):
+        """
+        Predict products for an order history (e.g. a known user's history
+        with a fresh basket) without the dataframes pipeline: features are
+        computed by `UserHistory.get_features` with item statistics of the
+        prediction data, scored with the published model. Only the
+        built-in feature extractors are supported (see
+        `UserHistory.check_extractors`).
+
+        history: UserHistory
+            Limited to the last orders as prediction data (`n_orders_limit`
+            of `self.icds_predict`).
+        n_limit: None or int
+            Maximum number of products.
+
+        Returns
+        -------
+        predictions: DataFrame
+            Columns (4): uid, iid, in_target_prob, product_name.
+        """
         if self._model_trained == False:
             raise ValueError('Model has to be trained to make predictions. '
                 'Use `.train_model()` or `.load_model(path)`.')
-
-        if np.isscalar(user_ids):
-            user_ids = [user_ids]
-        user_ids = list(user_ids)
-        predictions = self.predictions[self.predictions.uid.isin(user_ids)]
-        if n_limit is not None:
-            predictions = predictions.groupby('uid', sort=False).head(n_limit)
-
-        product_names = (
-            self.icds_predict.df_prod
-            .set_index('iid')
-            .product_name
-        )
-        predictions = predictions.join(product_names, on='iid')
+        self._prepare_history_predictions()
+        state = self._state
+        features = self.features_predict
+        extractors = features.feature_extractors
+        if state.bundle.extractor_names is not None:
+            extractors = {name: function
+                for name, function in features._feature_extractors.items()
+                if name in state.bundle.extractor_names}
+
+        history = history.tail(self.icds_predict.n_orders_limit)
+        df_i = features.item_stats.get_features(iids=np.unique(history.iid))
+        with self.profiler.stage('features.history',
+                rows_in=len(history.iid)):
+            df_ui = history.get_features(df_i, extractors)
+        predictions = PredictionsStore.from_frame(
+            self._predict_df_ui(df_ui, state.bundle)).get_frame(
+                n_limit=n_limit)
+        predictions['product_name'] = state.catalog.get_names(
+            predictions.iid.values)
         return predictions
 
 
-    def predictions_to_csv(self, path):
+    def _prepare_history_predictions(self):
+        """ Prediction data and its item statistics (computed once). """
+        if self.lazy:
+            self._predict_users_lazily([])
+        elif self._update_predictset_needed:
+            raise ValueError('Prediction data is not prepared yet. Use '
+                '`.update_predictions()` or `.load_model()` first.')
+        with self._write_lock:
+            features = self.features_predict
+            if features.item_stats is None:
+                icds = self.icds_predict
+                with self.profiler.stage('features.item_stats',
+                        rows_in=len(icds.df_trns)):
+                    features.item_stats = ItemStats.from_df_trns(
+                        icds.df_trns)
+
+
+    def _predict_users_lazily(self, user_ids):
+        """
+        Extract features and predict products for given users which haven't
+        been predicted yet. The first call reads and preprocesses the whole
+        dataset and computes global item statistics (once, even if no user
+        has been predicted).
+        """
+        if self.path_dir is None:
+            raise ValueError('Model needs data to make predictions. '
+                'Use `.add_data(path_dir)` to set path to directory with data.')
+
+        with self._write_lock:
+            self._predict_new_users_lazily(user_ids)
+
+
+    def _predict_new_users_lazily(self, user_ids):
+        icds = self.icds_predict
+        features = self.features_predict
+        if not self._lazy_loaded:
+            with self.profiler.stage('dataset.predict_lazy'):
+                icds.read_dir(self.path_dir)
+                self.popular_products = None
+                self._publish(predictions_store=PredictionsStore.empty(),
+                    catalog=ProductCatalog.from_frame(icds.df_prod),
+                    popular_products=copy.copy(
+                        self._get_popular_products()))
+            with self.profiler.stage('features.item_stats',
+                    rows_in=len(icds.df_trns)):
+                features.item_stats = ItemStats.from_df_trns(icds.df_trns)
+            self._lazy_loaded = True
+
+        user_ids = np.setdiff1d(np.unique(user_ids),
+            np.fromiter(self._lazy_user_ids, dtype='int64'))
+        if len(user_ids) == 0:
+            return
+        df_ui = features.extract_users_features(
+            **icds.get_users_dataframes(user_ids))
+        if len(df_ui) > 0:
+            store = PredictionsStore.from_frame(self._predict_df_ui(df_ui))
+            self.predictions_store = (store
+                if self.predictions_store.n_users == 0
+                else self.predictions_store.update(store))
+        # Users without transactions are memoised as well (no predictions)
+        self._lazy_user_ids.update(user_ids.tolist())
+
+
+    def predictions_to_csv(self, path, compression='infer'):
         """
         user_id,product_id
         1,196 12427 10258 25133 46149 38928 39657 49235 13032 35951
         2,47209 1559 19156 18523 33754 16589 24852 21709 22124 32792
         ...
+
+        path: str, pathlib.Path or file-like
+        compression: {'infer', None, 'gzip', 'zstd'}
+            'infer' uses path's suffix: ".gz" - gzip, ".zst" - zstd.
         """
         n_limit=10
 
-        rows = ['user_id,product_id']
-
-        for uid, iids in tqdm(self.predictions.groupby('uid').iid,
-                disable=(self.verbose < 1)):
-            iids = iids.values[:n_limit]
-            iid_list_str = ' '.join(map(str, iids))
-            rows.append(f'{uid},{iid_list_str}')
+        with self.profiler.stage('export.csv',
+                rows_in=len(self.predictions_store)) as event:
+            n_bytes, sha256 = write_predictions_csv(self.predictions_store,
+                path, n_limit=n_limit, compression=compression)
+            event.rows_out = self.predictions_store.n_users
 
-        with open(path, 'wt', newline='') as f:
-            f.write('\n'.join(rows))
-
-        fsize = Path(path).stat().st_size
         print(f'{path}\n'
-              f'  {fsize} ({format_size(fsize)}), sha256:{hash_for_file(path)}'
+              f'  {n_bytes} ({format_size(n_bytes)}), sha256:{sha256}'
         )
 
 
+    def export_predictions(self, path, format='infer', n_limit=10,
+            with_prob=False, with_rank=False, **kwargs):
+        """
+        Export predictions to a binary format (or CSV, see
+        `predictions_to_csv`).
+
+        format: {'infer', 'parquet', 'feather', 'npz', 'csv'}
+            'infer' uses path's suffix: ".parquet", ".feather" / ".arrow",
+            ".npz", ".csv" (optionally followed by ".gz" / ".zst").
+            Parquet and Feather require pyarrow library (use
+            `pip install pyarrow` to install).
+        n_limit: None or int
+            Maximum number of products per user (all if None).
+        with_prob, with_rank: {False, True}
+            Add `prob` / `rank` (1 - most probable) columns (`rank` is
+            implicit in npz).
+        kwargs:
+            Passed to the format's writer (e.g. `users_per_chunk`,
+            `compression`), see `instacartlib.predictions_export`. CSV
+            accepts `compression` only.
+        """
+        if format == 'infer':
+            format = get_format(path)
+
+        if format == 'csv':
+            if n_limit != 10:
+                raise ValueError('CSV export has fixed `n_limit=10`.')
+            if with_prob or with_rank:
+                raise ValueError('CSV export has product ids only, '
+                    '`with_prob` and `with_rank` are not supported.')
+            unsupported = sorted(set(kwargs) - {'compression'})
+            if unsupported:
+                raise ValueError(f'Unsupported options for CSV export: '
+                    f'{unsupported} (only `compression` is supported).')
+            return self.predictions_to_csv(path, **kwargs)
+
+        with self.profiler.stage(f'export.{format}',
+                rows_in=len(self.predictions_store)):
+            if format == 'parquet':
+                write_predictions_parquet(self.predictions_store, path,
+                    n_limit, with_prob, with_rank, **kwargs)
+            elif format == 'feather':
+                write_predictions_feather(self.predictions_store, path,
+                    n_limit, with_prob, with_rank, **kwargs)
+            elif format == 'npz':
+                write_predictions_npz(self.predictions_store, path, n_limit,
+                    with_prob, **kwargs)
+            else:
+                raise ValueError(f'Unknown format: {format!r}')
 
-
-
-
-
+        fsize = Path(path).stat().st_size
+        print(f'{path}\n  {fsize} ({format_size(fsize)})')
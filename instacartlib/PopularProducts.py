@@ -0,0 +1,212 @@
+"""
+Popular products used to complete short predictions.
+
+Capabilities:
+* Count product purchases once per dataset into a dense array indexed by
+  product id, update counts by delta (new transactions).
+* Keep top-N tables as integer arrays: overall, per aisle and per department
+  (ties broken by lower product id).
+* Complete predictions of users with less than `n_min` products without
+  Python loops or object columns.
+* Recommend products to users without history (cold start), optionally
+  conditioned on a partial cart, from the tables only (cost doesn't depend
+  on the dataset size).
+
+Tables and counts are replaced, never changed in place, so a shallow copy
+of the object is a consistent snapshot.
+
+Tables (-1 marks empty slots):
+    top            - (n_top,)
+    aisle_top      - (max_aisle_id + 1, n_top_group)
+    department_top - (max_department_id + 1, n_top_group)
+"""
+
+from .ranking import get_segments_offsets, get_segments_positions
+from .ranking import get_segments_ranks
+
+import numpy as np
+import pandas as pd
+
+
+def _get_group_top(group_ids, ranked_products, n_groups, n_top):
+    """
+    group_ids: np.ndarray
+        Group of every product in `ranked_products` (ranked by popularity).
+
+    Returns
+    -------
+    table: np.ndarray
+        (n_groups, n_top), most popular products of every group.
+    """
+    table = np.full((n_groups, n_top), -1, dtype='int64')
+    order = np.argsort(group_ids, kind='stable')
+    group_ids = group_ids[order]
+    ranks = get_segments_ranks(get_segments_offsets(group_ids))
+    is_top = ranks < n_top
+    table[group_ids[is_top], ranks[is_top]] = ranked_products[order][is_top]
+    return table
+
+
+class PopularProducts:
+    """
+    n_top: int
+        Number of overall most popular products to add.
+    n_top_group: int
+        Number of most popular products of the same aisle / department (as
+        the user's first predicted product) to add.
+    n_min: int
+        Predictions of users with less than `n_min` products are completed.
+    """
+    def __init__(self, n_top=10, n_top_group=3, n_min=10):
+        self.n_top = n_top
+        self.n_top_group = n_top_group
+        self.n_min = n_min
+        self.counts = None
+        self.product_aisle = None
+        self.product_department = None
+        self.top = None
+        self.aisle_top = None
+        self.department_top = None
+
+
+    def __repr__(self):
+        n_products = 0 if self.counts is None else int((self.counts > 0).sum())
+        return f'<{self.__class__.__name__} products={n_products}>'
+
+
+    def fit(self, df_trns_raw, df_prod_raw):
+        """
+        df_trns_raw: DataFrame
+            Required columns (1): product_id
+        df_prod_raw: DataFrame
+            Required columns (3): product_id, aisle_id, department_id
+        """
+        max_product_id = max(df_prod_raw.product_id.max(),
+            df_trns_raw.product_id.max() if len(df_trns_raw) else 0)
+        self.product_aisle = np.full(max_product_id + 1, -1, dtype='int64')
+        self.product_department = self.product_aisle.copy()
+        product_ids = df_prod_raw.product_id.values
+        self.product_aisle[product_ids] = df_prod_raw.aisle_id.values
+        self.product_department[product_ids] = (
+            df_prod_raw.department_id.values)
+
+        self.counts = np.zeros(max_product_id + 1, dtype='int64')
+        return self.add_transactions(df_trns_raw)
+
+
+    def add_transactions(self, df_trns_raw):
+        """ Update counts with new transactions and recompute tables. """
+        product_ids = df_trns_raw.product_id.values
+        if len(product_ids) and product_ids.max() >= len(self.counts):
+            size = product_ids.max() + 1
+            self.counts = np.r_[self.counts,
+                np.zeros(size - len(self.counts), dtype='int64')]
+            fill = np.full(size - len(self.product_aisle), -1, dtype='int64')
+            self.product_aisle = np.r_[self.product_aisle, fill]
+            self.product_department = np.r_[self.product_department, fill]
+        self.counts = self.counts + np.bincount(product_ids,
+            minlength=len(self.counts)).astype('int64')
+        self._update_tables()
+        return self
+
+
+    def _update_tables(self):
+        bought = np.flatnonzero(self.counts > 0)
+        # Most popular first, ties: lower product id first
+        ranked = bought[np.lexsort((bought, -self.counts[bought]))]
+        self.top = ranked[:self.n_top]
+
+        # Products missing in products table have no aisle / department
+        ranked = ranked[self.product_aisle[ranked] >= 0]
+        aisles = self.product_aisle[ranked]
+        departments = self.product_department[ranked]
+        self.aisle_top = _get_group_top(aisles, ranked,
+            max(self.product_aisle.max(), 0) + 1, self.n_top_group)
+        self.department_top = _get_group_top(departments, ranked,
+            max(self.product_department.max(), 0) + 1, self.n_top_group)
+
+
+    def recommend(self, cart=None, n_limit=None):
+        """
+        Popular products for a user without history.
+
+        cart: None or list-like
+            Products already in the user's cart: most popular products of
+            their aisles, then of their departments go first (cart products
+            themselves are excluded), then overall most popular products.
+        n_limit: None or int
+            Maximum number of products (all candidates if None, at most
+            `len(cart) * 2 * n_top_group + n_top`).
+
+        Returns
+        -------
+        iid: np.ndarray
+            int64 product ids, most relevant first.
+        """
+        if cart is None or len(cart) == 0:
+            return self.top[:n_limit]
+        cart = np.asarray(cart, dtype='int64')
+        known = cart[(cart >= 0) & (cart < len(self.product_aisle))]
+        aisles = self.product_aisle[known]
+        departments = self.product_department[known]
+        candidates = np.r_[
+            self.aisle_top[aisles[aisles >= 0]].ravel(),
+            self.department_top[departments[departments >= 0]].ravel(),
+            self.top,
+        ]
+        candidates = candidates[(candidates >= 0)
+            & ~np.isin(candidates, cart)]
+        _, first = np.unique(candidates, return_index=True)
+        return candidates[np.sort(first)][:n_limit]
+
+
+    def get_fill(self, uid, iid):
+        """
+        uid, iid: np.ndarray
+            Ranked predictions sorted by uid.
+
+        Returns
+        -------
+        uid_fill, iid_fill: np.ndarray
+            Products to add after predictions of users with less than
+            `n_min` products: top products of the first predicted product's
+            aisle, of its department and overall, without products already
+            predicted or added.
+        """
+        offsets = get_segments_offsets(uid)
+        lengths = np.diff(offsets)
+        users = np.flatnonzero(lengths < self.n_min)
+        first_iid = iid[offsets[users]].astype('int64')
+        known = first_iid < len(self.product_aisle)
+        aisle = np.where(known,
+            self.product_aisle[
+                first_iid.clip(max=len(self.product_aisle) - 1)],
+            -1)
+        department = np.where(known,
+            self.product_department[
+                first_iid.clip(max=len(self.product_department) - 1)],
+            -1)
+
+        candidates = np.hstack([
+            np.where(aisle[:, None] >= 0, self.aisle_top[aisle], -1),
+            np.where(department[:, None] >= 0,
+                self.department_top[department], -1),
+            np.broadcast_to(self.top, (len(users), len(self.top))),
+        ])
+
+        # Predicted products of these users go first to exclude them
+        rows_predicted = get_segments_positions(offsets[users], lengths[users])
+        df = pd.DataFrame({
+            'user': np.r_[
+                np.repeat(users, lengths[users]),
+                np.repeat(users, candidates.shape[1]),
+            ],
+            'iid': np.r_[iid[rows_predicted].astype('int64'),
+                candidates.ravel()],
+            'is_fill': np.r_[
+                np.zeros(len(rows_predicted), dtype=bool),
+                np.ones(candidates.size, dtype=bool),
+            ],
+        })
+        df = df[~df.duplicated(['user', 'iid']) & df.is_fill & (df.iid >= 0)]
+        return uid[offsets[df.user.values]], df.iid.values.astype(iid.dtype)
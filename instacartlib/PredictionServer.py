@@ -0,0 +1,604 @@
+"""
+Local HTTP/JSON prediction server over `NextBasketPrediction`.
+
+Capabilities:
+* asyncio server (standard library only, HTTP/1.1 with keep-alive) holding
+  a loaded model and dataset in memory.
+* Concurrent requests are coalesced into micro-batches (`MicroBatcher`):
+  one `get_predictions` call per batch of up to `batch_size` users, waiting
+  at most `max_wait` seconds for a batch to fill. Batches are scored in a
+  worker thread, so requests keep being accepted (and batched) meanwhile.
+* Latency and throughput metrics (`GET /metrics`), process memory.
+* Product names from a compact `ProductCatalog` (`"with_names": true`).
+* Cold start (`cold_start=True`): users without predictions get popular
+  products (`PopularProducts.recommend`), conditioned on `"cart"` if given.
+* Multi-process mode (`--workers`), see `prefork`.
+* `HttpJsonClient` - minimal asyncio client (used by the load test script
+  `benchmarks/load_test.py`).
+
+Endpoints:
+    POST /predict  {"user_ids": [1, 2], "n_limit": 10, "with_names": false}
+        -> {"predictions": [{"user_id": 1, "product_ids": [...]}, ...]}
+        Unknown users get empty `product_ids`. With `"with_names": true`
+        every prediction has `product_names` as well.
+        Cold start server: optional `"cart": [product ids]`, unknown users
+        get popular products and `"cold_start": true`.
+    GET /metrics   -> see `ServerMetrics.to_dict`
+    GET /health    -> {"status": "ok"}
+
+Usage:
+    python -m instacartlib.PredictionServer --data-dir instacart_data \\
+        --model instacartlib_model.dump --port 8080 --batch-size 64 \\
+        --max-wait-ms 5 [--workers 4]
+"""
+
+from .ranking import get_segments_offsets
+from .ProductCatalog import ProductCatalog
+from .Profiler import get_process_memory
+
+import argparse
+import asyncio
+from collections import deque
+import concurrent.futures
+import json
+import os
+import time
+
+import numpy as np
+
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+MAX_BODY_BYTES = 1 << 20
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_http_request(reader):
+    """
+    Returns
+    -------
+    request: None or (method, path, headers, body)
+        None if the connection was closed before a request.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HttpError(400, 'Malformed request line.')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    n_bytes = int(headers.get('content-length', 0))
+    if n_bytes > MAX_BODY_BYTES:
+        raise HttpError(413, f'Request body is limited to {MAX_BODY_BYTES} '
+            f'bytes.')
+    body = await reader.readexactly(n_bytes) if n_bytes else b''
+    return method, path.split('?', 1)[0], headers, body
+
+
+def format_http_response(status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    head = (f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    return head.encode('latin-1') + body
+
+
+class ServerMetrics:
+    """
+    Counters since start and latency percentiles of the last `window`
+    requests.
+    """
+    def __init__(self, window=10_000):
+        self.start_time = time.perf_counter()
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_users = 0
+        self.n_batches = 0
+        self.n_batch_requests = 0
+        self.batch_seconds = 0.
+        self.latencies = deque(maxlen=window)
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} requests={self.n_requests} '
+                f'batches={self.n_batches}>')
+
+
+    def record_request(self, latency, n_users=0, is_error=False):
+        self.n_requests += 1
+        self.n_users += n_users
+        self.n_errors += is_error
+        self.latencies.append(latency)
+
+
+    def record_batch(self, n_requests, seconds):
+        self.n_batches += 1
+        self.n_batch_requests += n_requests
+        self.batch_seconds += seconds
+
+
+    def to_dict(self):
+        uptime = time.perf_counter() - self.start_time
+        latencies_ms = np.array(self.latencies) * 1000
+        percentiles = (np.percentile(latencies_ms, [50, 90, 99]).tolist()
+            if len(latencies_ms) else [0., 0., 0.])
+        return {
+            'pid': os.getpid(),
+            'memory': get_process_memory(),
+            'uptime_seconds': uptime,
+            'n_requests': self.n_requests,
+            'n_errors': self.n_errors,
+            'n_users': self.n_users,
+            'requests_per_second': self.n_requests / uptime,
+            'users_per_second': self.n_users / uptime,
+            'latency_ms': {
+                'p50': percentiles[0],
+                'p90': percentiles[1],
+                'p99': percentiles[2],
+                'max': float(latencies_ms.max()) if len(latencies_ms) else 0.,
+            },
+            'n_batches': self.n_batches,
+            'batch_requests_mean': (
+                self.n_batch_requests / max(self.n_batches, 1)),
+            'batch_ms_mean': (
+                self.batch_seconds * 1000 / max(self.n_batches, 1)),
+        }
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent `submit` calls into calls of `predict_batch`.
+
+    predict_batch: callable
+        predict_batch(user_ids, n_limit) -> {user_id: list of product ids}
+        Called in a worker thread, one batch at a time.
+    batch_size: int
+        Maximum number of users in a batch (a single larger request is
+        scored as one batch).
+    max_wait: float
+        Seconds to wait for more requests after the first one of a batch.
+    metrics: None or ServerMetrics
+    """
+    def __init__(self, predict_batch, batch_size=64, max_wait=.005,
+            metrics=None):
+        self.predict_batch = predict_batch
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.metrics = metrics if metrics is not None else ServerMetrics()
+        self._queue = None
+        self._task = None
+        self._executor = None
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} batch_size={self.batch_size} '
+                f'max_wait={self.max_wait}>')
+
+
+    def start(self):
+        """ Start the batching loop (in the running event loop). """
+        self._queue = asyncio.Queue()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown(wait=True)
+
+
+    async def submit(self, user_ids, n_limit=10):
+        """
+        Returns
+        -------
+        predictions: dict
+            {user_id: list of product ids} for every requested user.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((list(user_ids), n_limit, future))
+        return await future
+
+
+    async def _get_batch(self):
+        batch = [await self._queue.get()]
+        n_users = len(batch[0][0])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while n_users < self.batch_size:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._queue.get_nowait()
+            batch.append(item)
+            n_users += len(item[0])
+        return batch
+
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._get_batch()
+            user_ids = list(dict.fromkeys(
+                uid for uids, _, _ in batch for uid in uids))
+            n_limit = max(n_limit for _, n_limit, _ in batch)
+            start = time.perf_counter()
+            try:
+                predictions = await loop.run_in_executor(self._executor,
+                    self.predict_batch, user_ids, n_limit)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.metrics.record_batch(len(batch),
+                    time.perf_counter() - start)
+            for uids, n_limit, future in batch:
+                if not future.done():
+                    future.set_result({uid: predictions.get(uid, [])[:n_limit]
+                        for uid in uids})
+
+
+def get_predict_batch(nbp):
+    """
+    Batch function for `MicroBatcher`: one `nbp.get_predictions` call per
+    batch, split by user.
+    """
+    def predict_batch(user_ids, n_limit):
+        predictions = nbp.get_predictions(user_ids, n_limit=n_limit)
+        offsets = get_segments_offsets(predictions.uid.values)
+        uids = predictions.uid.values[offsets[:-1]].tolist()
+        iids = predictions.iid.values.tolist()
+        return {uid: iids[start:stop] for uid, start, stop
+            in zip(uids, offsets[:-1].tolist(), offsets[1:].tolist())}
+    return predict_batch
+
+
+def get_store_predict_batch(store):
+    """
+    Batch function for `MicroBatcher` reading a `PredictionsStore` directly
+    (no model or dataframes needed).
+    """
+    def predict_batch(user_ids, n_limit):
+        uids, offsets, rows = store._take_users(
+            store._get_users_positions(user_ids), n_limit)
+        iids = store.iid[rows].tolist()
+        return {uid: iids[start:stop] for uid, start, stop
+            in zip(uids.tolist(), offsets[:-1].tolist(), offsets[1:].tolist())}
+    return predict_batch
+
+
+class PredictionServer:
+    """
+    nbp: None or NextBasketPrediction
+        Model with data (`load_model` done, lazy mode is fine). Not needed
+        if `predict_batch` and `catalog` are given.
+    host, port: str, int
+        Address to listen on (port 0 - any free port, see `self.port` after
+        `start()`).
+    batch_size, max_wait:
+        See `MicroBatcher`.
+    n_limit: int
+        Default number of products per user.
+    predict_batch: None or callable
+        See `MicroBatcher` (`nbp.get_predictions` per batch if None).
+    catalog: None or ProductCatalog
+        Product names (created from `nbp` data at the first request with
+        names if None).
+    cold_start: {False, True}
+        Recommend popular products to users without predictions.
+    popular_products: None or PopularProducts
+        Used with `cold_start=True` (`nbp.state.popular_products` if None).
+    """
+    def __init__(self, nbp=None, host='127.0.0.1', port=8080, batch_size=64,
+            max_wait=.005, n_limit=10, predict_batch=None, catalog=None,
+            cold_start=False, popular_products=None):
+        if nbp is None and predict_batch is None:
+            raise ValueError('Either `nbp` or `predict_batch` is required.')
+        if predict_batch is None:
+            predict_batch = get_predict_batch(nbp)
+        self.nbp = nbp
+        self.host = host
+        self.port = port
+        self.n_limit = n_limit
+        self.catalog = catalog
+        self.cold_start = cold_start
+        self.popular_products = popular_products
+        self.metrics = ServerMetrics()
+        self.batcher = MicroBatcher(predict_batch, batch_size, max_wait,
+            self.metrics)
+        self._server = None
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} '
+                f'address={self.host}:{self.port} {self.batcher!r}>')
+
+
+    async def start(self, sock=None):
+        """
+        sock: None or socket.socket
+            Listening socket to accept connections on (shared by forked
+            workers) instead of binding `host:port`.
+        """
+        self.metrics = self.batcher.metrics = ServerMetrics()
+        self.batcher.start()
+        if sock is None:
+            self._server = await asyncio.start_server(
+                self._handle_connection, self.host, self.port)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle_connection, sock=sock)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+
+    async def serve_started(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+
+    def serve_forever(self):
+        async def serve():
+            await self.start()
+            print(f'Serving on http://{self.host}:{self.port}')
+            await self.serve_started()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_http_request(reader)
+                except (HttpError, ValueError) as e:
+                    status = getattr(e, 'status', 400)
+                    writer.write(format_http_response(status,
+                        {'error': str(e)}, keep_alive=False))
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload = await self._handle_request(method, path,
+                    body)
+                writer.write(format_http_response(status, payload,
+                    keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def _handle_request(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.metrics.to_dict()
+        if path != '/predict':
+            return 404, {'error': f'Unknown path: {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST for /predict.'}
+
+        start = time.perf_counter()
+        try:
+            user_ids, n_limit, with_names, cart = self._parse_predict_body(
+                body)
+            predictions = await self.batcher.submit(user_ids, n_limit)
+            # After predictions: data of lazy `nbp` is read by then
+            catalog = self._get_catalog() if with_names else None
+        except HttpError as e:
+            self.metrics.record_request(time.perf_counter() - start,
+                is_error=True)
+            return e.status, {'error': str(e)}
+        except Exception as e:
+            self.metrics.record_request(time.perf_counter() - start,
+                is_error=True)
+            return 500, {'error': repr(e)}
+        self.metrics.record_request(time.perf_counter() - start,
+            len(user_ids))
+        predictions = [
+            {'user_id': uid, 'product_ids': predictions[uid]}
+            for uid in user_ids
+        ]
+        if self.cold_start:
+            self._add_cold_start(predictions, cart, n_limit)
+        if with_names:
+            for prediction in predictions:
+                prediction['product_names'] = catalog.get_names(
+                    prediction['product_ids'])
+        return 200, {'predictions': predictions}
+
+
+    def _add_cold_start(self, predictions, cart, n_limit):
+        """ Popular products for predictions without products. """
+        popular_products = self.popular_products
+        if popular_products is None and self.nbp is not None:
+            popular_products = self.nbp.state.popular_products
+        if popular_products is None:
+            return
+        iids = None
+        for prediction in predictions:
+            if not prediction['product_ids']:
+                if iids is None:
+                    iids = popular_products.recommend(cart, n_limit).tolist()
+                prediction['product_ids'] = iids
+                prediction['cold_start'] = True
+
+
+    def _get_catalog(self):
+        if self.catalog is None:
+            if self.nbp is None:
+                raise HttpError(400, 'Product names are not available.')
+            self.catalog = ProductCatalog.from_frame(
+                self.nbp.icds_predict.df_prod)
+        return self.catalog
+
+
+    def _parse_predict_body(self, body):
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise TypeError(f'JSON object expected, got: '
+                    f'{type(request).__name__}')
+            user_ids = [int(uid) for uid in request['user_ids']]
+            n_limit = request.get('n_limit', self.n_limit)
+            with_names = bool(request.get('with_names', False))
+            cart = [int(iid) for iid in request.get('cart') or []]
+        except (ValueError, KeyError, TypeError) as e:
+            raise HttpError(400, f'Expected JSON {{"user_ids": [...], '
+                f'"n_limit": int, "with_names": bool, "cart": [...]}}, '
+                f'got error: {e!r}')
+        if isinstance(n_limit, bool) or not isinstance(n_limit, int) or (
+                n_limit < 0):
+            raise HttpError(400, f'"n_limit" expected to be a non-negative '
+                f'integer, got: {n_limit!r}')
+        return user_ids, n_limit, with_names, cart
+
+
+class HttpJsonClient:
+    """
+    Minimal asyncio HTTP/JSON client, one keep-alive connection.
+
+    Use `async with HttpJsonClient(host, port) as client:`.
+    """
+    def __init__(self, host='127.0.0.1', port=8080):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+
+    async def __aenter__(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port)
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+    async def request(self, method, path, payload=None):
+        """
+        Returns
+        -------
+        status: int
+        payload: object
+            Decoded JSON response.
+        """
+        body = b'' if payload is None else json.dumps(payload).encode()
+        self._writer.write(
+            (f'{method} {path} HTTP/1.1\r\n'
+             f'Host: {self.host}\r\n'
+             f'Content-Type: application/json\r\n'
+             f'Content-Length: {len(body)}\r\n\r\n').encode('latin-1')
+            + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        status = int(status_line.split()[1])
+        n_bytes = 0
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                n_bytes = int(value)
+        return status, json.loads(await self._reader.readexactly(n_bytes))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Serve predictions of '
+        'NextBasketPrediction over HTTP/JSON.')
+    parser.add_argument('--data-dir', required=True,
+        help='Directory with dataset files.')
+    parser.add_argument('--model', default=None,
+        help='Model file created with `save_model` (pretrained "gbc" model '
+             'if not set).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--batch-size', type=int, default=64,
+        help='Maximum number of users scored in one batch.')
+    parser.add_argument('--max-wait-ms', type=float, default=5.,
+        help='Maximum time to wait for a batch to fill.')
+    parser.add_argument('--n-limit', type=int, default=10)
+    parser.add_argument('--lazy', action='store_true',
+        help='Predict requested users on demand (see `load_model`).')
+    parser.add_argument('--workers', type=int, default=1,
+        help='Number of pre-forked worker processes sharing predictions '
+             '(0 - number of CPUs, see `prefork`).')
+    parser.add_argument('--cold-start', action='store_true',
+        help='Recommend popular products to users without predictions.')
+    parser.add_argument('--compile-model', action='store_true',
+        help='Score with the model compiled to numpy arrays (see '
+             '`TreeEnsemble`).')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    from .NextBasketPrediction import NextBasketPrediction
+    from .prefork import get_prefork_server
+
+    args = parse_args(args)
+    nbp = NextBasketPrediction(verbose=1).add_data(args.data_dir)
+    nbp.load_model(path=args.model, lazy=args.lazy)
+    if args.compile_model:
+        nbp.compile_model()
+    server_kwargs = dict(host=args.host, port=args.port,
+        batch_size=args.batch_size, max_wait=args.max_wait_ms / 1000,
+        n_limit=args.n_limit, cold_start=args.cold_start)
+    if args.workers == 1:
+        server = PredictionServer(nbp, **server_kwargs)
+    else:
+        server = get_prefork_server(nbp, args.workers or None,
+            **server_kwargs)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
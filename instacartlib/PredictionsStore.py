@@ -0,0 +1,219 @@
+"""
+Compact storage for predicted products of every user.
+
+Capabilities:
+* Hold predictions as CSR-like arrays: sorted unique user ids, offsets of
+  every user's rows, product ids and probabilities (ranked within user).
+* Look up a few users' predictions with binary search (no scan over all
+  rows).
+* Replace predictions of some users (incremental refresh).
+
+Arrays:
+    uid    - (n_users,) sorted unique user ids
+    offsets - (n_users + 1,) int64, rows of uid[i] are offsets[i]:offsets[i+1]
+    iid    - (n_rows,) int32 product ids
+    prob   - (n_rows,) float32 (or float16) probabilities
+"""
+
+from .ranking import get_segments_offsets, get_segments_positions
+from .utils import format_size
+
+import numpy as np
+import pandas as pd
+
+
+def _get_ids_array(ids):
+    """ Array of any list-like of ids (sets and iterators too). """
+    if not isinstance(ids, (np.ndarray, list, tuple, pd.Index, pd.Series)):
+        ids = list(ids)
+    return np.asarray(ids)
+
+
+class PredictionsStore:
+    """
+    Use `PredictionsStore.from_frame(predictions)` to create from
+    predictions frame.
+
+    uid, offsets, iid, prob: np.ndarray
+        See module docstring.
+    prob_name: str
+        Name of the probability column in frames.
+    """
+    def __init__(self, uid, offsets, iid, prob, prob_name='in_target_prob'):
+        if len(offsets) != len(uid) + 1 or offsets[-1] != len(iid):
+            raise ValueError('`offsets` must have `len(uid) + 1` values '
+                'ending with `len(iid)`.')
+        if len(iid) != len(prob):
+            raise ValueError('`iid` and `prob` must have the same length.')
+        if np.any(uid[1:] <= uid[:-1]):
+            raise ValueError('`uid` must be sorted and unique.')
+        self.uid = uid
+        self.offsets = offsets
+        self.iid = iid
+        self.prob = prob
+        self.prob_name = prob_name
+
+
+    @classmethod
+    def empty(cls, prob_name='in_target_prob'):
+        return cls(np.array([], dtype='uint32'), np.zeros(1, dtype='int64'),
+            np.array([], dtype='int32'), np.array([], dtype='float32'),
+            prob_name=prob_name)
+
+
+    @classmethod
+    def from_frame(cls, df, prob_name='in_target_prob', iid_dtype='int32',
+            prob_dtype='float32'):
+        """
+        df: DataFrame
+            Columns (3): uid, iid, `prob_name`. Rows sorted by uid (rows of
+            every user in ranked order).
+        """
+        uids = df['uid'].values
+        if np.any(uids[1:] < uids[:-1]):
+            raise ValueError('Predictions must be sorted by uid.')
+        offsets = get_segments_offsets(uids)
+        return cls(
+            uid=uids[offsets[:-1]],
+            offsets=offsets,
+            iid=df['iid'].values.astype(iid_dtype),
+            prob=df[prob_name].values.astype(prob_dtype),
+            prob_name=prob_name,
+        )
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} users={self.n_users} '
+                f'rows={len(self)} size=\'{format_size(self.nbytes)}\'>')
+
+
+    def __len__(self):
+        return len(self.iid)
+
+
+    @property
+    def n_users(self):
+        return len(self.uid)
+
+
+    @property
+    def nbytes(self):
+        return (self.uid.nbytes + self.offsets.nbytes + self.iid.nbytes
+            + self.prob.nbytes)
+
+
+    def _get_users_positions(self, user_ids):
+        """ Positions of known users among `self.uid` (sorted, unique). """
+        user_ids = np.unique(_get_ids_array(user_ids))
+        if self.n_users == 0:
+            return np.array([], dtype='int64')
+        positions = np.searchsorted(self.uid, user_ids).clip(
+            max=self.n_users - 1)
+        return positions[self.uid[positions] == user_ids]
+
+
+    def _take_users(self, positions, n_limit=None):
+        """ Rows of users at `positions` (in given order). """
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        if n_limit is not None:
+            lengths = lengths.clip(max=n_limit)
+        rows = get_segments_positions(starts, lengths)
+        return (
+            self.uid[positions],
+            np.r_[0, np.cumsum(lengths)].astype('int64'),
+            rows,
+        )
+
+
+    def get_user(self, user_id):
+        """
+        Returns
+        -------
+        iid, prob: np.ndarray
+            Views of user's ranked predictions (empty for unknown user).
+        """
+        position = np.searchsorted(self.uid, user_id)
+        if position == self.n_users or self.uid[position] != user_id:
+            return self.iid[:0], self.prob[:0]
+        start, stop = self.offsets[position], self.offsets[position + 1]
+        return self.iid[start:stop], self.prob[start:stop]
+
+
+    def get_frame(self, user_ids=None, n_limit=None):
+        """
+        user_ids: None or list-like
+            Users to get predictions for (all users if None). Unknown users
+            are ignored.
+        n_limit: None or int
+            Maximum number of products per user.
+
+        Returns
+        -------
+        predictions: DataFrame
+            Columns (3): uid, iid, `prob_name`. Sorted by uid.
+        """
+        if user_ids is None and n_limit is None:
+            return self.to_frame()
+        if user_ids is None:
+            positions = np.arange(self.n_users)
+        else:
+            positions = self._get_users_positions(user_ids)
+        uid, offsets, rows = self._take_users(positions, n_limit)
+        return pd.DataFrame({
+            'uid': np.repeat(uid, np.diff(offsets)),
+            'iid': self.iid[rows],
+            self.prob_name: self.prob[rows],
+        })
+
+
+    def to_frame(self):
+        return pd.DataFrame({
+            'uid': np.repeat(self.uid, np.diff(self.offsets)),
+            'iid': self.iid,
+            self.prob_name: self.prob,
+        })
+
+
+    def iter_users(self, n_limit=None):
+        """ Yield (uid, iid) for every user, `iid` is a view. """
+        for i, uid in enumerate(self.uid):
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            if n_limit is not None:
+                stop = min(stop, start + n_limit)
+            yield uid, self.iid[start:stop]
+
+
+    def update(self, other, user_ids=None):
+        """
+        Replace predictions of `user_ids` (all users of `other` if None) with
+        predictions from `other`.
+
+        Returns
+        -------
+        store: PredictionsStore
+            New store.
+        """
+        if user_ids is None:
+            user_ids = other.uid
+        is_kept = ~np.isin(self.uid, _get_ids_array(user_ids))
+        uid_kept, offsets_kept, rows_kept = self._take_users(
+            np.flatnonzero(is_kept))
+
+        uid = np.concatenate([uid_kept, other.uid.astype(self.uid.dtype)])
+        lengths = np.r_[np.diff(offsets_kept), np.diff(other.offsets)]
+        iid = np.concatenate([self.iid[rows_kept],
+            other.iid.astype(self.iid.dtype)])
+        prob = np.concatenate([self.prob[rows_kept],
+            other.prob.astype(self.prob.dtype)])
+        starts = np.cumsum(lengths) - lengths
+
+        order = np.argsort(uid, kind='stable')
+        rows = get_segments_positions(starts[order], lengths[order])
+        return PredictionsStore(
+            uid=uid[order],
+            offsets=np.r_[0, np.cumsum(lengths[order])].astype('int64'),
+            iid=iid[rows],
+            prob=prob[rows],
+            prob_name=self.prob_name,
+        )
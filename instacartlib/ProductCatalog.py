@@ -0,0 +1,99 @@
+"""
+Compact read-only products catalog for serving.
+
+Capabilities:
+* Keep product names as one UTF-8 bytes buffer with offsets and product
+  ids as a sorted array - a few numpy arrays instead of millions of Python
+  string objects (no per-object refcounts / GC headers, so forked workers
+  share the pages copy-on-write without touching them).
+* Look up names of given products with binary search.
+
+Arrays:
+    iid          - (n_products,) uint32 sorted product ids
+    name_offsets - (n_products + 1,) int64, name of iid[i] is
+        names[name_offsets[i]:name_offsets[i+1]]
+    names        - (n_bytes,) uint8 UTF-8 encoded names
+"""
+
+from .utils import format_size
+
+import numpy as np
+
+
+class ProductCatalog:
+    """
+    Use `ProductCatalog.from_frame(df_prod)` to create from products frame.
+
+    iid, name_offsets, names: np.ndarray
+        See module docstring.
+    """
+    def __init__(self, iid, name_offsets, names):
+        if len(name_offsets) != len(iid) + 1 or name_offsets[-1] != len(names):
+            raise ValueError('`name_offsets` must have `len(iid) + 1` values '
+                'ending with `len(names)`.')
+        if np.any(iid[1:] <= iid[:-1]):
+            raise ValueError('`iid` must be sorted and unique.')
+        self.iid = iid
+        self.name_offsets = name_offsets
+        self.names = names
+
+
+    @classmethod
+    def from_frame(cls, df_prod):
+        """
+        df_prod: DataFrame
+            Required columns (2): iid, product_name
+        """
+        df_prod = df_prod.sort_values('iid')
+        encoded = [name.encode('utf-8') for name in df_prod.product_name]
+        lengths = np.fromiter(map(len, encoded), dtype='int64',
+            count=len(encoded))
+        return cls(
+            iid=df_prod.iid.values.astype('uint32'),
+            name_offsets=np.r_[0, np.cumsum(lengths)].astype('int64'),
+            names=np.frombuffer(b''.join(encoded), dtype='uint8'),
+        )
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} products={len(self)} '
+                f'size=\'{format_size(self.nbytes)}\'>')
+
+
+    def __len__(self):
+        return len(self.iid)
+
+
+    @property
+    def nbytes(self):
+        return self.iid.nbytes + self.name_offsets.nbytes + self.names.nbytes
+
+
+    @property
+    def arrays(self):
+        return {
+            'iid': self.iid,
+            'name_offsets': self.name_offsets,
+            'names': self.names,
+        }
+
+
+    def get_names(self, iids):
+        """
+        Returns
+        -------
+        names: list of str
+            Name of every product in `iids` (None for unknown products).
+        """
+        iids = np.asarray(iids)
+        if len(self.iid) == 0:
+            return [None] * len(iids)
+        positions = np.searchsorted(self.iid, iids).clip(max=len(self.iid) - 1)
+        is_known = self.iid[positions] == iids
+        starts = self.name_offsets[positions].tolist()
+        stops = self.name_offsets[positions + 1].tolist()
+        names = self.names
+        return [
+            bytes(names[start:stop]).decode('utf-8') if known else None
+            for start, stop, known in zip(starts, stops, is_known.tolist())
+        ]
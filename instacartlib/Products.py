@@ -2,6 +2,7 @@ from .utils import download_from_info
 from .utils import dummy_contextmanager
 from .utils import timer_contextmanager
 from .utils import get_df_info
+from .Profiler import Profiler
 
 from pathlib import Path
 
@@ -97,9 +98,13 @@ class Products:
 
     show_progress: {False, True}
         No op. Left for consistency with Transactions API.
+    profiler: None or Profiler
+        Record "ingest.*" stages.
     """
-    def __init__(self, show_progress=False):
+    def __init__(self, show_progress=False, profiler=None):
         self.show_progress = show_progress
+        self.profiler = (Profiler(enabled=False) if profiler is None
+            else profiler)
 
         self.df = None
 
@@ -132,8 +137,10 @@ class Products:
             API consistency with Transactions. No op.
         """
         products_csv_path = get_products_csv_path(path_dir)
-        with self._timer(f'Reading "{products_csv_path.name}" ...'):
+        with self.profiler.stage('ingest.products') as event, \
+                self._timer(f'Reading "{products_csv_path.name}" ...'):
             self.df = read_products_csv(products_csv_path)
+            event.rows_out = len(self.df)
         return self
 
     def __repr__(self):
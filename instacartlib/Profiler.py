@@ -0,0 +1,270 @@
+"""
+Per-stage timing and memory instrumentation.
+
+Capabilities:
+* Record pipeline stages (ingest, preprocessing, feature extraction,
+  training, scoring, export) as `StageEvent` objects: wall time, CPU time,
+  rows in / out, peak RSS growth and (optionally) `tracemalloc` peak.
+* Export recorded events to JSON or Chrome trace format (open in
+  `chrome://tracing` or https://ui.perfetto.dev).
+* Bounded memory: only the last `max_events` events are kept, so a
+  long-running process (e.g. prediction server) can keep profiling.
+
+```python
+    profiler = Profiler()
+    with profiler.stage('preprocess.transactions', rows_in=len(df)) as event:
+        df_trns = preprocess(df)
+        event.rows_out = len(df_trns)
+    profiler.to_chrome_trace('trace.json')
+```
+"""
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  #pragma: no cover
+    # Not available on Windows
+    resource = None
+
+
+def get_rss_peak_bytes():
+    """ Peak resident set size of the current process (None if unknown). """
+    if resource is None:  #pragma: no cover
+        return None
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: kilobytes, macOS: bytes
+    return rss_peak if sys.platform == 'darwin' else rss_peak * 1024
+
+
+def get_process_memory(pid='self'):
+    """
+    Memory of a process from `/proc/<pid>/smaps_rollup` (Linux), bytes:
+    rss, pss (shared pages divided by the number of sharing processes),
+    shared (clean + dirty), private (clean + dirty). Empty dict if unknown.
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            lines = f.read().splitlines()
+    except OSError:  #pragma: no cover
+        return {}
+    values = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if value.strip().endswith('kB'):
+            values[name] = int(value.split()[0]) * 1024
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'shared': values.get('Shared_Clean', 0)
+            + values.get('Shared_Dirty', 0),
+        'private': values.get('Private_Clean', 0)
+            + values.get('Private_Dirty', 0),
+    }
+
+
+class StageEvent:
+    """
+    name: str
+        Stage name, dot-separated (e.g. "features.extractor.buy_counts").
+    start: float
+        Seconds since the profiler has been created.
+    wall_time, cpu_time: float
+        Seconds.
+    rows_in, rows_out: None or int
+        Size of the stage's input / output (set by instrumented code).
+    rss_peak_delta: None or int
+        Growth of the process' peak RSS during the stage (bytes). 0 means the
+        stage has not exceeded previous peak.
+    tracemalloc_peak: None or int
+        Peak of memory allocated by Python during the stage relative to its
+        start (bytes). Recorded only if profiler has `trace_memory=True`.
+    depth: int
+        Nesting level (0 for top level stages).
+    """
+    def __init__(self, name, start, depth=0, rows_in=None):
+        self.name = name
+        self.start = start
+        self.depth = depth
+        self.thread_id = threading.get_ident()
+        self.wall_time = None
+        self.cpu_time = None
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.rss_peak_delta = None
+        self.tracemalloc_peak = None
+
+
+    def __repr__(self):
+        wall_time = (
+            'None' if self.wall_time is None else f'{self.wall_time:.3}s')
+        return (f'<{self.__class__.__name__} name="{self.name}" '
+                f'wall_time={wall_time} rows_in={self.rows_in} '
+                f'rows_out={self.rows_out}>')
+
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'start': self.start,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rss_peak_delta': self.rss_peak_delta,
+            'tracemalloc_peak': self.tracemalloc_peak,
+            'depth': self.depth,
+            'thread_id': self.thread_id,
+        }
+
+
+class Profiler:
+    """
+    enabled: {True, False}
+        If False, `stage()` only yields a dummy event (nothing is recorded).
+    trace_memory: {False, True}
+        Record `tracemalloc` peak for every stage (starts `tracemalloc` if
+        it's not started yet). Slows down allocation-heavy code.
+    max_events: int
+        Keep only the last `max_events` recorded events.
+
+    Stages may be nested (nesting is tracked per thread). Events of all
+    threads are recorded (thread-safe), but `tracemalloc` peaks are
+    process-wide: with `trace_memory=True` stages of concurrent threads
+    include each other's allocations.
+    """
+    def __init__(self, enabled=True, trace_memory=False, max_events=10_000):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.max_events = max_events
+        self._events = collections.deque(maxlen=max_events)
+        self._events_lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._local = threading.local()
+
+        if self.enabled and self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} events={len(self._events)}>'
+
+
+    @property
+    def events(self):
+        """ Recorded events (in order of completion), the last
+        `max_events` of them. """
+        with self._events_lock:
+            return list(self._events)
+
+
+    @property
+    def _stack(self):
+        """ Open stages of the current thread. """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Context manager to record a stage. Yields `StageEvent` which can be
+        used to set `rows_out` (or `rows_in`) inside the block.
+        """
+        event = StageEvent(name, start=time.perf_counter() - self._t0,
+            depth=len(self._stack), rows_in=rows_in)
+        if not self.enabled:
+            yield event
+            return
+
+        frame = {'tracemalloc_start': None, 'tracemalloc_peak': 0}
+        if self.trace_memory:
+            frame['tracemalloc_start'], _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+        rss_peak_start = get_rss_peak_bytes()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event.wall_time = time.perf_counter() - wall_start
+            event.cpu_time = time.process_time() - cpu_start
+            rss_peak_end = get_rss_peak_bytes()
+            if rss_peak_start is not None:
+                event.rss_peak_delta = rss_peak_end - rss_peak_start
+            self._stack.pop()
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                # Nested stages reset the peak, take their peaks into account
+                peak = max(peak, frame['tracemalloc_peak'])
+                event.tracemalloc_peak = peak - frame['tracemalloc_start']
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent['tracemalloc_peak'] = max(
+                        parent['tracemalloc_peak'], peak)
+            with self._events_lock:
+                self._events.append(event)
+
+
+    def clear(self):
+        with self._events_lock:
+            self._events.clear()
+        return self
+
+
+    def get_events(self, prefix=''):
+        """ Recorded events (in order of completion) with names starting with
+        `prefix`. """
+        return [event for event in self.events
+            if event.name.startswith(prefix)]
+
+
+    def to_json(self, path=None):
+        """
+        Events as JSON list of dicts (see `StageEvent.to_dict`). Write to
+        `path` if provided.
+        """
+        output = json.dumps([event.to_dict() for event in self.events],
+            indent=2)
+        if path is not None:
+            with open(path, 'wt') as f:
+                f.write(output)
+        return output
+
+
+    def to_chrome_trace(self, path=None):
+        """
+        Events in Chrome trace event format ("X" complete events,
+        microseconds). Write to `path` if provided.
+        """
+        pid = os.getpid()
+        trace_events = [{
+            'name': event.name,
+            'cat': event.name.split('.')[0],
+            'ph': 'X',
+            'ts': event.start * 1e6,
+            'dur': event.wall_time * 1e6,
+            'pid': pid,
+            'tid': event.thread_id,
+            'args': {
+                key: value
+                for key, value in event.to_dict().items()
+                if key not in ['name', 'start', 'wall_time', 'thread_id']
+            },
+        } for event in self.events]
+        output = json.dumps({'traceEvents': trace_events,
+            'displayTimeUnit': 'ms'})
+        if path is not None:
+            with open(path, 'wt') as f:
+                f.write(output)
+        return output
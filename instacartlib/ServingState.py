@@ -0,0 +1,82 @@
+"""
+Immutable snapshot of everything needed to serve predictions.
+
+Capabilities:
+* Hold model (with its `ModelBundle`), predictions (`PredictionsStore`),
+  products catalog (`ProductCatalog`) and popularity tables for cold start
+  (`PopularProducts`) of one consistent version.
+* New versions are created with `replace()` (the snapshot itself can't be
+  changed), so a reader holding a snapshot never sees a half-updated state
+  and needs no locks. Writers publish a new snapshot with a single
+  attribute assignment (atomic in Python).
+"""
+
+from .PredictionsStore import PredictionsStore
+from .ProductCatalog import ProductCatalog
+
+import time
+
+import numpy as np
+
+
+class ServingState:
+    """
+    model: None or estimator
+    bundle: None or ModelBundle
+        Bundle of `model` (features schema and scaler).
+    predictions_store: PredictionsStore
+    catalog: ProductCatalog
+    popular_products: None or PopularProducts
+        Not changed after publishing (see `PopularProducts`).
+    version: int
+        Incremented by every `replace()`.
+    """
+    __slots__ = ('model', 'bundle', 'predictions_store', 'catalog',
+        'popular_products', 'version', 'created_at')
+
+    def __init__(self, model=None, predictions_store=None, catalog=None,
+            popular_products=None, bundle=None, version=0):
+        if predictions_store is None:
+            predictions_store = PredictionsStore.empty()
+        if catalog is None:
+            catalog = ProductCatalog(np.array([], dtype='uint32'),
+                np.zeros(1, dtype='int64'), np.array([], dtype='uint8'))
+        for name, value in [
+                ('model', model),
+                ('bundle', bundle),
+                ('predictions_store', predictions_store),
+                ('catalog', catalog),
+                ('popular_products', popular_products),
+                ('version', version),
+                ('created_at', time.time())]:
+            object.__setattr__(self, name, value)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable, use '
+            f'`.replace({name}=...)`.')
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} version={self.version} '
+                f'users={self.predictions_store.n_users} '
+                f'products={len(self.catalog)}>')
+
+
+    def replace(self, **changes):
+        """
+        Returns
+        -------
+        state: ServingState
+            New snapshot with given fields changed and the next version.
+        """
+        fields = {
+            'model': self.model,
+            'bundle': self.bundle,
+            'predictions_store': self.predictions_store,
+            'catalog': self.catalog,
+            'popular_products': self.popular_products,
+            **changes,
+            'version': self.version + 1,
+        }
+        return ServingState(**fields)
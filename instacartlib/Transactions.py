@@ -6,14 +6,30 @@ Capabilities:
   appropriate dtype.
 * Deal with NaNs.
 * Limit number of orders to N most recent (per user).
+* Append new orders to already loaded transactions.
+* Append-only log: store appended orders as binary delta segments and merge
+  them periodically into a binary base (compaction).
+
+Directory layout (besides `transactions.csv`):
+    transactions_base/          - compacted transactions, one `*.npy` file
+                                  per column (read instead of csv file),
+                                  `manifest.json` lists delta segments the
+                                  base includes
+    transactions_delta/*.npz    - delta segments, applied in name order
+                                  (except segments the base includes)
 """
 
 from .utils import download_from_info
 from .utils import dummy_contextmanager
 from .utils import timer_contextmanager
 from .utils import get_df_info
+from .utils import get_existing_dir_path
+from .utils import replace_dir
+from .Profiler import Profiler
 
+import json
 from pathlib import Path
+import shutil
 
 import numpy as np
 import pandas as pd
@@ -21,6 +37,9 @@ import pandas as pd
 
 TRANSACTIONS_FILENAME = 'transactions.csv'
 TRANSACTIONS_ZIP_FILENAME = 'transactions.csv.zip'
+TRANSACTIONS_BASE_DIRNAME = 'transactions_base'
+TRANSACTIONS_DELTA_DIRNAME = 'transactions_delta'
+MANIFEST_FILENAME = 'manifest.json'
 REDUCED_DATASET_N_ROWS = 1_571_044  # 6000 user ids
 EXCLUDE_COLUMNS = []
 RAW_COLUMNS_DTYPES = {
@@ -99,6 +118,129 @@ def read_transactions_csv(filepath_or_buffer, nrows=None, exclude_columns=None):
     return df_raw
 
 
+def write_transactions_npy(df_raw, path_dir, delta_names=()):
+    """
+    Write raw transactions to directory as one `<column>.npy` file per column.
+    The directory is replaced crash-safely (written to a temporary directory
+    first, the previous one is renamed aside, see `utils.replace_dir`).
+
+    delta_names: sequence of str
+        Names of delta segments included in `df_raw`, written to
+        `manifest.json` (see `read_transactions_manifest`).
+    """
+    path_dir = Path(path_dir)
+    tmp_dir = path_dir.with_name(path_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    for col in df_raw.columns:
+        np.save(tmp_dir / f'{col}.npy', df_raw[col].values)
+    with open(tmp_dir / MANIFEST_FILENAME, 'wt') as f:
+        json.dump({'deltas': sorted(delta_names)}, f, indent=2)
+    replace_dir(tmp_dir, path_dir)
+
+
+def read_transactions_manifest(path_dir):
+    """
+    Returns
+    -------
+    delta_names: set of str
+        Delta segments included in transactions written by
+        `write_transactions_npy` to `path_dir` (empty if no manifest).
+    """
+    manifest_path = Path(path_dir) / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        return set()
+    with open(manifest_path, 'rt') as f:
+        return set(json.load(f)['deltas'])
+
+
+def read_transactions_npy(path_dir, nrows=None):
+    """
+    Read raw transactions written by `write_transactions_npy`.
+    """
+    missing_columns = [col for col in RAW_COLUMNS_DTYPES
+        if not (Path(path_dir) / f'{col}.npy').exists()]
+    if missing_columns:
+        raise InvalidTransactionsData(
+            f'Transactions directory "{path_dir}"',
+            f'Missing columns: {missing_columns}')
+    return pd.DataFrame({
+        col: np.array(
+            np.load(Path(path_dir) / f'{col}.npy', mmap_mode='r')[:nrows])
+        for col in RAW_COLUMNS_DTYPES
+    })
+
+
+def write_transactions_delta(df_raw, path):
+    """
+    Write raw transactions to a delta segment file (uncompressed `*.npz`, one
+    array per column).
+    """
+    with open(path, 'wb') as f:
+        np.savez(f, **{col: df_raw[col].values for col in df_raw.columns})
+
+
+def read_transactions_delta(path):
+    with np.load(path) as npz:
+        return pd.DataFrame({col: npz[col] for col in npz.files})
+
+
+def get_transactions_delta_paths(path_dir):
+    delta_dir = Path(path_dir) / TRANSACTIONS_DELTA_DIRNAME
+    return sorted(delta_dir.glob('*.npz'))
+
+
+def _get_next_delta_path(path_dir):
+    # Numbers of compacted segments aren't reused: leftovers of an
+    # interrupted compaction are skipped by name
+    names = [path.name for path in get_transactions_delta_paths(path_dir)]
+    base_dir = get_existing_dir_path(
+        Path(path_dir) / TRANSACTIONS_BASE_DIRNAME)
+    if base_dir is not None:
+        names += read_transactions_manifest(base_dir)
+    next_n = max(int(Path(name).stem) for name in names) + 1 if names else 1
+    return Path(path_dir) / TRANSACTIONS_DELTA_DIRNAME / f'{next_n:06d}.npz'
+
+
+def get_users_last_order_number(df_raw):
+    """
+    Returns
+    -------
+    last_order_number: pd.Series
+        Index: user_id
+        Value: order_number of the most recent order
+    """
+    return df_raw.groupby('user_id').order_number.max()
+
+
+def validate_orders_progression(df_raw_new, users_last_order_number):
+    """
+    Check that new orders continue per user `order_number` progression: the
+    first new order of each user follows user's last order (or is 1 for new
+    users) and the rest follow one another.
+
+    Raises
+    ------
+    InvalidTransactionsData
+    """
+    df_orders = df_raw_new.drop_duplicates('order_id')
+    last_order_number = (
+        users_last_order_number
+        .reindex(df_orders.user_id, fill_value=0)
+        .values
+        .astype('int64')
+    )
+    expected = (last_order_number + 1
+        + df_orders.groupby('user_id').cumcount().values)
+    is_invalid = df_orders.order_number.values.astype('int64') != expected
+    if is_invalid.any():
+        invalid_user_ids = df_orders.user_id[is_invalid].unique()
+        raise InvalidTransactionsData(
+            f'New orders don\'t continue `order_number` progression for '
+            f'{len(invalid_user_ids)} users: {invalid_user_ids[:10].tolist()}')
+
+
 class Transactions:
     """
     Transactions data manipulator.
@@ -120,12 +262,20 @@ class Transactions:
 
     show_progress: {False, True}
         Print messages with progress information for long operations.
+    profiler: None or Profiler
+        Record "ingest.*" stages.
     """
-    def __init__(self, iord_start_count=0, show_progress=False):
+    def __init__(self, iord_start_count=0, show_progress=False, profiler=None):
         self.iord_start_count = iord_start_count
         self.show_progress = show_progress
+        self.profiler = (Profiler(enabled=False) if profiler is None
+            else profiler)
 
         self.df = None
+        self._users_last_order_number = None
+        self._delta_paths = []
+        self._compacted_delta_paths = []
+        self._reduced = False
 
 
     def __repr__(self):
@@ -150,11 +300,138 @@ class Transactions:
             files.
         reduced: {False, True}
             Read transactions for the first 6000 users.
+
+        If compacted transactions (`transactions_base/`) exist they are read
+        instead of csv file. Delta segments (`transactions_delta/*.npz`) are
+        appended afterwards, except segments the base already includes
+        (left by an interrupted `compact`).
         """
-        transactions_csv_path = get_transactions_csv_path(path_dir)
         n_rows = REDUCED_DATASET_N_ROWS if reduced else None
-        with self._timer(f'Reading "{transactions_csv_path.name}" ...'):
-            self.df = read_transactions_csv(transactions_csv_path, n_rows)
+        base_dir = get_existing_dir_path(
+            Path(path_dir) / TRANSACTIONS_BASE_DIRNAME)
+        compacted_names = set()
+        with self.profiler.stage('ingest.transactions') as event:
+            if base_dir is not None:
+                compacted_names = read_transactions_manifest(base_dir)
+                with self._timer(f'Reading "{base_dir.name}" ...'):
+                    self.df = read_transactions_npy(base_dir, n_rows)
+            else:
+                transactions_csv_path = get_transactions_csv_path(path_dir)
+                with self._timer(
+                        f'Reading "{transactions_csv_path.name}" ...'):
+                    self.df = read_transactions_csv(transactions_csv_path,
+                        n_rows)
+            event.rows_out = len(self.df)
+        self._users_last_order_number = None
+        self._reduced = reduced
+
+        delta_paths = get_transactions_delta_paths(path_dir)
+        self._compacted_delta_paths = [path for path in delta_paths
+            if path.name in compacted_names]
+        self._delta_paths = [path for path in delta_paths
+            if path.name not in compacted_names]
+        if len(self._delta_paths) == 0:
+            return self
+
+        base_user_ids = self._get_users_last_order_number().index
+        dfs_delta = []
+        with self.profiler.stage('ingest.transactions_delta') as event, \
+                self._timer(f'Reading {len(self._delta_paths)} delta '
+                    f'segments ...'):
+            for delta_path in self._delta_paths:
+                df_delta = read_transactions_delta(delta_path)
+                if reduced:
+                    df_delta = df_delta[df_delta.user_id.isin(base_user_ids)]
+                dfs_delta.append(self._validate_new_orders(df_delta))
+            self.df = pd.concat([self.df, *dfs_delta], ignore_index=True)
+            event.rows_out = sum(map(len, dfs_delta))
+        return self
+
+
+    def _get_users_last_order_number(self):
+        if self._users_last_order_number is None:
+            self._users_last_order_number = get_users_last_order_number(
+                self.df)
+        return self._users_last_order_number
+
+
+    def append(self, df_raw, path_dir=None):
+        """
+        Append raw transactions (new orders) to `self.df`.
+
+        df_raw: DataFrame
+            Raw transactions (same columns as `read_transactions_csv` output).
+            User's new orders have to continue user's `order_number`
+            progression (see `validate_orders_progression`).
+        path_dir: None, str or pathlib.Path
+            If provided, also write `df_raw` to `path_dir` as a new delta
+            segment, so following `read_dir` calls include these orders
+            (also if nothing has been read or appended before).
+        """
+        if self.df is not None:
+            df_raw = self._validate_new_orders(df_raw)
+        if path_dir is not None:
+            delta_path = _get_next_delta_path(path_dir)
+            delta_path.parent.mkdir(parents=True, exist_ok=True)
+            write_transactions_delta(df_raw, delta_path)
+            self._delta_paths.append(delta_path)
+
+        if self.df is None:
+            self.df = df_raw.reset_index(drop=True)
+            self._users_last_order_number = None
+        else:
+            self.df = pd.concat([self.df, df_raw], ignore_index=True)
+        return self
+
+
+    def _validate_new_orders(self, df_raw):
+        """
+        Validate new orders against orders in `self.df` and orders validated
+        before (not yet in `self.df`).
+
+        Returns
+        -------
+        df_raw: DataFrame
+            New orders with columns and dtypes of `self.df`.
+        """
+        missing_columns = set(self.df.columns) - set(df_raw.columns)
+        if missing_columns:
+            raise InvalidTransactionsData(
+                f'Missing columns in appended transactions: {missing_columns}')
+        df_raw = df_raw.loc[:, self.df.columns].astype(self.df.dtypes)
+
+        users_last_order_number = self._get_users_last_order_number()
+        validate_orders_progression(df_raw, users_last_order_number)
+        self._users_last_order_number = (
+            get_users_last_order_number(df_raw)
+            .combine_first(users_last_order_number)
+            .astype(users_last_order_number.dtype)
+        )
+        return df_raw
+
+
+    def compact(self, path_dir):
+        """
+        Write `self.df` (base and appended delta segments) to `path_dir` as
+        compacted transactions and delete delta segments it includes.
+
+        The new base lists the segments in its manifest, so if deleting them
+        is interrupted, `read_dir` skips the ones left.
+        """
+        if self._reduced:
+            raise ValueError('Transactions were read with `reduced=True`, '
+                'compaction would drop other users\' transactions. Use '
+                '`.read_dir(path_dir)` before `.compact(path_dir)`.')
+        delta_paths = self._compacted_delta_paths + self._delta_paths
+        with self._timer(f'Compacting {len(self._delta_paths)} delta '
+                f'segments ...'):
+            write_transactions_npy(self.df,
+                Path(path_dir) / TRANSACTIONS_BASE_DIRNAME,
+                delta_names=[Path(path).name for path in delta_paths])
+            for delta_path in delta_paths:
+                Path(delta_path).unlink(missing_ok=True)
+            self._delta_paths = []
+            self._compacted_delta_paths = []
         return self
 
 
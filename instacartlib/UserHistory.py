@@ -0,0 +1,336 @@
+"""
+Order history of a single user and its features without dataframes pipeline.
+
+Capabilities:
+* Hold one user's orders as small arrays (CSR-like: orders, products, cart
+  positions, `days_since_prior_order`).
+* Create from preprocessed frames of the user (see
+  `InstacartDataset.get_users_dataframes`) or from a list of baskets, append
+  a fresh basket.
+* Compute the user's UI feature rows with numpy in about a millisecond.
+  Values and dtypes are identical to the built-in extractors
+  (`feature_extractors`) run on the whole dataset, given global item
+  features (`df_i`, see `ItemStats.get_features`).
+* Guard against the two paths drifting apart (`check_extractors`): only
+  the built-in extractors of the versions this module reproduces
+  (`EXTRACTORS_VERSIONS`) are supported, other registered extractors
+  (plugins) or changed extractors raise an error.
+* Used by `NextBasketPrediction.get_history_predictions` (real-time
+  predictions for a history with a fresh basket).
+
+Arrays:
+    days_since_prior_order - (n_orders,) int8, -1 for the first order
+    order_offsets - (n_orders + 1,) int64, products of order k are
+        order_offsets[k]:order_offsets[k+1]
+    iid      - (n_transactions,) uint32 product ids in cart order
+    cart_pos - (n_transactions,) uint8 add to cart order (1-based)
+"""
+
+from .ModelBundle import get_extractors_versions
+
+import numpy as np
+import pandas as pd
+
+
+# Extractors reproduced by `UserHistory.get_features`: {name: version} (see
+# `ModelBundle.get_extractors_versions`). When an extractor changes, update
+# `get_features` and its version here (tests compare both paths).
+EXTRACTORS_VERSIONS = {
+    '000_ui_in_target.in_target': '2227af6b397d4707',
+    '001_ui_buy_counts.buy_counts': 'b8ba979dffbea135',
+    '002_ui_avg_cart_pos.avg_cart_pos': '203a4037c4473f83',
+    '003_ui_buy_delays.buy_delays': '43870c807690a831',
+}
+
+# Values of items missing in `df_i` and dtypes (same as in extractors)
+ITEM_FEATURES_FILL_VALUES = {
+    'i_n_popularity': (0, 'uint32'),
+    'i_n_orders_mid': (0, 'float32'),
+    'i_days_delay_global_mid': (999., 'float32'),
+}
+
+
+def _get_groups_median(values, groups, n_groups):
+    """
+    Median of `values` (NaN skipped) for every group in range(n_groups), as
+    pandas groupby median: float64, mean of two middle values for even
+    sizes, NaN for groups without values.
+    """
+    values = np.asarray(values, dtype='float64')
+    is_valid = ~np.isnan(values)
+    values, groups = values[is_valid], groups[is_valid]
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    has_values = counts > 0
+    lo = starts + (counts - 1) // 2
+    hi = starts + counts // 2
+    median = np.full(n_groups, np.nan)
+    median[has_values] = (values[hi[has_values]]
+        + values[lo[has_values]]) / 2
+    return median
+
+
+def check_extractors(feature_extractors):
+    """
+    Raise ValueError if features of `feature_extractors` ({name: function},
+    see `FeaturesDataset.feature_extractors`) aren't the ones
+    `UserHistory.get_features` computes: unknown extractors (e.g. plugins)
+    or built-in extractors changed since (see `EXTRACTORS_VERSIONS`).
+    """
+    unknown = sorted(set(feature_extractors) - set(EXTRACTORS_VERSIONS))
+    if unknown:
+        raise ValueError(f'Single-user features are computed for built-in '
+            f'extractors only, got: {unknown}. Use '
+            f'`FeaturesDataset.extract_users_features`.')
+    versions = get_extractors_versions(feature_extractors)
+    changed = sorted(name for name, version in versions.items()
+        if version != EXTRACTORS_VERSIONS[name])
+    if changed:
+        raise ValueError(f'Feature extractors changed since '
+            f'`UserHistory.get_features` was written: {changed}. Update it '
+            f'and `EXTRACTORS_VERSIONS`.')
+
+
+class UserHistory:
+    """
+    Use `UserHistory.from_frames(df_ord, df_trns)` or
+    `UserHistory.from_orders(orders)` to create.
+
+    days_since_prior_order, order_offsets, iid, cart_pos: np.ndarray
+        See module docstring.
+    uid: int
+        User id (index level of features).
+    """
+    def __init__(self, days_since_prior_order, order_offsets, iid, cart_pos,
+            uid=0):
+        if len(order_offsets) != len(days_since_prior_order) + 1 or (
+                order_offsets[-1] != len(iid)):
+            raise ValueError('`order_offsets` must have `n_orders + 1` '
+                'values ending with `len(iid)`.')
+        if len(iid) != len(cart_pos):
+            raise ValueError('`iid` and `cart_pos` must have the same length.')
+        if np.any(np.diff(order_offsets) <= 0):
+            raise ValueError('Every order must have at least one product.')
+        self.days_since_prior_order = np.asarray(days_since_prior_order,
+            dtype='int8')
+        self.order_offsets = np.asarray(order_offsets, dtype='int64')
+        self.iid = np.asarray(iid, dtype='uint32')
+        self.cart_pos = np.asarray(cart_pos, dtype='uint8')
+        self.uid = uid
+
+
+    @classmethod
+    def from_frames(cls, df_ord, df_trns, uid=None):
+        """
+        df_ord: DataFrame
+            Required columns (3): order_id, order_n, days_since_prior_order
+        df_trns: DataFrame
+            Required columns (3): order_id, iid, cart_pos. Transactions of
+            the same user in temporal order (as in `InstacartDataset`).
+        uid: None or int
+            User id (taken from `df_trns.uid` if None).
+        """
+        if uid is None:
+            uids = df_trns.uid.unique()
+            if len(uids) != 1:
+                raise ValueError(f'Transactions of a single user expected, '
+                    f'got users: {uids[:10].tolist()}')
+            uid = uids[0]
+        df_ord = (df_ord[df_ord.order_id.isin(df_trns.order_id)]
+            .sort_values('order_n'))
+        order_idx = pd.Index(df_ord.order_id).get_indexer(df_trns.order_id)
+        if np.any(np.diff(order_idx) < 0):
+            raise ValueError('Transactions must be in temporal order.')
+        counts = np.bincount(order_idx, minlength=len(df_ord))
+        return cls(
+            days_since_prior_order=df_ord.days_since_prior_order.values,
+            order_offsets=np.r_[0, np.cumsum(counts)],
+            iid=df_trns.iid.values,
+            cart_pos=df_trns.cart_pos.values,
+            uid=uid,
+        )
+
+
+    @classmethod
+    def from_orders(cls, orders, uid=0):
+        """
+        orders: list of (days_since_prior_order, iids)
+            Baskets in temporal order, products in cart order.
+            `days_since_prior_order` is None (or -1) for the first order.
+        """
+        empty = cls(np.array([], dtype='int8'), np.zeros(1, dtype='int64'),
+            np.array([], dtype='uint32'), np.array([], dtype='uint8'), uid)
+        for days_since_prior_order, iids in orders:
+            empty = empty.add_order(iids, days_since_prior_order)
+        return empty
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} uid={self.uid} '
+                f'orders={self.n_orders} transactions={len(self.iid)}>')
+
+
+    @property
+    def n_orders(self):
+        return len(self.days_since_prior_order)
+
+
+    def add_order(self, iids, days_since_prior_order=None):
+        """
+        Returns
+        -------
+        history: UserHistory
+            New history with the basket `iids` (in cart order) appended.
+        """
+        iids = np.asarray(iids, dtype='uint32')
+        if days_since_prior_order is None:
+            days_since_prior_order = -1
+        return UserHistory(
+            days_since_prior_order=np.r_[self.days_since_prior_order,
+                days_since_prior_order].astype('int8'),
+            order_offsets=np.r_[self.order_offsets,
+                self.order_offsets[-1] + len(iids)],
+            iid=np.r_[self.iid, iids],
+            cart_pos=np.r_[self.cart_pos, np.arange(1, len(iids) + 1)],
+            uid=self.uid,
+        )
+
+
+    def tail(self, n_orders):
+        """ History limited to `n_orders` most recent orders (None - all). """
+        if n_orders is None or n_orders >= self.n_orders:
+            return self
+        start = self.order_offsets[-n_orders - 1]
+        return UserHistory(
+            days_since_prior_order=self.days_since_prior_order[-n_orders:],
+            order_offsets=self.order_offsets[-n_orders - 1:] - start,
+            iid=self.iid[start:],
+            cart_pos=self.cart_pos[start:],
+            uid=self.uid,
+        )
+
+
+    def get_days_until_same_item(self):
+        """
+        Same as `days_until_same_item` column of `InstacartDataset.df_trns`.
+
+        Returns
+        -------
+        days_until_same_item: np.ndarray
+            (n_transactions,) float32
+        """
+        days = self.days_since_prior_order
+        # Days from every order until the last one (uint16 as in batch)
+        days_until_next = np.r_[days[1:], 0].astype('int64')
+        days_until_last = np.cumsum(days_until_next[::-1])[::-1].astype(
+            'uint16')
+        days_prior = days[days != -1]
+        days_between_mid = np.float16(
+            np.median(days_prior.astype('float64')) if len(days_prior)
+            else np.nan)
+        days_until_target = (days_until_last + days_between_mid).astype(
+            'float32')
+
+        lengths = np.diff(self.order_offsets)
+        trns_days = np.repeat(days_until_target, lengths)
+        # Next purchase of the same item (same days as target if none)
+        order = np.lexsort((np.arange(len(self.iid)), self.iid))
+        is_next_same = self.iid[order][1:] == self.iid[order][:-1]
+        shifted = np.zeros(len(self.iid), dtype='float32')
+        shifted[order[:-1][is_next_same]] = trns_days[order[1:][is_next_same]]
+        return trns_days - shifted
+
+
+    def get_features(self, df_i, feature_extractors=None):
+        """
+        df_i: DataFrame
+            Global item features indexed by iid (see `ItemStats`). Items
+            missing in `df_i` get the same values as in extractors.
+        feature_extractors: None or dict
+            Extractors the features are expected from, checked with
+            `check_extractors` (not checked if None).
+
+        Returns
+        -------
+        df_ui: DataFrame
+            Index: (uid, iid), products in order of the first purchase
+            Columns (21): same as built-in extractors' features.
+        """
+        if feature_extractors is not None:
+            check_extractors(feature_extractors)
+        n_orders = self.n_orders
+        lengths = np.diff(self.order_offsets)
+        order_r = np.repeat(np.arange(n_orders, 0, -1), lengths).astype(
+            'uint8')
+
+        iids, first, inverse, counts = np.unique(self.iid, return_index=True,
+            return_inverse=True, return_counts=True)
+        # Items in order of the first purchase
+        order = np.argsort(first, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        groups = rank[inverse]
+        iids, first, counts = iids[order], first[order], counts[order]
+        n_items = len(iids)
+
+        u_n_orders = order_r[:1].repeat(n_items)
+        ui_n_chances = order_r[first]
+        ui_total_buy = counts.astype('uint8')
+        days = self.get_days_until_same_item()
+        ui_days_delay_max = np.full(n_items, np.nan, dtype='float32')
+        np.fmax.at(ui_days_delay_max, groups, days)
+        last = np.zeros(n_items, dtype='int64')
+        np.maximum.at(last, groups, np.arange(len(days)))
+        ui_days_passed = days[last]
+        ui_days_delay_mid = _get_groups_median(days, groups,
+            n_items).astype('float32')
+
+        positions = df_i.index.get_indexer(iids)
+        is_known = positions >= 0
+        item_features = {}
+        for name, (fill, dtype) in ITEM_FEATURES_FILL_VALUES.items():
+            item_features[name] = np.full(n_items, fill, dtype=dtype)
+            item_features[name][is_known] = (
+                df_i[name].values[positions[is_known]])
+        i_n_popularity, i_n_orders_mid, i_days_delay_global_mid = (
+            item_features.values())
+
+        ui_readyness_max = ui_days_passed - ui_days_delay_max
+        ui_readyness_mid = ui_days_passed - ui_days_delay_mid
+        ui_readyness_global_mid = ui_days_passed - i_days_delay_global_mid
+
+        # Levels are known, no factorization needed
+        index = pd.MultiIndex(
+            levels=[np.array([self.uid], dtype='uint32'), iids],
+            codes=[np.zeros(n_items, dtype='int64'), np.arange(n_items)],
+            names=['uid', 'iid'], verify_integrity=False)
+        return pd.DataFrame({
+            'u_n_orders': u_n_orders,
+            'ui_n_chances': ui_n_chances,
+            'ui_total_buy': ui_total_buy,
+            'ui_total_buy_ratio': (ui_total_buy / u_n_orders).astype(
+                'float32'),
+            'ui_chance_buy_ratio': (ui_total_buy / ui_n_chances).astype(
+                'float32'),
+            'u_n_transactions': np.full(n_items, len(self.iid),
+                dtype='uint32'),
+            'u_unique_items': np.full(n_items, n_items, dtype='uint32'),
+            'u_order_size_mid': np.full(n_items,
+                np.median(lengths.astype('float64')), dtype='float32'),
+            'i_n_popularity': i_n_popularity,
+            'i_n_orders_mid': i_n_orders_mid,
+            'ui_avg_cart_pos': (np.bincount(groups, weights=self.cart_pos,
+                minlength=n_items) / counts).astype('float32'),
+            'ui_days_delay_max': ui_days_delay_max,
+            'ui_days_delay_mid': ui_days_delay_mid,
+            'i_days_delay_global_mid': i_days_delay_global_mid,
+            'ui_days_passed': ui_days_passed,
+            'ui_readyness_max': ui_readyness_max,
+            'ui_readyness_max_abs': np.abs(ui_readyness_max),
+            'ui_readyness_mid': ui_readyness_mid,
+            'ui_readyness_mid_abs': np.abs(ui_readyness_mid),
+            'ui_readyness_global_mid': ui_readyness_global_mid,
+            'ui_readyness_global_mid_abs': np.abs(ui_readyness_global_mid),
+        }, index=index)
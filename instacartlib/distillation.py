@@ -0,0 +1,121 @@
+"""
+Distillation of a model (teacher) into a compact student for
+latency-critical serving.
+
+Capabilities:
+* Fit a shallow gradient boosting regressor on the teacher's log-odds over
+  train features (soft targets: the student learns the teacher's scores,
+  not only its classes). Any model with `predict_proba` can be the teacher
+  (e.g. CatBoost).
+* Student is compiled to `TreeEnsemble` (numpy only, no sklearn or
+  catboost needed to load and score) and bundled with the teacher's
+  features schema and scaler (`ModelBundle`), so it's saved and loaded as a
+  regular model.
+* Report on held-out users: accuracy (vs target), agreement with the
+  teacher's classes and top-K products, probabilities difference, scoring
+  time and model size of the teacher and the student.
+"""
+
+from .TreeEnsemble import TreeEnsemble
+from .ranking import get_top_k_agreement
+
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def get_default_student():
+    from sklearn.ensemble import GradientBoostingRegressor
+    return GradientBoostingRegressor(n_estimators=30, max_depth=3,
+        learning_rate=.3, random_state=0)
+
+
+def get_log_odds(prob, eps=1e-6):
+    prob = np.clip(prob, eps, 1 - eps)
+    return np.log(prob / (1 - prob))
+
+
+def get_holdout_mask(uids, holdout=.1, random_state=0):
+    """
+    Returns
+    -------
+    mask: np.ndarray
+        Rows of randomly chosen `holdout` share of users.
+    """
+    users = np.unique(uids)
+    rng = np.random.default_rng(random_state)
+    n_holdout = int(round(len(users) * holdout))
+    holdout_users = rng.choice(users, n_holdout, replace=False)
+    return np.isin(uids, holdout_users)
+
+
+def _get_size_bytes(model):
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _score(model, x):
+    time_start = time.perf_counter()
+    prob = model.predict_proba(x)[:, 1]
+    return prob, time.perf_counter() - time_start
+
+
+def distill(bundle, df_ui, student=None, holdout=.1, n_limit=10,
+        target='ui_in_target'):
+    """
+    bundle: ModelBundle
+        Teacher.
+    df_ui: DataFrame
+        Train features with `target`, indexed by (uid, iid).
+    student: None or sklearn.ensemble.GradientBoostingRegressor
+        Unfitted regressor (squared error) - shallow trees, few stages
+        (see `get_default_student` if None).
+    holdout: float
+        Share of users left out of student's training for the report.
+
+    Returns
+    -------
+    student_bundle: ModelBundle
+        Compiled student with teacher's features schema and scaler.
+    report: DataFrame
+        Rows: teacher, student. Columns:
+            accuracy - on held-out rows (vs target)
+            teacher_agreement - share of held-out rows of the same class
+                as teacher's
+            top_k_agreement - share of teacher's top-`n_limit` products per
+                user kept (see `ranking.get_top_k_agreement`)
+            mean_prob_diff - mean absolute difference from teacher's
+                probabilities
+            seconds - scoring time of held-out rows
+            size_bytes - pickled model size
+    """
+    student = get_default_student() if student is None else student
+    x = bundle.get_x(df_ui.drop(columns=target))
+    y = df_ui[target].values
+    uids = df_ui.index.get_level_values('uid').values
+    is_holdout = get_holdout_mask(uids, holdout)
+
+    teacher_prob = bundle.model.predict_proba(x)[:, 1]
+    student.fit(x[~is_holdout], get_log_odds(teacher_prob[~is_holdout]))
+    student_bundle = bundle.with_model(
+        TreeEnsemble.from_sklearn(student, log_odds=True))
+
+    x_holdout, y_holdout = x[is_holdout], y[is_holdout]
+    teacher_prob = teacher_prob[is_holdout]
+    report = []
+    for name, model in [('teacher', bundle.model),
+            ('student', student_bundle.model)]:
+        prob, seconds = _score(model, x_holdout)
+        report.append({
+            'model': name,
+            'accuracy': np.mean((prob > .5) == y_holdout),
+            'teacher_agreement': np.mean(
+                (prob > .5) == (teacher_prob > .5)),
+            'top_k_agreement': get_top_k_agreement(uids[is_holdout],
+                teacher_prob, prob, n_limit),
+            'mean_prob_diff': np.mean(np.abs(prob - teacher_prob)),
+            'seconds': seconds,
+            'size_bytes': _get_size_bytes(model),
+        })
+    return student_bundle, pd.DataFrame(report).set_index('model')
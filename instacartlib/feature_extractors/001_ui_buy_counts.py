@@ -1,7 +1,7 @@
 
 import pandas as pd
 
-def buy_counts(index, df_trns, **kwargs):
+def buy_counts(index, df_trns, df_i=None, **kwargs):
     """
     u_n_orders: total number of orders made by user.
     ui_n_chances: number of orders in which user A had a chance to buy item B.
@@ -22,6 +22,10 @@ def buy_counts(index, df_trns, **kwargs):
     index: pd.MultiIndex
         uid: level=0
         iid: level=1
+    df_i: None or DataFrame
+        Global item features indexed by iid (see `ItemStats`). If provided,
+        item features are taken from it instead of being computed from
+        `df_trns` (which may contain a subset of users).
     """
     # `order_r` for oldest transaction = number of orders
     u_n_orders = (
@@ -75,21 +79,25 @@ def buy_counts(index, df_trns, **kwargs):
         .astype('float32')
         .reindex(index, level='uid', fill_value=0)
     )
-    i_n_popularity = (
-        df_trns
-        .drop_duplicates(['uid', 'iid'])
-        .value_counts('iid')
-        .astype('uint32')
-        .reindex(index, level='iid', fill_value=0)
-    )
-    i_n_orders_mid = (
-        df_trns
-        .value_counts(['uid', 'iid'], sort=False)
-        .groupby('iid')
-        .median()
-        .astype('float32')
-        .reindex(index, level='iid', fill_value=0)
-    )
+    if df_i is None:
+        i_n_popularity = (
+            df_trns
+            .drop_duplicates(['uid', 'iid'])
+            .value_counts('iid')
+            .astype('uint32')
+        )
+        i_n_orders_mid = (
+            df_trns
+            .value_counts(['uid', 'iid'], sort=False)
+            .groupby('iid')
+            .median()
+            .astype('float32')
+        )
+    else:
+        i_n_popularity = df_i.i_n_popularity
+        i_n_orders_mid = df_i.i_n_orders_mid
+    i_n_popularity = i_n_popularity.reindex(index, level='iid', fill_value=0)
+    i_n_orders_mid = i_n_orders_mid.reindex(index, level='iid', fill_value=0)
 
     return pd.DataFrame({
         'u_n_orders': u_n_orders,
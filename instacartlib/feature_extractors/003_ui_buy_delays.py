@@ -1,7 +1,7 @@
 import pandas as pd
 
 
-def buy_delays(index, df_trns, **kwargs):
+def buy_delays(index, df_trns, df_i=None, **kwargs):
     """
     ui_days_delay_max: the longest (in days) user A gone without buying item B.
     ui_days_delay_mid: median number of days user A gone without buying item B.
@@ -24,6 +24,11 @@ def buy_delays(index, df_trns, **kwargs):
     ui_readyness_global_mid: user readyness relative to global delay for
         particular item.
     ui_readyness_global_mid_abs: absolute value of `ui_readyness_global_mid`.
+
+    df_i: None or DataFrame
+        Global item features indexed by iid (see `ItemStats`). If provided,
+        `i_days_delay_global_mid` is taken from it instead of being computed
+        from `df_trns` (which may contain a subset of users).
     """
     ui_days_delay_max = (
         df_trns
@@ -39,11 +44,17 @@ def buy_delays(index, df_trns, **kwargs):
         .astype('float32')
         .reindex(index, fill_value=999.)
     )
+    if df_i is None:
+        i_days_delay_global_mid = (
+            df_trns
+            .groupby('iid', sort=False)
+            .days_until_same_item.median()
+            .astype('float32')
+        )
+    else:
+        i_days_delay_global_mid = df_i.i_days_delay_global_mid
     i_days_delay_global_mid = (
-        df_trns
-        .groupby('iid', sort=False)
-        .days_until_same_item.median()
-        .astype('float32')
+        i_days_delay_global_mid
         .reindex(index, level='iid', fill_value=999.)
     )
     ui_days_passed = (
@@ -0,0 +1,336 @@
+"""
+Export predictions (`PredictionsStore`) to files.
+
+Capabilities:
+* CSV in submission format (`user_id,product_id` header, space-separated
+  product ids, no trailing newline), formatted digit by digit with numpy
+  in batches of users and streamed to the output.
+* Plain, gzip or zstd output (zstd requires `zstandard`:
+  `pip install zstandard`), to a path or a file-like object.
+* SHA-256 of the written bytes computed while writing.
+* Binary formats for downstream systems (no parsing needed to load):
+  Parquet and Arrow IPC / Feather (require `pyarrow`: `pip install pyarrow`)
+  written in row groups / record batches of users, npz with CSR arrays.
+
+Binary formats columns: uid, iid, [prob], [rank] (1 - most probable).
+"""
+
+from .ranking import get_segments_positions, get_segments_ranks
+from .PredictionsStore import PredictionsStore
+
+import contextlib
+import gzip
+import hashlib
+import importlib
+import io
+from pathlib import Path
+
+import numpy as np
+
+
+CSV_HEADER = 'user_id,product_id'
+COMPRESSION_SUFFIXES = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+}
+FORMAT_SUFFIXES = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+    '.npz': 'npz',
+}
+
+
+def _import_optional(module_name, package_name, feature):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        raise ImportError(f'{feature} requires {package_name} library (use '
+            f'`pip install {package_name}` to install).') from e
+
+
+def get_format(path):
+    """ Export format from path's suffix (compression suffix ignored). """
+    suffixes = Path(path).suffixes
+    if suffixes and suffixes[-1] in COMPRESSION_SUFFIXES:
+        suffixes = suffixes[:-1]
+    if not suffixes or suffixes[-1] not in FORMAT_SUFFIXES:
+        raise ValueError(f'Can\'t infer export format from "{path}", '
+            f'known suffixes: {list(FORMAT_SUFFIXES)}.')
+    return FORMAT_SUFFIXES[suffixes[-1]]
+
+
+class _HashingWriter(io.RawIOBase):
+    """ Binary writer that counts and hashes bytes on the way to `fileobj`. """
+    def __init__(self, fileobj, algorithm='sha256'):
+        self.fileobj = fileobj
+        self.hash = hashlib.new(algorithm)
+        self.n_bytes = 0
+
+
+    def writable(self):
+        return True
+
+
+    def write(self, data):
+        self.hash.update(data)
+        self.n_bytes += len(data)
+        self.fileobj.write(data)
+        return len(data)
+
+
+class _TextAdapter:
+    """ Binary writer on top of text file-like. """
+    def __init__(self, text_fileobj):
+        self.text_fileobj = text_fileobj
+
+
+    def write(self, data):
+        self.text_fileobj.write(data.decode('utf-8'))
+        return len(data)
+
+
+def _get_compression(path_or_buf, compression):
+    if compression != 'infer':
+        return compression
+    if isinstance(path_or_buf, (str, Path)):
+        return COMPRESSION_SUFFIXES.get(Path(path_or_buf).suffix)
+    return None
+
+
+@contextlib.contextmanager
+def open_output(path_or_buf, compression='infer'):
+    """
+    Context manager yielding (binary writer, `_HashingWriter`). The hashing
+    writer sees bytes as they are written to the path / file-like object
+    (after compression).
+
+    path_or_buf: str, pathlib.Path or file-like
+        Text file-likes get decoded (utf-8) output.
+    compression: {'infer', None, 'gzip', 'zstd'}
+        'infer' uses path's suffix: ".gz" - gzip, ".zst" - zstd.
+    """
+    compression = _get_compression(path_or_buf, compression)
+    with contextlib.ExitStack() as stack:
+        if isinstance(path_or_buf, (str, Path)):
+            fileobj = stack.enter_context(open(path_or_buf, 'wb'))
+        elif isinstance(path_or_buf, io.TextIOBase):
+            fileobj = _TextAdapter(path_or_buf)
+        else:
+            fileobj = path_or_buf
+        hashing_writer = _HashingWriter(fileobj)
+
+        if compression is None:
+            writer = hashing_writer
+        elif compression == 'gzip':
+            # mtime=0: same data gives the same file (and hash)
+            writer = stack.enter_context(gzip.GzipFile(filename='',
+                mode='wb', fileobj=hashing_writer, mtime=0))
+        elif compression == 'zstd':
+            zstandard = _import_optional('zstandard', 'zstandard',
+                'zstd compression')
+            writer = stack.enter_context(zstandard.ZstdCompressor()
+                .stream_writer(hashing_writer, closefd=False))
+        else:
+            raise ValueError(f'Unknown compression: {compression!r}')
+        yield writer, hashing_writer
+
+
+def _format_numbers(numbers, prefixes):
+    """
+    Format non-negative integers as ASCII, every number preceded by a
+    single-byte prefix, e.g. [12, 3], b'\\n,' -> b'\\n12,3'.
+
+    numbers: np.ndarray
+        Unsigned / non-negative integers.
+    prefixes: np.ndarray
+        uint8, prefix of every number.
+    """
+    numbers = numbers.astype('uint64')
+    n_digits = np.ones(len(numbers), dtype='int64')
+    power = 10
+    while len(numbers) and power <= numbers.max():
+        n_digits += numbers >= power
+        power *= 10
+    lengths = n_digits + 1
+    starts = np.cumsum(lengths) - lengths
+
+    buffer = np.empty(lengths.sum(), dtype='uint8')
+    buffer[starts] = prefixes
+    ends = starts + n_digits  # position of the last digit
+    for k in range(int(n_digits.max()) if len(numbers) else 0):
+        has_digit = n_digits > k
+        buffer[ends[has_digit] - k] = 48 + numbers[has_digit] % 10
+        numbers = numbers // 10
+    return buffer.tobytes()
+
+
+def format_csv_lines(uid, offsets, iid):
+    """
+    Format users' lines, each preceded by newline: "\\n{uid},{iid} {iid}...".
+
+    uid: np.ndarray
+        (n_users,)
+    offsets: np.ndarray
+        (n_users + 1,), rows of uid[i] are offsets[i]:offsets[i+1] (every user
+        has at least one row).
+    iid: np.ndarray
+        (offsets[-1],)
+
+    Returns
+    -------
+    text: bytes
+    """
+    n_users, n_rows = len(uid), len(iid)
+    numbers = np.empty(n_users + n_rows, dtype='uint64')
+    prefixes = np.full(n_users + n_rows, ord(' '), dtype='uint8')
+
+    # Every user's id is followed by user's product ids
+    uid_positions = offsets[:-1] + np.arange(n_users)
+    is_uid = np.zeros(len(numbers), dtype=bool)
+    is_uid[uid_positions] = True
+    numbers[uid_positions] = uid
+    numbers[~is_uid] = iid
+    prefixes[uid_positions] = ord('\n')
+    prefixes[uid_positions + 1] = ord(',')
+    return _format_numbers(numbers, prefixes)
+
+
+def _get_users_rows(store, start, stop, n_limit):
+    """ (uid, offsets, rows) of users [start, stop) limited to `n_limit`. """
+    starts = store.offsets[start:stop]
+    lengths = store.offsets[start + 1:stop + 1] - starts
+    if n_limit is not None:
+        lengths = lengths.clip(max=n_limit)
+    rows = get_segments_positions(starts, lengths)
+    return store.uid[start:stop], np.r_[0, np.cumsum(lengths)], rows
+
+
+def iter_csv_chunks(store, n_limit=10, users_per_chunk=100_000):
+    """
+    Yield CSV content (bytes) of `store`: header, then lines of every
+    `users_per_chunk` users. Chunks concatenated give the whole file.
+    """
+    yield CSV_HEADER.encode()
+    for start in range(0, store.n_users, users_per_chunk):
+        stop = min(start + users_per_chunk, store.n_users)
+        uid, offsets, rows = _get_users_rows(store, start, stop, n_limit)
+        yield format_csv_lines(uid, offsets, store.iid[rows])
+
+
+def write_predictions_csv(store, path_or_buf, n_limit=10,
+        compression='infer', users_per_chunk=100_000):
+    """
+    user_id,product_id
+    1,196 12427 10258 25133 46149 38928 39657 49235 13032 35951
+    2,47209 1559 19156 18523 33754 16589 24852 21709 22124 32792
+    ...
+
+    Returns
+    -------
+    n_bytes: int
+        Number of bytes written (compressed).
+    sha256: str
+        Hex digest of written bytes (same as of the written file).
+    """
+    with open_output(path_or_buf, compression) as (writer, hashing_writer):
+        for chunk in iter_csv_chunks(store, n_limit, users_per_chunk):
+            writer.write(chunk)
+    return hashing_writer.n_bytes, hashing_writer.hash.hexdigest()
+
+
+def iter_column_chunks(store, n_limit=None, with_prob=False,
+        with_rank=False, users_per_chunk=100_000):
+    """
+    Yield dicts of columns (uid, iid, [prob], [rank]) for every
+    `users_per_chunk` users.
+    """
+    for start in range(0, max(store.n_users, 1), users_per_chunk):
+        stop = min(start + users_per_chunk, store.n_users)
+        uid, offsets, rows = _get_users_rows(store, start, stop, n_limit)
+        columns = {
+            'uid': np.repeat(uid, np.diff(offsets)),
+            'iid': store.iid[rows],
+        }
+        if with_prob:
+            columns['prob'] = store.prob[rows]
+        if with_rank:
+            columns['rank'] = (get_segments_ranks(offsets) + 1).astype(
+                'uint16')
+        yield columns
+
+
+def write_predictions_parquet(store, path, n_limit=None, with_prob=False,
+        with_rank=False, users_per_chunk=100_000, compression='snappy'):
+    """
+    Write one row group per `users_per_chunk` users.
+    """
+    pa = _import_optional('pyarrow', 'pyarrow', 'Parquet export')
+    pq = importlib.import_module('pyarrow.parquet')
+    writer = None
+    try:
+        for columns in iter_column_chunks(store, n_limit, with_prob,
+                with_rank, users_per_chunk):
+            table = pa.table(columns)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema,
+                    compression=compression)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_predictions_feather(store, path, n_limit=None, with_prob=False,
+        with_rank=False, users_per_chunk=100_000, compression=None):
+    """
+    Arrow IPC file (Feather V2), one record batch per `users_per_chunk`
+    users.
+
+    compression: {None, 'lz4', 'zstd'}
+    """
+    pa = _import_optional('pyarrow', 'pyarrow', 'Arrow IPC export')
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    writer = None
+    try:
+        for columns in iter_column_chunks(store, n_limit, with_prob,
+                with_rank, users_per_chunk):
+            batch = pa.record_batch(list(columns.values()),
+                names=list(columns))
+            if writer is None:
+                writer = pa.ipc.new_file(str(path), batch.schema,
+                    options=options)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_predictions_npz(store, path, n_limit=None, with_prob=False,
+        compressed=False):
+    """
+    CSR arrays: uid, offsets, iid, [prob] (see `PredictionsStore`). Ranks
+    are positions within users' slices. Load with `read_predictions_npz`.
+    """
+    uid, offsets, rows = _get_users_rows(store, 0, store.n_users, n_limit)
+    arrays = {'uid': uid, 'offsets': offsets, 'iid': store.iid[rows]}
+    if with_prob:
+        arrays['prob'] = store.prob[rows]
+    save = np.savez_compressed if compressed else np.savez
+    with open(path, 'wb') as f:
+        save(f, **arrays)
+
+
+def read_predictions_npz(path):
+    """
+    Returns
+    -------
+    store: PredictionsStore
+        Probabilities are NaN if they were not exported.
+    """
+    with np.load(path) as npz:
+        iid = npz['iid']
+        prob = (npz['prob'] if 'prob' in npz.files
+            else np.full(len(iid), np.nan, dtype='float32'))
+        return PredictionsStore(npz['uid'], npz['offsets'], iid, prob)
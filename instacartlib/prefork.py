@@ -0,0 +1,218 @@
+"""
+Pre-fork multi-process serving: load once, fork workers sharing memory.
+
+Capabilities:
+* Pack predictions (`PredictionsStore`), products catalog
+  (`ProductCatalog`) and cold start tables (`PopularProducts`) arrays into
+  anonymous shared memory maps. Data pages
+  hold only array contents (no Python objects), so refcount and GC writes
+  in workers never touch them, and they are shared (not copied) by all
+  workers.
+* `gc.freeze()` before forking: objects loaded in the parent are moved to
+  the permanent generation and are not traversed (written) by workers'
+  garbage collector.
+* `PreforkServer` - bind a listening socket once, fork `n_workers`
+  processes, each running its own asyncio `PredictionServer` on the shared
+  socket (the kernel distributes connections).
+
+Linux / macOS only (requires `os.fork`).
+"""
+
+from .PredictionsStore import PredictionsStore
+from .ProductCatalog import ProductCatalog
+from .PredictionServer import PredictionServer, get_store_predict_batch
+
+import asyncio
+import copy
+import gc
+import mmap
+import os
+import signal
+import socket
+import sys
+import traceback
+
+import numpy as np
+
+
+def pack_arrays(arrays, alignment=64):
+    """
+    Copy arrays into one anonymous shared memory map.
+
+    arrays: dict
+        {name: np.ndarray}
+
+    Returns
+    -------
+    views: dict
+        {name: read-only np.ndarray} backed by the memory map (shared with
+        forked processes).
+    """
+    offsets = {}
+    n_bytes = 0
+    for name, array in arrays.items():
+        offsets[name] = n_bytes
+        n_bytes += -(-array.nbytes // alignment) * alignment
+    buffer = mmap.mmap(-1, max(n_bytes, 1))
+
+    views = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        view = np.frombuffer(buffer, dtype=array.dtype, count=array.size,
+            offset=offsets[name]).reshape(array.shape)
+        view[...] = array
+        view.flags.writeable = False
+        views[name] = view
+    return views
+
+
+def share_serving_state(store, catalog):
+    """
+    Returns
+    -------
+    store, catalog: PredictionsStore, ProductCatalog
+        Copies backed by shared memory (see `pack_arrays`).
+    """
+    views = pack_arrays({
+        **{f'store.{name}': getattr(store, name)
+            for name in ['uid', 'offsets', 'iid', 'prob']},
+        **{f'catalog.{name}': array
+            for name, array in catalog.arrays.items()},
+    })
+    store = PredictionsStore(*(views[f'store.{name}']
+        for name in ['uid', 'offsets', 'iid', 'prob']),
+        prob_name=store.prob_name)
+    catalog = ProductCatalog(*(views[f'catalog.{name}']
+        for name in ['iid', 'name_offsets', 'names']))
+    return store, catalog
+
+
+def share_popular_products(popular_products):
+    """
+    Returns
+    -------
+    popular_products: PopularProducts
+        Copy with arrays backed by shared memory (see `pack_arrays`).
+    """
+    names = ['counts', 'product_aisle', 'product_department', 'top',
+        'aisle_top', 'department_top']
+    views = pack_arrays({name: getattr(popular_products, name)
+        for name in names})
+    popular_products = copy.copy(popular_products)
+    for name in names:
+        setattr(popular_products, name, views[name])
+    return popular_products
+
+
+class PreforkServer:
+    """
+    server: PredictionServer
+        Server to run in every worker (not started, see
+        `get_prefork_server` to create one over shared state).
+    n_workers: None or int
+        Number of worker processes (number of CPUs if None).
+    """
+    def __init__(self, server, n_workers=None):
+        if not hasattr(os, 'fork'):  #pragma: no cover
+            raise OSError('Pre-fork serving requires `os.fork` '
+                '(Linux / macOS).')
+        self.server = server
+        self.n_workers = n_workers or os.cpu_count()
+        self.pids = []
+        self.host = server.host
+        self.port = server.port
+        self._sock = None
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} workers={len(self.pids)} '
+                f'address={self.host}:{self.port}>')
+
+
+    def start(self):
+        """ Bind the socket and fork workers (returns in the parent). """
+        self._sock = socket.create_server((self.host, self.port),
+            backlog=1024)
+        self.port = self._sock.getsockname()[1]
+
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.n_workers):
+            pid = os.fork()
+            if pid == 0:  #pragma: no cover
+                # Worker, never returns (coverage doesn't see forked code)
+                self._run_worker()
+            self.pids.append(pid)
+        gc.unfreeze()
+        self._sock.close()
+        return self
+
+
+    def _run_worker(self):  #pragma: no cover
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            asyncio.run(self._serve_worker())
+        except BaseException:
+            traceback.print_exc(file=sys.stderr)
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+
+    async def _serve_worker(self):  #pragma: no cover
+        await self.server.start(sock=self._sock)
+        await self.server.serve_started()
+
+
+    def wait(self):
+        """ Wait for all workers to exit. """
+        for pid in self.pids:
+            os.waitpid(pid, 0)
+        self.pids = []
+
+
+    def stop(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:  #pragma: no cover
+                pass
+        self.wait()
+
+
+    def serve_forever(self):
+        self.start()
+        print(f'Serving on http://{self.host}:{self.port} '
+              f'({self.n_workers} workers)')
+        try:
+            self.wait()
+        except KeyboardInterrupt:
+            self.stop()
+
+
+def get_prefork_server(nbp, n_workers=None, **server_kwargs):
+    """
+    Pre-fork server over `nbp` predictions (lazy mode is not supported:
+    workers would predict and memoise users independently).
+
+    **server_kwargs:
+        See `PredictionServer`.
+
+    Returns
+    -------
+    server: PreforkServer
+        Not started.
+    """
+    if nbp.lazy:
+        raise ValueError('Pre-fork serving requires predictions for all '
+            'users. Use `.update_predictions()` or `load_model(lazy=False)`.')
+    store, catalog = share_serving_state(nbp.predictions_store,
+        ProductCatalog.from_frame(nbp.icds_predict.df_prod))
+    popular_products = nbp.state.popular_products
+    if popular_products is not None:
+        popular_products = share_popular_products(popular_products)
+    server = PredictionServer(predict_batch=get_store_predict_batch(store),
+        catalog=catalog, popular_products=popular_products, **server_kwargs)
+    return PreforkServer(server, n_workers)
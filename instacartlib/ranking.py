@@ -0,0 +1,240 @@
+"""
+Per-user ranking of scored (uid, iid) rows.
+
+Capabilities:
+* Find segments of grouped keys (e.g. rows of `df_ui` are grouped by uid).
+* Split rows into chunks aligned to segments (no user split between chunks).
+* Rank rows within segments (`get_segments_ranks(offsets) < n` selects
+  top-n rows of ranked segments).
+* Select top-K rows per key ordered by score (descending, ties keep the
+  original order of rows): segment-wise partition, only the selected rows
+  are sorted by score.
+* `TopKAccumulator` - keep only top-K items per user while scoring chunk by
+  chunk, so memory doesn't depend on the number of candidates.
+* Compare two scorings of the same rows by their top-K rows per key.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Max size of padded (n_segments, max_length) blocks of `select_top_k`
+PARTITION_BLOCK_SIZE = 1 << 22
+
+
+def get_segments_offsets(keys):
+    """
+    keys: array-like
+        Grouped keys (equal keys are adjacent, not necessarily sorted).
+
+    Returns
+    -------
+    offsets: np.ndarray
+        Start of every segment followed by `len(keys)` (n_segments + 1
+        values).
+    """
+    keys = np.asarray(keys)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    if len(keys) == 0:
+        starts = starts[:0]
+    return np.r_[starts, len(keys)].astype('int64')
+
+
+def get_segments_ranks(offsets):
+    """
+    Position of every row within its segment: offsets [0, 2, 5] ->
+    [0, 1, 0, 1, 2]. With rows ranked within segments, `ranks < n` selects
+    top-n rows of every segment.
+    """
+    lengths = np.diff(offsets)
+    return np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+
+
+def get_segments_positions(starts, lengths):
+    """
+    Row positions of segments [start, start + length) concatenated:
+    starts [5, 0], lengths [2, 3] -> [5, 6, 0, 1, 2].
+    """
+    lengths = np.asarray(lengths, dtype='int64')
+    new_starts = np.cumsum(lengths) - lengths
+    return (np.repeat(np.asarray(starts, dtype='int64') - new_starts, lengths)
+        + np.arange(lengths.sum()))
+
+
+def get_chunks_bounds(offsets, chunk_size):
+    """
+    Split rows into chunks of ~`chunk_size` rows aligned to segments (a
+    segment longer than `chunk_size` is a chunk on its own).
+
+    Returns
+    -------
+    bounds: list of (start, stop)
+    """
+    n_rows = offsets[-1]
+    targets = np.arange(0, n_rows, max(int(chunk_size), 1))
+    starts = np.unique(offsets[np.searchsorted(offsets, targets)])
+    starts = starts[starts < n_rows]
+    stops = np.r_[starts[1:], n_rows]
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def _get_keys_order(keys):
+    """ Stable order of rows by keys (rows are often sorted already). """
+    if len(keys) < 2 or (keys[1:] >= keys[:-1]).all():
+        return np.arange(len(keys))
+    return np.argsort(keys, kind='stable')
+
+
+def _get_segments_kth_scores(scores, offsets, segments, k):
+    """
+    `k`-th largest score of each of `segments` (all longer than `k`).
+    Segments are partitioned as rows of padded matrices, segments of similar
+    lengths together (little padding), `PARTITION_BLOCK_SIZE` cells at most.
+    """
+    lengths = np.diff(offsets)[segments]
+    segments, lengths = segments[np.argsort(lengths)], np.sort(lengths)
+    kth_scores = np.empty(len(segments))
+    start = 0
+    while start < len(segments):
+        # Padded size of blocks [start, stop) grows with stop
+        sizes = np.arange(1, len(segments) - start + 1) * lengths[start:]
+        stop = start + max(1, np.searchsorted(sizes, PARTITION_BLOCK_SIZE,
+            side='right'))
+        block_lengths = lengths[start:stop]
+        block_offsets = np.r_[0, np.cumsum(block_lengths)]
+        # Negated scores: the k-th smallest, padding is never selected
+        padded = np.full((stop - start, block_lengths[-1]), np.inf)
+        padded[np.repeat(np.arange(stop - start), block_lengths),
+            get_segments_ranks(block_offsets)] = -scores[
+                get_segments_positions(offsets[segments[start:stop]],
+                    block_lengths)]
+        kth_scores[start:stop] = -np.partition(padded, k - 1,
+            axis=1)[:, k - 1]
+        start = stop
+    result = np.full(len(offsets) - 1, -np.inf)
+    result[segments] = kth_scores
+    return result
+
+
+def select_top_k(keys, scores, k=None):
+    """
+    Rank rows by `keys` (ascending) and `scores` (descending, stable).
+
+    k: None or int
+        Keep only first `k` rows of each key (all rows if None).
+
+    Returns
+    -------
+    positions: np.ndarray
+        Positions of selected rows in ranked order.
+
+    With `k`, rows are selected segment by segment first (the `k`-th score
+    of every key longer than `k` by a partition, no sorting), then only
+    selected rows are sorted.
+    """
+    keys, scores = np.asarray(keys), np.asarray(scores)
+    if k is None:
+        return np.lexsort((-scores, keys))
+    positions = _get_keys_order(keys)
+    if k < 1:
+        return positions[:0]
+    offsets = get_segments_offsets(keys[positions])
+    lengths = np.diff(offsets)
+    if (lengths > k).any():
+        positions = positions[_get_top_k_mask(
+            np.nan_to_num(scores[positions], nan=-np.inf), offsets, k)]
+    # Rows of every key stay in their original order: sort is stable
+    return positions[np.lexsort((-scores[positions], keys[positions]))]
+
+
+def _get_top_k_mask(scores, offsets, k):
+    """
+    Top-`k` rows of every segment of grouped `scores` (NaN-free), ties at
+    the `k`-th score are broken by position.
+    """
+    lengths = np.diff(offsets)
+    is_long = lengths > k
+    kth_scores = np.repeat(_get_segments_kth_scores(scores, offsets,
+        np.flatnonzero(is_long), k), lengths)
+    is_greater = scores > kth_scores
+    is_equal = scores == kth_scores
+    n_greater = np.add.reduceat(is_greater, offsets[:-1])
+    equals_before = np.cumsum(is_equal) - is_equal
+    equal_ranks = equals_before - np.repeat(equals_before[offsets[:-1]],
+        lengths)
+    return np.repeat(~is_long, lengths) | is_greater | (is_equal & (
+        equal_ranks < np.repeat(k - n_greater, lengths)))
+
+
+def get_top_k_agreement(keys, scores, scores_other, k=10):
+    """
+    Share of top-`k` rows per key by `scores` that are in top-`k` rows by
+    `scores_other` as well (1. - same top-K of every key).
+    """
+    positions = select_top_k(keys, scores, k)
+    if not len(positions):
+        return 1.
+    positions_other = select_top_k(keys, scores_other, k)
+    return len(np.intersect1d(positions, positions_other)) / len(positions)
+
+
+class TopKAccumulator:
+    """
+    Accumulates top-`k` scored items per user from chunks of rows.
+
+    k: None or int
+        Number of items to keep per user (all items if None).
+
+    Chunks should be user-aligned (see `get_chunks_bounds`), then every chunk
+    is reduced to its top-K rows once. Users split between chunks are merged
+    in `get_arrays()`.
+    """
+    def __init__(self, k=None):
+        self.k = k
+        self._chunks = []
+        self._n_rows = 0
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} k={self.k} '
+                f'chunks={len(self._chunks)} rows={self._n_rows}>')
+
+
+    def add(self, uid, iid, score):
+        uid, iid, score = map(np.asarray, (uid, iid, score))
+        positions = select_top_k(uid, score, self.k)
+        self._chunks.append((uid[positions], iid[positions], score[positions]))
+        self._n_rows += len(positions)
+        return self
+
+
+    def _is_disjoint(self):
+        for (uid_a, _, _), (uid_b, _, _) in zip(self._chunks,
+                self._chunks[1:]):
+            if len(uid_a) and len(uid_b) and uid_a[-1] >= uid_b[0]:
+                return False
+        return True
+
+
+    def get_arrays(self):
+        """
+        Returns
+        -------
+        uid, iid, score: np.ndarray
+            Sorted by uid (ascending) and score (descending, ties in order of
+            added rows).
+        """
+        if not self._chunks:
+            empty = np.array([])
+            return empty, empty, empty
+        uid, iid, score = (np.concatenate(arrays)
+            for arrays in zip(*self._chunks))
+        if not self._is_disjoint():
+            positions = select_top_k(uid, score, self.k)
+            uid, iid, score = uid[positions], iid[positions], score[positions]
+        return uid, iid, score
+
+
+    def to_frame(self, score_name='in_target_prob'):
+        uid, iid, score = self.get_arrays()
+        return pd.DataFrame({'uid': uid, 'iid': iid, score_name: score})
@@ -0,0 +1,214 @@
+"""
+Negative downsampling of train rows: most candidate (user, item) rows are
+negatives, fitting on all positives and a share of negatives is faster.
+
+Capabilities:
+* Sample negatives user by user (`get_negative_sample_mask`): every user
+  keeps all positive rows and `negative_rate` of its negative rows (rounded
+  randomly, so the share is exact on average), users' row proportions stay
+  as they are.
+* Probability correction: a model fitted on the sample overestimates
+  probabilities, `DownsampledModel` corrects them back (prior shift
+  `p = w * p_s / (w * p_s + 1 - p_s)`), so `predict_proba` stays
+  calibrated. Compiled (`TreeEnsemble.from_sklearn`) as the inner model
+  with the shift added to its init prediction.
+* Report of the accuracy impact (`get_negative_sampling_report`): models
+  fitted at several rates, scored on held-out users.
+"""
+
+from .distillation import get_holdout_mask
+from .ranking import get_segments_offsets
+from .ranking import get_segments_ranks
+from .ranking import get_top_k_agreement
+from .ranking import select_top_k
+
+import copy
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def get_negative_sample_mask(uids, y, negative_rate, random_state=0):
+    """
+    uids: array-like
+        User of every row (any order).
+    y: array-like
+        Binary target.
+    negative_rate: float
+        Share of negative rows to keep, in (0, 1].
+
+    Returns
+    -------
+    mask: np.ndarray
+        Rows to keep: all positives, random `negative_rate` of every user's
+        negatives.
+    """
+    if not 0 < negative_rate <= 1:
+        raise ValueError(f'negative_rate expected to be in (0, 1], '
+            f'got: {negative_rate}')
+    uids = np.asarray(uids)
+    is_negative = np.asarray(y) == 0
+    negatives = np.flatnonzero(is_negative)
+    rng = np.random.default_rng(random_state)
+    # Negatives of every user in random order
+    order = np.lexsort((rng.random(len(negatives)), uids[negatives]))
+    negatives = negatives[order]
+    offsets = get_segments_offsets(uids[negatives])
+    lengths = np.diff(offsets)
+    n_keep = np.floor(lengths * negative_rate
+        + rng.random(len(lengths))).astype('int64')
+    ranks = get_segments_ranks(offsets)
+
+    mask = ~is_negative
+    mask[negatives] = ranks < np.repeat(n_keep, lengths)
+    return mask
+
+
+def get_negative_rate(y, mask):
+    """ Share of negative rows kept by `mask`. """
+    is_negative = np.asarray(y) == 0
+    n_negative = is_negative.sum()
+    if n_negative == 0:
+        return 1.
+    return (mask & is_negative).sum() / n_negative
+
+
+def correct_probabilities(prob, negative_rate):
+    """
+    prob: np.ndarray
+        Positive class probabilities of a model fitted on a sample with
+        `negative_rate` of negatives.
+
+    Returns
+    -------
+    prob: np.ndarray
+        Probabilities on all rows.
+    """
+    return negative_rate * prob / (negative_rate * prob + 1. - prob)
+
+
+class DownsampledModel:
+    """
+    Binary classifier fitted on negatively downsampled rows, with corrected
+    probabilities.
+
+    model: estimator
+        Classifier with `predict_proba` (fitted on the sample by `fit`).
+    negative_rate: float
+        Share of negatives in the sample (see `get_negative_rate`).
+    """
+    def __init__(self, model, negative_rate):
+        self.model = model
+        self.negative_rate = negative_rate
+
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} '
+                f'model={self.model.__class__.__name__} '
+                f'negative_rate={self.negative_rate:.4g}>')
+
+
+    @property
+    def classes_(self):
+        return self.model.classes_
+
+
+    @property
+    def n_features_in_(self):
+        return self.model.n_features_in_
+
+
+    def fit(self, x, y):
+        """ x, y - the sample. """
+        self.model.fit(x, y)
+        return self
+
+
+    def predict_proba(self, x):
+        prob = self.model.predict_proba(x)[:, 1]
+        prob = correct_probabilities(prob, self.negative_rate)
+        return np.c_[1. - prob, prob]
+
+
+    def predict(self, x):
+        return np.asarray(self.classes_)[
+            (self.predict_proba(x)[:, 1] > .5).astype('int64')]
+
+
+def _fit(model, x, y):
+    time_start = time.perf_counter()
+    model.fit(x, y)
+    return time.perf_counter() - time_start
+
+
+def _get_log_loss(prob, y, eps=1e-15):
+    prob = np.clip(prob, eps, 1 - eps)
+    return -np.mean(y * np.log(prob) + (1 - y) * np.log(1 - prob))
+
+
+def get_negative_sampling_report(model, x, y, uids,
+        negative_rates=(.5, .25, .1), holdout=.1, n_limit=10,
+        random_state=0):
+    """
+    Fit a copy of `model` on train users' rows with all negatives and with
+    each of `negative_rates` of them, score held-out users' rows.
+
+    model: estimator
+        Unfitted binary classifier.
+    x, y, uids: np.ndarray
+        Features, target and user of every row.
+    holdout: float
+        Share of users left out for scoring.
+
+    Returns
+    -------
+    report: DataFrame
+        One row per rate, the first row is no sampling (rate 1.):
+            negative_rate
+            rows - train rows fitted on
+            seconds, speedup - fitting time, time without sampling / time
+            accuracy - on held-out rows
+            log_loss - of corrected probabilities
+            mean_prob - mean corrected probability (calibrated model's is
+                close to `positive_rate`)
+            positive_rate - held-out rows
+            top_k_recall - share of held-out positives in top-`n_limit`
+                products of their users
+            top_k_agreement - share of top-`n_limit` products per user the
+                same as without sampling (see `ranking.get_top_k_agreement`)
+    """
+    is_holdout = get_holdout_mask(uids, holdout, random_state)
+    x_train, y_train = x[~is_holdout], y[~is_holdout]
+    x_holdout, y_holdout = x[is_holdout], y[is_holdout]
+    uids_train, uids_holdout = uids[~is_holdout], uids[is_holdout]
+
+    results = []
+    for negative_rate in [1., *negative_rates]:
+        mask = get_negative_sample_mask(uids_train, y_train, negative_rate,
+            random_state)
+        fitted = DownsampledModel(copy.deepcopy(model),
+            get_negative_rate(y_train, mask))
+        seconds = _fit(fitted, x_train[mask], y_train[mask])
+        prob = fitted.predict_proba(x_holdout)[:, 1]
+        results.append((negative_rate, mask.sum(), seconds, prob))
+
+    _, _, seconds_full, prob_full = results[0]
+    n_positive = max(y_holdout.sum(), 1)
+    report = []
+    for negative_rate, n_rows, seconds, prob in results:
+        top_k = select_top_k(uids_holdout, prob, n_limit)
+        report.append({
+            'negative_rate': negative_rate,
+            'rows': n_rows,
+            'seconds': seconds,
+            'speedup': seconds_full / seconds,
+            'accuracy': np.mean((prob > .5) == y_holdout),
+            'log_loss': _get_log_loss(prob, y_holdout),
+            'mean_prob': prob.mean(),
+            'positive_rate': y_holdout.mean(),
+            'top_k_recall': y_holdout[top_k].sum() / n_positive,
+            'top_k_agreement': get_top_k_agreement(uids_holdout, prob_full,
+                prob, n_limit),
+        })
+    return pd.DataFrame(report)
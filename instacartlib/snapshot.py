@@ -0,0 +1,352 @@
+"""
+Warm-restart snapshots of prepared `NextBasketPrediction` state.
+
+Capabilities:
+* Write everything prepared for predictions - preprocessed and raw frames of
+  `icds_predict`, features (`features_predict.df_ui`) with item statistics,
+  predictions, products catalog, popularity tables and the model bundle -
+  as `.npy` column files with JSON metadata (no CSV, no pickled frames).
+* Lazy mode state (after the first `get_predictions` call) is written as
+  well: the data read, item statistics and predictions of users predicted
+  so far (no features, they aren't kept in lazy mode). The restored object
+  continues predicting lazily.
+* Open a snapshot without parsing or recomputing anything: files are
+  memory-mapped. Predictions, catalog, popularity tables and model arrays
+  are used as mapped (read-only, pages shared by processes opening the same
+  snapshot). Frames keep numeric columns and index levels as mapped arrays
+  (not copied), string columns are decoded into memory.
+* Snapshot directory is replaced crash-safely: written to a temporary
+  directory first, the previous snapshot is renamed aside before the new one
+  is moved in and deleted last (`utils.replace_dir`), loading falls back to
+  it if saving was interrupted in between.
+
+Directory layout:
+    meta.json                - settings, feature registry, dataset stats
+    model.joblib             - `ModelBundle`
+    frames/<name>/           - one frame per directory (see `write_frame`)
+    features/                - `FeaturesStore` of `features_predict.df_ui`
+    predictions/<array>.npy  - `PredictionsStore` arrays
+    catalog/<array>.npy      - `ProductCatalog` arrays
+    popular_products/<array>.npy
+"""
+
+from .FeaturesStore import FeaturesStore, FeaturesStoreWriter
+from .ItemStats import ItemStats
+from .ModelBundle import ModelBundle
+from .PopularProducts import PopularProducts
+from .PredictionsStore import PredictionsStore
+from .ProductCatalog import ProductCatalog
+from .utils import get_existing_dir_path
+from .utils import replace_dir
+
+import copy
+import json
+from pathlib import Path
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+META_FILENAME = 'meta.json'
+SNAPSHOT_VERSION = 1
+
+STORE_ARRAYS = ['uid', 'offsets', 'iid', 'prob']
+CATALOG_ARRAYS = ['iid', 'name_offsets', 'names']
+POPULAR_ARRAYS = ['counts', 'product_aisle', 'product_department', 'top',
+    'aisle_top', 'department_top']
+ICDS_STATS = ['n_ord_user_max', 'n_users', 'n_items', 'n_prod_items',
+    'n_aisles', 'n_departments', 'n_users_target', 'n_items_target']
+
+
+def write_arrays(arrays, path_dir):
+    """ One `<name>.npy` file per array of `arrays` dict. """
+    path_dir = Path(path_dir)
+    path_dir.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(path_dir / f'{name}.npy', np.ascontiguousarray(array))
+
+
+def read_arrays(path_dir, names, mmap_mode='r'):
+    return {name: np.load(Path(path_dir) / f'{name}.npy', mmap_mode=mmap_mode)
+        for name in names}
+
+
+def _encode_strings(values):
+    """
+    Returns
+    -------
+    arrays: dict
+        {'data': uint8 UTF-8 bytes, 'offsets': int64, 'isna': bool}
+    """
+    isna = pd.isna(values)
+    encoded = [b'' if na else str(value).encode('utf-8')
+        for value, na in zip(values, isna)]
+    lengths = np.fromiter(map(len, encoded), dtype='int64',
+        count=len(encoded))
+    return {
+        'data': np.frombuffer(b''.join(encoded), dtype='uint8'),
+        'offsets': np.r_[0, np.cumsum(lengths)].astype('int64'),
+        'isna': np.asarray(isna, dtype=bool),
+    }
+
+
+def _decode_strings(data, offsets, isna):
+    data = bytes(data)
+    starts, stops = offsets[:-1].tolist(), offsets[1:].tolist()
+    values = np.array([data[start:stop].decode('utf-8')
+        for start, stop in zip(starts, stops)], dtype=object)
+    values[isna] = None
+    return values
+
+
+def _add_values(arrays, key, values):
+    """ Add `values` to `arrays` under `key`, returns dtype to restore. """
+    if values.dtype == object:
+        for name, array in _encode_strings(values).items():
+            arrays[f'{key}.{name}'] = array
+        return 'str'
+    arrays[key] = values
+    return str(values.dtype)
+
+
+def _get_values(load, key, dtype):
+    if dtype == 'str':
+        return _decode_strings(load(f'{key}.data'), load(f'{key}.offsets'),
+            load(f'{key}.isna'))
+    return load(key)
+
+
+def write_frame(df, path_dir):
+    """
+    Write frame as one `.npy` file per column and index level. Object
+    (string) columns are written as UTF-8 bytes with offsets.
+
+    Files:
+        meta.json - columns, dtypes, index names
+        index.<i>.npy - index levels (not written for RangeIndex)
+        <i>.npy - columns
+    Strings are written as <key>.data.npy, <key>.offsets.npy, <key>.isna.npy
+    instead of <key>.npy.
+    """
+    path_dir = Path(path_dir)
+    path_dir.mkdir(parents=True, exist_ok=True)
+    has_index = not isinstance(df.index, pd.RangeIndex)
+    arrays = {}
+    columns = [
+        {'name': name, 'dtype': _add_values(arrays, f'{i}', df[name].values)}
+        for i, name in enumerate(df.columns)
+    ]
+    index = None
+    if has_index:
+        index = [
+            {'name': name, 'dtype': _add_values(arrays, f'index.{i}',
+                df.index.get_level_values(i).values)}
+            for i, name in enumerate(df.index.names)
+        ]
+    write_arrays(arrays, path_dir)
+    meta = {'n_rows': len(df), 'columns': columns, 'index': index}
+    with open(path_dir / META_FILENAME, 'wt') as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_frame(path_dir, mmap_mode='r'):
+    """
+    Read frame written by `write_frame`. Numeric columns and index levels
+    stay memory-mapped with `mmap_mode` (not copied, read-only for 'r'),
+    strings are decoded.
+    """
+    path_dir = Path(path_dir)
+    with open(path_dir / META_FILENAME, 'rt') as f:
+        meta = json.load(f)
+
+    def load(name):
+        return np.load(path_dir / f'{name}.npy', mmap_mode=mmap_mode)
+
+    data = {column['name']: _get_values(load, f'{i}', column['dtype'])
+        for i, column in enumerate(meta['columns'])}
+    index = None
+    if meta['index'] is not None:
+        levels = [_get_values(load, f'index.{i}', level['dtype'])
+            for i, level in enumerate(meta['index'])]
+        names = [level['name'] for level in meta['index']]
+        if len(levels) == 1:
+            index = pd.Index(levels[0], name=names[0])
+        else:
+            index = pd.MultiIndex.from_arrays(levels, names=names)
+    df = pd.DataFrame(data, index=index, copy=False)
+    if len(df.columns) == 0 and index is None:
+        df = pd.DataFrame(index=pd.RangeIndex(meta['n_rows']))
+    return df
+
+
+def _write_features(df_ui, path_dir):
+    FeaturesStoreWriter(path_dir, len(df_ui)).write(df_ui).close()
+
+
+def save_snapshot(nbp, path_dir):
+    """
+    Write prepared state of `nbp` (predictions have to be made, or data
+    read in lazy mode, see module docstring).
+    """
+    lazy = nbp.lazy
+    if lazy and not nbp._lazy_loaded:
+        raise ValueError('Nothing to snapshot: in lazy mode data is read by '
+            'the first `.get_predictions()` call, call it first.')
+    if nbp._update_predictset_needed and not lazy:
+        raise ValueError('Nothing to snapshot: predictions have to be made '
+            'first. Use `.update_predictions()` or `.load_model()`.')
+
+    path_dir = Path(path_dir)
+    tmp_dir = path_dir.with_name(path_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    with nbp._write_lock:
+        state = nbp.state
+        icds = nbp.icds_predict
+        features = nbp.features_predict
+        frames = {
+            **icds.dataframes,
+            'transactions_raw': icds._transactions.df,
+            'products_raw': icds._products.df,
+        }
+        if features.item_stats is not None:
+            frames['orders_hist'] = (
+                features.item_stats.orders_hist.to_frame('count'))
+            frames['delays_hist'] = (
+                features.item_stats.delays_hist.to_frame('count'))
+        for name, df in frames.items():
+            write_frame(df, tmp_dir / 'frames' / name)
+        if not lazy:
+            _write_features(features.df_ui, tmp_dir / 'features')
+
+        store = state.predictions_store
+        write_arrays({name: getattr(store, name) for name in STORE_ARRAYS},
+            tmp_dir / 'predictions')
+        write_arrays(state.catalog.arrays, tmp_dir / 'catalog')
+        popular_products = state.popular_products
+        if popular_products is not None:
+            write_arrays({name: getattr(popular_products, name)
+                for name in POPULAR_ARRAYS}, tmp_dir / 'popular_products')
+        (state.bundle or nbp._get_model_bundle()).save(
+            tmp_dir / 'model.joblib')
+
+        meta = {
+            'version': SNAPSHOT_VERSION,
+            'path_dir': None if nbp.path_dir is None else str(nbp.path_dir),
+            'frames': list(frames),
+            'icds_stats': {name: int(getattr(icds, name))
+                for name in ICDS_STATS},
+            'feature_registry': features._feature_registry,
+            'used_extractors': (None if features._used_extractors is None
+                else sorted(features._used_extractors)),
+            'prob_name': store.prob_name,
+            'popular_products': None if popular_products is None else {
+                'n_top': popular_products.n_top,
+                'n_top_group': popular_products.n_top_group,
+                'n_min': popular_products.n_min,
+            },
+            'lazy': lazy,
+            'lazy_user_ids': sorted(nbp._lazy_user_ids),
+        }
+        with open(tmp_dir / META_FILENAME, 'wt') as f:
+            json.dump(meta, f, indent=2)
+
+    replace_dir(tmp_dir, path_dir)
+
+
+def _read_popular_products(path_dir, params, mmap_mode):
+    popular_products = PopularProducts(**params)
+    for name, array in read_arrays(path_dir, POPULAR_ARRAYS,
+            mmap_mode).items():
+        setattr(popular_products, name, array)
+    return popular_products
+
+
+def load_snapshot(nbp, path_dir, mmap_mode='r'):
+    """
+    Replace state of `nbp` with the snapshot and publish its model and
+    predictions.
+
+    Returns
+    -------
+    nbp: NextBasketPrediction
+    """
+    path_dir = Path(path_dir)
+    existing_dir = get_existing_dir_path(path_dir)
+    if (existing_dir is None
+            or not (existing_dir / META_FILENAME).exists()):
+        raise FileNotFoundError(
+            f'Snapshot not found at "{path_dir.absolute()}".')
+    path_dir = existing_dir
+    meta_path = path_dir / META_FILENAME
+    with open(meta_path, 'rt') as f:
+        meta = json.load(f)
+    if meta['version'] > SNAPSHOT_VERSION:
+        raise ValueError(f'Snapshot version {meta["version"]} is newer than '
+            f'supported ({SNAPSHOT_VERSION}). Update instacartlib.')
+
+    with nbp.profiler.stage('snapshot.load'):
+        frames = {name: read_frame(path_dir / 'frames' / name, mmap_mode)
+            for name in meta['frames']}
+        df_ui = None
+        if not meta['lazy']:
+            df_ui = FeaturesStore(path_dir / 'features',
+                mmap_mode).get_frame()
+        store = PredictionsStore(**read_arrays(path_dir / 'predictions',
+            STORE_ARRAYS, mmap_mode), prob_name=meta['prob_name'])
+        catalog = ProductCatalog(**read_arrays(path_dir / 'catalog',
+            CATALOG_ARRAYS, mmap_mode))
+        popular_products = None
+        if meta['popular_products'] is not None:
+            popular_products = _read_popular_products(
+                path_dir / 'popular_products', meta['popular_products'],
+                mmap_mode)
+        bundle = ModelBundle.load(path_dir / 'model.joblib', mmap_mode)
+
+    with nbp._write_lock:
+        icds = nbp.icds_predict
+        icds._transactions.df = frames['transactions_raw']
+        icds._transactions._users_last_order_number = None
+        icds._transactions._delta_paths = []
+        icds._transactions._compacted_delta_paths = []
+        icds._transactions._reduced = False
+        icds._products.df = frames['products_raw']
+        for name in icds.dataframes:
+            setattr(icds, name, frames[name])
+        for name, value in meta['icds_stats'].items():
+            setattr(icds, name, value)
+        icds._sorted_by_uid = {}
+
+        features = nbp.features_predict
+        features.df_ui = pd.DataFrame() if df_ui is None else df_ui
+        features._ui_index_created = df_ui is not None
+        features._feature_registry = meta['feature_registry']
+        features.use_feature_extractors(meta['used_extractors'])
+        features.item_stats = None
+        if 'orders_hist' in frames:
+            features.item_stats = ItemStats(
+                frames['orders_hist']['count'].rename(None),
+                frames['delays_hist']['count'].rename(None))
+
+        nbp.path_dir = meta['path_dir']
+        nbp.popular_products = popular_products
+        nbp.model = bundle.model
+        nbp.scaler = bundle.scaler
+        nbp.quantizer = bundle.quantizer
+        nbp.model_bundle = bundle
+        nbp.compiled_bundle = None
+        nbp._compiled_bundle_source = None
+        nbp._model_trained = True
+        nbp.lazy = meta['lazy']
+        nbp._lazy_loaded = True
+        nbp._lazy_user_ids = set(meta['lazy_user_ids'])
+        # Lazy mode never has features of all users
+        nbp._update_predictset_needed = meta['lazy']
+        nbp._update_trainset_needed = True
+        nbp._publish(model=bundle.model, bundle=bundle,
+            predictions_store=store, catalog=catalog,
+            popular_products=copy.copy(popular_products))
+    return nbp
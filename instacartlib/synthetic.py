@@ -0,0 +1,208 @@
+"""
+Synthetic Instacart-like dataset generator.
+
+Capabilities:
+* Generate `products.csv` and `transactions.csv` in the raw schema (same as
+  downloaded files, readable by `read_transactions_csv` and
+  `read_products_csv`).
+* Scale from thousands to billions of rows: users are generated and written
+  chunk by chunk with vectorised numpy code.
+
+Distributions (roughly matching the real dataset):
+- orders per user: 4..100, geometric tail (mean ~17).
+- basket size: 1..80, negative binomial (mean ~9).
+- days since prior order: 0..30, user-specific mean, capped at 30.
+- item popularity: Zipf-like over product ranks.
+- reorders: every user has a pool of preferred items (skewed towards the
+  first ones), ~60% of items after the first order are reorders.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tqdm import tqdm
+
+
+N_PRODUCTS = 49_688
+N_AISLES = 134
+N_DEPARTMENTS = 21
+ROWS_PER_USER_MEAN = 160  # approximate, used to estimate number of users
+
+TRANSACTIONS_COLUMNS = [
+    'order_id',
+    'user_id',
+    'order_number',
+    'order_dow',
+    'order_hour_of_day',
+    'days_since_prior_order',
+    'product_id',
+    'add_to_cart_order',
+    'reordered',
+]
+
+
+def generate_products(n_products=N_PRODUCTS, n_aisles=N_AISLES,
+        n_departments=N_DEPARTMENTS, seed=0):
+    """
+    Returns
+    -------
+    df_prod_raw: DataFrame
+        Columns (6): product_id, product_name, aisle_id, department_id,
+            aisle, department
+    """
+    rng = np.random.default_rng(seed)
+    aisle_department_id = rng.integers(1, n_departments + 1, size=n_aisles)
+    aisle_id = rng.integers(1, n_aisles + 1, size=n_products)
+    department_id = aisle_department_id[aisle_id - 1]
+    product_id = np.arange(1, n_products + 1)
+    return pd.DataFrame({
+        'product_id': product_id,
+        'product_name': [f'product {i}' for i in product_id],
+        'aisle_id': aisle_id,
+        'department_id': department_id,
+        'aisle': [f'aisle {i}' for i in aisle_id],
+        'department': [f'department {i}' for i in department_id],
+    })
+
+
+def _get_popularity_cdf(n_products, zipf_exponent, rng):
+    """ Zipf-like popularity over randomly permuted product ids. """
+    weights = 1. / np.arange(1, n_products + 1) ** zipf_exponent
+    weights = weights[rng.permutation(n_products)]
+    return np.cumsum(weights) / weights.sum()
+
+
+def _sample_products(popularity_cdf, size, rng):
+    product_idx = np.searchsorted(popularity_cdf, rng.random(size),
+        side='right')
+    return product_idx.clip(max=len(popularity_cdf) - 1) + 1
+
+
+def _repeat_segments_arange(lengths):
+    """ [2, 3] -> [0, 1, 0, 1, 2] """
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+
+
+def generate_transactions_chunk(n_users, popularity_cdf, rng,
+        first_user_id=1, first_order_id=1, reorder_prob=.7,
+        pool_size_mean=30):
+    """
+    Generate raw transactions for `n_users` consecutive user ids.
+
+    Returns
+    -------
+    df_trns_raw: DataFrame
+        Columns: see `TRANSACTIONS_COLUMNS`. Rows are ordered by
+        [user_id, order_number, add_to_cart_order].
+    """
+    # Users
+    n_orders = (4 + rng.geometric(1 / 14, size=n_users) - 1).clip(max=100)
+    days_mean = rng.uniform(3, 25, size=n_users)
+    basket_mean = rng.gamma(4., 3., size=n_users).clip(min=1)
+    pool_size = (1 + rng.poisson(pool_size_mean, size=n_users))
+    pool_offsets = np.cumsum(pool_size) - pool_size
+    pool = _sample_products(popularity_cdf, pool_size.sum(), rng)
+
+    # Orders
+    order_user = np.repeat(np.arange(n_users), n_orders)
+    n_orders_total = len(order_user)
+    order_number = _repeat_segments_arange(n_orders) + 1
+    days = rng.geometric(1 / (1 + days_mean[order_user])) - 1
+    days = days.clip(max=30).astype('float32')
+    days[order_number == 1] = np.nan
+    order_dow = rng.integers(0, 7, size=n_orders_total)
+    order_hour = rng.normal(13.5, 4.2, size=n_orders_total).round()
+    order_hour = order_hour.clip(0, 23).astype('int64')
+    basket_size = 1 + rng.negative_binomial(2,
+        2 / (2 + basket_mean[order_user] - 1))
+    basket_size = basket_size.clip(max=80)
+
+    # Transactions
+    row_order = np.repeat(np.arange(n_orders_total), basket_size)
+    row_user = order_user[row_order]
+    n_rows = len(row_order)
+    from_pool = rng.random(n_rows) < reorder_prob
+    pool_pos = (rng.random(n_rows) ** 2 * pool_size[row_user]).astype('int64')
+    product_id = np.where(
+        from_pool,
+        pool[pool_offsets[row_user] + pool_pos],
+        _sample_products(popularity_cdf, n_rows, rng),
+    )
+
+    df = pd.DataFrame({
+        'order_id': first_order_id + row_order,
+        'user_id': first_user_id + row_user,
+        'order_number': order_number[row_order],
+        'order_dow': order_dow[row_order],
+        'order_hour_of_day': order_hour[row_order],
+        'days_since_prior_order': days[row_order],
+        'product_id': product_id,
+    })
+    # Products in a basket are unique
+    df = df[~df.duplicated(['order_id', 'product_id'])]
+    df['add_to_cart_order'] = df.groupby('order_id').cumcount() + 1
+    df['reordered'] = df.duplicated(['user_id', 'product_id']).astype('int64')
+    return df.reset_index(drop=True)
+
+
+def iter_transactions_chunks(n_rows, n_products=N_PRODUCTS, seed=0,
+        users_per_chunk=20_000, zipf_exponent=1.):
+    """
+    Yield raw transactions chunks (see `generate_transactions_chunk`) until
+    approximately `n_rows` rows are generated. The last user is never
+    truncated, so the total number of rows slightly exceeds `n_rows`.
+    """
+    rng = np.random.default_rng(seed)
+    popularity_cdf = _get_popularity_cdf(n_products, zipf_exponent, rng)
+    n_rows_generated = 0
+    first_user_id = 1
+    first_order_id = 1
+    while n_rows_generated < n_rows:
+        n_users_left = -(-(n_rows - n_rows_generated) // ROWS_PER_USER_MEAN)
+        n_users = min(users_per_chunk, max(n_users_left, 1))
+        df = generate_transactions_chunk(n_users, popularity_cdf, rng,
+            first_user_id=first_user_id, first_order_id=first_order_id)
+
+        n_rows_left = n_rows - n_rows_generated
+        if len(df) > n_rows_left:
+            last_user_id = df.user_id.values[n_rows_left - 1]
+            df = df[df.user_id <= last_user_id]
+        n_rows_generated += len(df)
+        first_user_id = df.user_id.values[-1] + 1
+        first_order_id = df.order_id.values[-1] + 1
+        yield df
+
+
+def write_synthetic_dataset(path_dir, n_rows, n_products=N_PRODUCTS, seed=0,
+        users_per_chunk=20_000, show_progress=False):
+    """
+    Write `transactions.csv` (~n_rows rows) and `products.csv` to `path_dir`.
+    `transactions.csv` is written last, under a temporary name renamed when
+    complete, so its presence means the dataset is complete.
+
+    Returns
+    -------
+    n_rows: int
+        Number of rows written to `transactions.csv`.
+    """
+    path_dir = Path(path_dir)
+    path_dir.mkdir(parents=True, exist_ok=True)
+    generate_products(n_products, seed=seed).to_csv(
+        path_dir / 'products.csv', index=False)
+
+    n_rows_written = 0
+    tmp_path = path_dir / 'transactions.csv.tmp'
+    with open(tmp_path, 'wt', newline='') as f, \
+            tqdm(total=n_rows, disable=not show_progress) as progress_bar:
+        f.write(','.join(TRANSACTIONS_COLUMNS) + '\n')
+        for df in iter_transactions_chunks(n_rows, n_products, seed=seed,
+                users_per_chunk=users_per_chunk):
+            df.to_csv(f, header=False, index=False,
+                columns=TRANSACTIONS_COLUMNS, float_format='%.0f')
+            n_rows_written += len(df)
+            progress_bar.update(len(df))
+    tmp_path.replace(path_dir / 'transactions.csv')
+    return n_rows_written
@@ -1,5 +1,6 @@
 import contextlib
 import hashlib
+import shutil
 import time
 
 from pathlib import Path
@@ -79,6 +80,39 @@ def drop_duplicates(sequence):
     return list(dict.fromkeys(sequence))
 
 
+def get_old_dir_path(path_dir):
+    """ Where `replace_dir` keeps the replaced directory meanwhile. """
+    path_dir = Path(path_dir)
+    return path_dir.with_name(path_dir.name + '.old')
+
+
+def replace_dir(tmp_dir, path_dir):
+    """
+    Move fully written `tmp_dir` to `path_dir`. The previous `path_dir` is
+    renamed aside first and deleted last, so after a crash there is always
+    either the new directory at `path_dir` or the previous one at
+    `get_old_dir_path(path_dir)`.
+    """
+    path_dir = Path(path_dir)
+    old_dir = get_old_dir_path(path_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    if path_dir.exists():
+        path_dir.rename(old_dir)
+    Path(tmp_dir).rename(path_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+
+
+def get_existing_dir_path(path_dir):
+    """ `path_dir` or the previous directory if `replace_dir` crashed
+    between its renames (None if neither exists). """
+    for path in [Path(path_dir), get_old_dir_path(path_dir)]:
+        if path.exists():
+            return path
+    return None
+
+
 # Based on: https://stackoverflow.com/a/31278890/7204581
 def hash_for_file(path, algorithm='sha256', block_size=256*128,
         human_readable=True):
@@ -0,0 +1,59 @@
+from instacartlib.FeatureQuantizer import FeatureQuantizer, NAN_CODE
+from instacartlib.FeatureQuantizer import _get_midpoint_quantiles
+from instacartlib.FeaturesStore import FeaturesStoreWriter
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'a': np.array([1, 2, 3, 4] * 250, dtype='uint8'),
+        'b': rng.normal(size=1000).astype('float32'),
+        'c': np.r_[np.nan, np.full(999, .5)],
+    })
+
+
+def test_FeatureQuantizer_fit_transform(df):
+    quantizer = FeatureQuantizer(max_bins=16).fit(df, columns=['c', 'a', 'b'])
+    assert quantizer.get_edges('a').tolist() == [1.5, 2.5, 3.5]
+    assert len(quantizer.get_edges('c')) == 0
+    assert 10 <= len(quantizer.get_edges('b')) <= 15
+
+    codes = quantizer.transform(df)
+    assert codes.dtype == np.uint8 and codes.shape == (1000, 3)
+    assert codes[:4, 1].tolist() == [0, 1, 2, 3]
+    assert codes[:2, 0].tolist() == [NAN_CODE, 0]
+    # Order of values is kept: x <= edges[k] - code <= k
+    b, edges = df.b.values, quantizer.get_edges('b')
+    for k, edge in enumerate(edges):
+        assert ((b <= edge) == (codes[:, 2] <= k)).all()
+    # Rows are coded independently of each other
+    assert (quantizer.transform(df.iloc[500:]) == codes[500:]).all()
+
+
+def test_FeatureQuantizer_features_store(df, tmp_dir):
+    df.index = pd.MultiIndex.from_arrays([np.arange(1000), np.zeros(1000)],
+        names=['uid', 'iid'])
+    store = FeaturesStoreWriter(tmp_dir, len(df)).write(df).close()
+    quantizer = FeatureQuantizer().fit(df)
+    assert (quantizer.transform(store) == quantizer.transform(df)).all()
+
+
+def test_FeatureQuantizer_errors(df):
+    with pytest.raises(ValueError, match='max_bins'):
+        FeatureQuantizer(max_bins=256)
+    with pytest.raises(ValueError, match='not fitted'):
+        FeatureQuantizer().transform(df)
+    with pytest.raises(ValueError, match=r"Missing features: \['b'\]"):
+        FeatureQuantizer().fit(df).transform(df[['a', 'c']])
+
+
+def test_get_midpoint_quantiles():
+    values = np.array([4., 0., 3., 1., 2.])
+    assert _get_midpoint_quantiles(values, [0., .1, .5, .6, 1.]).tolist() == [
+        0., .5, 2., 2.5, 4.]
@@ -0,0 +1,34 @@
+from instacartlib.FeatureScaler import FeatureScaler
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'a': np.array([1, 2, 3, 4], dtype='uint8'),
+        'b': np.array([.5, .5, .5, .5], dtype='float32'),
+        'c': np.array([10., 0., 10., 0.]),
+    })
+
+
+def test_FeatureScaler_fit_transform(df):
+    scaler = FeatureScaler().fit(df, columns=['c', 'a', 'b'])
+    x = scaler.transform(df)
+    assert x.dtype == np.float64
+    expected = df[['c', 'a', 'b']].values.astype('float64')
+    expected = (expected - expected.mean(axis=0)) / [5., 1.25 ** .5, 1.]
+    np.testing.assert_allclose(x, expected)
+    # Rows are scaled independently of each other
+    np.testing.assert_allclose(scaler.transform(df.iloc[2:]), x[2:])
+
+
+def test_FeatureScaler_errors(df):
+    with pytest.raises(ValueError, match='not fitted'):
+        FeatureScaler().transform(df)
+    scaler = FeatureScaler().fit(df)
+    with pytest.raises(ValueError, match=r"Missing features: \['b'\]"):
+        scaler.transform(df.drop(columns='b'))
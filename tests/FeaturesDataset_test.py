@@ -7,6 +7,7 @@ from instacartlib.FeaturesDataset import _assert_extractor_output
 from instacartlib.FeaturesDataset import _process_extractor_output
 from instacartlib.FeaturesDataset import _get_feature_cache_path
 from instacartlib.FeaturesDataset import FeaturesDataset
+from instacartlib.ItemStats import ItemStats
 
 
 from pathlib import Path
@@ -166,3 +167,80 @@ def test_FeaturesDataset_print(capsys):
     fsds._print(ValueError('info'), indent=-1)
     out_2, _ = capsys.readouterr()
     assert out_2.startswith('info')
+
+
+@pytest.mark.parametrize("n_shards", [1, 3, 100])
+def test_FeaturesDataset_extract_features_sharded(icds_train, tmp_dir,
+        n_shards):
+    fsds = FeaturesDataset()
+    fsds.extract_features(**icds_train.dataframes)
+
+    fsds_sharded = FeaturesDataset()
+    fsds_sharded.extract_features_sharded(tmp_dir, n_shards,
+        **icds_train.dataframes)
+    assert fsds_sharded.df_ui.shape == (0, 0)
+    assert fsds_sharded._feature_registry == fsds._feature_registry
+
+    output = fsds_sharded.features_store.get_frame()
+    expected = fsds.df_ui.sort_index(level='uid', sort_remaining=False)
+    pd.testing.assert_frame_equal(output, expected)
+
+
+def test_FeaturesDataset_extract_features_sharded_invalid(df_prod, tmp_dir):
+    with pytest.raises(ValueError, match='df_trns'):
+        FeaturesDataset().extract_features_sharded(tmp_dir, 2, df_prod=df_prod)
+
+
+def test_FeaturesDataset_update_users(icds_predict):
+    fsds = FeaturesDataset()
+    fsds.extract_features(**icds_predict.dataframes)
+    expected = fsds.df_ui.copy()
+    df_trns_1 = icds_predict.df_trns[icds_predict.df_trns.uid == 1]
+
+    with pytest.raises(ValueError, match='Item statistics'):
+        fsds.update_users([1], df_trns_1,
+            **icds_predict.get_users_dataframes([1]))
+
+    fsds.item_stats = ItemStats.from_df_trns(icds_predict.df_trns)
+    fsds.update_users([1], df_trns_1,
+        **icds_predict.get_users_dataframes([1]))
+    pd.testing.assert_frame_equal(
+        fsds.df_ui.sort_index(level='uid', sort_remaining=False),
+        expected)
+    assert fsds.df_ui.index.get_level_values('uid')[-1] == 1
+
+
+def test_FeaturesDataset_extract_users_features(icds_predict):
+    fsds = FeaturesDataset()
+    fsds.extract_features(**icds_predict.dataframes)
+    user_ids = [2, 3]
+    dataframes = icds_predict.get_users_dataframes(user_ids)
+
+    with pytest.raises(ValueError, match='Item statistics'):
+        fsds.extract_users_features(**dataframes)
+
+    fsds.item_stats = ItemStats.from_df_trns(icds_predict.df_trns)
+    output = fsds.extract_users_features(**dataframes)
+    is_users = fsds.df_ui.index.get_level_values('uid').isin(user_ids)
+    pd.testing.assert_frame_equal(output, fsds.df_ui[is_users])
+
+
+def test_FeaturesDataset_use_feature_extractors(icds_predict):
+    fsds = FeaturesDataset()
+    with pytest.raises(ValueError, match='Unknown feature extractors'):
+        fsds.use_feature_extractors(['999_missing.extractor'])
+    fsds.use_feature_extractors(['002_ui_avg_cart_pos.avg_cart_pos'])
+    assert list(fsds.feature_extractors) == [
+        '002_ui_avg_cart_pos.avg_cart_pos']
+    fsds.extract_features(**icds_predict.dataframes)
+    assert list(fsds.df_ui.columns) == ['ui_avg_cart_pos']
+    fsds.use_feature_extractors(None)
+    assert len(fsds.feature_extractors) == 4
+
+
+def test_FeaturesDataset_clear_features(icds_predict):
+    fsds = FeaturesDataset()
+    fsds.extract_features(**icds_predict.dataframes)
+    expected = fsds.df_ui.copy()
+    fsds.clear_features().extract_features(**icds_predict.dataframes)
+    pd.testing.assert_frame_equal(fsds.df_ui, expected)
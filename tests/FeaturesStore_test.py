@@ -0,0 +1,49 @@
+from instacartlib.FeaturesStore import FeaturesStore
+from instacartlib.FeaturesStore import FeaturesStoreWriter
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def df_ui():
+    index = pd.MultiIndex.from_arrays(
+        [np.array([1, 1, 2, 3], dtype='uint32'),
+         np.array([10, 11, 10, 12], dtype='uint32')],
+        names=['uid', 'iid'])
+    return pd.DataFrame({
+        'f_uint8': np.array([1, 2, 3, 4], dtype='uint8'),
+        'f_float32': np.array([.5, .25, 1., 2.], dtype='float32'),
+    }, index=index)
+
+
+def test_FeaturesStore_write_read(tmp_dir, df_ui):
+    writer = FeaturesStoreWriter(tmp_dir, n_rows=len(df_ui))
+    writer.write(df_ui.iloc[:1])
+    with pytest.raises(FileNotFoundError):
+        FeaturesStore(tmp_dir)
+    store = writer.write(df_ui.iloc[1:]).close()
+
+    assert len(store) == 4
+    assert store.columns == ['f_uint8', 'f_float32']
+    assert isinstance(store['f_uint8'], np.memmap)
+    pd.testing.assert_frame_equal(store.get_frame(), df_ui)
+    pd.testing.assert_frame_equal(store.get_frame(1, 3), df_ui.iloc[1:3])
+    np.testing.assert_array_equal(store.get_values(), df_ui.values)
+    assert repr(store).startswith('<FeaturesStore shape=(4, 2)')
+
+
+def test_FeaturesStoreWriter_invalid(tmp_dir, df_ui):
+    writer = FeaturesStoreWriter(tmp_dir, n_rows=len(df_ui))
+    writer.write(df_ui)
+    with pytest.raises(ValueError, match='columns'):
+        writer.write(df_ui[['f_uint8']])
+    with pytest.raises(ValueError, match='created for 4 rows'):
+        writer.write(df_ui)
+
+    writer = FeaturesStoreWriter(tmp_dir, n_rows=len(df_ui) + 1)
+    writer.write(df_ui)
+    with pytest.raises(ValueError, match='Expected 5 rows'):
+        writer.close()
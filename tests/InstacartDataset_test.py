@@ -229,3 +229,41 @@ def test_InstacartDataset_read_dir_reduced_default():
         .default
     )
     assert reduced_default_arg_value == False
+
+
+def test_InstacartDataset_update_users(test_data_dir):
+    inst = InstacartDataset(train=True, n_orders_limit=3).read_dir(
+        test_data_dir)
+    inst_updated = InstacartDataset(train=True, n_orders_limit=3).read_dir(
+        test_data_dir)
+    df_raw = inst_updated._transactions.df
+    last_order_id = df_raw[df_raw.user_id == 1].order_id.iloc[-1]
+    inst_updated._transactions.df = df_raw[df_raw.order_id != last_order_id]
+    inst_updated.update_users([1, 3])
+    inst_updated._transactions.append(df_raw[df_raw.order_id == last_order_id])
+    inst_updated.update_users([1])
+
+    for name, df in inst.dataframes.items():
+        df_updated = inst_updated.dataframes[name]
+        if 'uid' in df:
+            df = df.sort_values('uid', kind='stable').reset_index(drop=True)
+            df_updated = (df_updated.sort_values('uid', kind='stable')
+                .reset_index(drop=True))
+        pd.testing.assert_frame_equal(df_updated, df)
+
+    dataframes_1 = inst.get_users_dataframes([1])
+    assert (dataframes_1['df_trns'].uid == 1).all()
+    assert (dataframes_1['df_ord'].uid == 1).all()
+    assert len(dataframes_1['df_prod']) == len(inst.df_prod)
+
+
+def test_InstacartDataset_get_users_dataframes_sorted(test_data_dir):
+    inst = InstacartDataset(train=False).read_dir(test_data_dir)
+    user_ids = [5, 2, 100_000]
+    output = inst.get_users_dataframes(user_ids)
+    assert inst._sorted_by_uid['df_trns']
+
+    for name in ['df_trns', 'df_ord']:
+        df = inst.dataframes[name]
+        pd.testing.assert_frame_equal(output[name],
+            df[df.uid.isin(user_ids)])
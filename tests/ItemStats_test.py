@@ -0,0 +1,67 @@
+from instacartlib.ItemStats import ItemStats
+from instacartlib.ItemStats import _median_from_hist
+from instacartlib.FeaturesDataset import FeaturesDataset
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def df_ui_extracted(icds_predict):
+    fsds = FeaturesDataset()
+    fsds.extract_features(**icds_predict.dataframes)
+    return fsds.df_ui
+
+
+def test_median_from_hist():
+    hist = pd.Series([1, 1, 2, 3, 1],
+        index=pd.MultiIndex.from_tuples(
+            [(7, 1.), (7, 4.), (5, 2.), (5, 3.), (9, 0.5)]))
+    # iid=5: [2, 2, 3, 3, 3]; iid=7: [1, 4]; iid=9: [0.5]
+    expected = pd.Series([3., 2.5, 0.5], index=pd.Index([5, 7, 9],
+        name='iid'))
+    pd.testing.assert_series_equal(_median_from_hist(hist), expected)
+
+
+def test_ItemStats_features_equal_extractors(icds_predict, df_ui_extracted):
+    df_i = ItemStats.from_df_trns(icds_predict.df_trns).get_features()
+    columns = df_i.columns.to_list()
+    expected = df_ui_extracted[columns]
+    output = df_i.reindex(expected.index, level='iid')
+    pd.testing.assert_frame_equal(output, expected)
+
+
+def test_ItemStats_add_sub(icds_predict):
+    df_trns = icds_predict.df_trns
+    is_user_1 = df_trns.uid == df_trns.uid.iloc[0]
+    stats_all = ItemStats.from_df_trns(df_trns)
+    stats_1 = ItemStats.from_df_trns(df_trns[is_user_1])
+    stats_rest = ItemStats.from_df_trns(df_trns[~is_user_1])
+
+    pd.testing.assert_frame_equal(
+        (stats_1 + stats_rest).get_features(), stats_all.get_features())
+    pd.testing.assert_frame_equal(
+        (stats_all - stats_1).get_features(), stats_rest.get_features())
+    with pytest.raises(ValueError, match='negative'):
+        stats_1 - stats_all
+
+
+def test_ItemStats_empty():
+    stats = ItemStats()
+    assert repr(stats) == '<ItemStats items=0>'
+    assert len(stats.get_features()) == 0
+
+
+
+def test_ItemStats_features_passed_to_extractors(icds_predict,
+        df_ui_extracted):
+    df_trns = icds_predict.df_trns
+    df_trns_1 = df_trns[df_trns.uid == df_trns.uid.iloc[0]]
+    df_i = ItemStats.from_df_trns(df_trns).get_features()
+
+    fsds = FeaturesDataset()
+    fsds.extract_features(df_trns=df_trns_1, df_i=df_i)
+    expected = df_ui_extracted.loc[fsds.df_ui.index]
+    pd.testing.assert_frame_equal(fsds.df_ui, expected)
@@ -0,0 +1,118 @@
+from instacartlib.ModelBundle import ModelBundle, FORMAT_VERSION
+from instacartlib.ModelBundle import get_extractors_versions
+from instacartlib.ModelBundle import get_data_fingerprint
+from instacartlib.FeatureScaler import FeatureScaler
+from instacartlib.TreeEnsemble import TreeEnsemble
+from instacartlib.feature_extractors import exports as feature_extractors
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression
+
+import pytest
+
+
+@pytest.fixture
+def df_ui():
+    index = pd.MultiIndex.from_arrays([[1, 1, 2, 2], [10, 20, 10, 30]],
+        names=['uid', 'iid'])
+    return pd.DataFrame({
+        'f_a': np.array([1, 2, 3, 4], dtype='uint8'),
+        'f_b': np.array([.1, .4, .2, .3], dtype='float32'),
+        'ui_in_target': np.array([0, 1, 0, 1], dtype='uint8'),
+    }, index=index)
+
+
+@pytest.fixture
+def bundle(df_ui):
+    x, y = df_ui[['f_a', 'f_b']].values, df_ui.ui_in_target.values
+    model = LogisticRegression().fit(x, y)
+    return ModelBundle.from_features(model, df_ui,
+        feature_registry={'f_a': 'ext_a', 'f_b': 'ext_b'})
+
+
+def test_get_extractors_versions():
+    versions = get_extractors_versions(feature_extractors)
+    assert set(versions) == set(feature_extractors)
+    assert all(len(version) == 16 for version in versions.values())
+    assert get_extractors_versions(feature_extractors) == versions
+    # Source of builtins isn't available
+    assert get_extractors_versions({'builtin': len}) == {'builtin': None}
+
+
+def test_get_data_fingerprint(df_ui):
+    fingerprint = get_data_fingerprint(df_ui)
+    assert fingerprint['n_rows'] == 4
+    assert fingerprint['n_users'] == 2
+    assert fingerprint['n_items'] == 3
+    assert fingerprint['positive_rate'] == .5
+    changed = df_ui.assign(ui_in_target=np.uint8(1))
+    assert get_data_fingerprint(changed)['sha256'] != fingerprint['sha256']
+
+
+def test_ModelBundle_save_load(bundle, df_ui, tmp_dir):
+    assert bundle.features == [('f_a', 'uint8', 'ext_a'),
+        ('f_b', 'float32', 'ext_b')]
+    assert bundle.extractor_names == ['ext_a', 'ext_b']
+    bundle.save(tmp_dir / 'bundle.joblib')
+    loaded = ModelBundle.load(tmp_dir / 'bundle.joblib')
+    assert loaded.features == bundle.features
+    assert loaded.fingerprint == bundle.fingerprint
+    # Arrays are memory-mapped
+    assert isinstance(loaded.model.coef_, np.memmap)
+    np.testing.assert_array_equal(
+        loaded.model.predict_proba(loaded.get_x(df_ui)),
+        bundle.model.predict_proba(bundle.get_x(df_ui)))
+
+
+def test_ModelBundle_load_previous_formats(bundle, tmp_dir):
+    joblib.dump(bundle.model, tmp_dir / 'model.joblib', compress=3)
+    loaded = ModelBundle.load(tmp_dir / 'model.joblib')
+    assert loaded.features is None and loaded.scaler is None
+    scaler = FeatureScaler()
+    joblib.dump({'model': bundle.model, 'scaler': scaler},
+        tmp_dir / 'model.joblib')
+    assert ModelBundle.load(tmp_dir / 'model.joblib').scaler is not None
+
+    newer = {**bundle.to_dict(), 'format_version': FORMAT_VERSION + 1}
+    with pytest.raises(ValueError, match='newer than supported'):
+        ModelBundle.from_object(newer)
+
+
+def test_ModelBundle_get_x(bundle, df_ui):
+    x = bundle.get_x(df_ui.drop(columns='ui_in_target'))
+    np.testing.assert_array_equal(x, df_ui[['f_a', 'f_b']].values)
+    # Columns in model's order, extra features are ignored
+    df_reordered = df_ui[['f_b', 'ui_in_target', 'f_a']]
+    np.testing.assert_array_equal(bundle.get_x(df_reordered), x)
+
+    with pytest.raises(ValueError, match=r"missing for the model: \['f_b'\]"):
+        bundle.get_x(df_ui.drop(columns='f_b'))
+    with pytest.raises(ValueError, match='f_a: uint8 -> float64'):
+        bundle.get_x(df_ui.astype({'f_a': 'float64'}))
+
+
+def test_ModelBundle_check_extractors(bundle):
+    extractors = {'ext_a': get_data_fingerprint, 'ext_b': get_data_fingerprint}
+    bundle.extractors = get_extractors_versions(extractors)
+    assert bundle.check_extractors(extractors) == []
+    with pytest.warns(UserWarning, match=r"changed .*\['ext_b'\]"):
+        assert bundle.check_extractors({'ext_a': get_data_fingerprint}) == [
+            'ext_b']
+
+
+def test_ModelBundle_compile(df_ui, tmp_dir):
+    x, y = df_ui[['f_a', 'f_b']].values, df_ui.ui_in_target.values
+    model = GradientBoostingClassifier(n_estimators=3).fit(x, y)
+    bundle = ModelBundle.from_features(model, df_ui).compile()
+    assert isinstance(bundle.model, TreeEnsemble)
+    assert bundle.compile() is bundle
+    bundle.save(tmp_dir / 'model.joblib')
+    bundle_loaded = ModelBundle.load(tmp_dir / 'model.joblib')
+    assert isinstance(bundle_loaded.model.node_thresholds, np.memmap)
+    assert bundle_loaded.features == bundle.features
+    x = bundle_loaded.get_x(df_ui)
+    assert (bundle_loaded.model.predict_proba(x) == model.predict_proba(x)
+        ).all()
@@ -0,0 +1,440 @@
+from instacartlib.NextBasketPrediction import NextBasketPrediction
+from instacartlib.Transactions import read_transactions_csv
+from instacartlib.sampling import DownsampledModel
+
+import shutil
+import threading
+
+import joblib
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def trained_model():
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model)
+    nbp.add_data('tests/testing_data')
+    nbp.train_model()
+    return nbp.model
+
+
+@pytest.fixture
+def nbp(trained_model, test_data_dir):
+    nbp = NextBasketPrediction(model=trained_model)
+    return nbp.add_data(test_data_dir).update_predictions()
+
+
+@pytest.fixture
+def changed_user_ids():
+    return [1, 2]
+
+
+@pytest.fixture
+def split_data_dir(tmp_dir, test_data_dir, changed_user_ids):
+    """
+    Directory with transactions except the last order of `changed_user_ids`
+    and a frame with these orders (raw format).
+    """
+    df_raw = read_transactions_csv(test_data_dir / 'transactions.csv')
+    last_order_ids = (df_raw[df_raw.user_id.isin(changed_user_ids)]
+        .drop_duplicates('user_id', keep='last').order_id)
+    is_delta = df_raw.order_id.isin(last_order_ids)
+    df_raw[~is_delta].to_csv(tmp_dir / 'transactions.csv', index=False)
+    shutil.copy(test_data_dir / 'products.csv', tmp_dir)
+    return tmp_dir, df_raw[is_delta]
+
+
+def test_NextBasketPrediction_add_transactions(nbp, trained_model,
+        split_data_dir, changed_user_ids):
+    base_dir, df_raw_delta = split_data_dir
+    nbp_inc = NextBasketPrediction(model=trained_model)
+    with pytest.raises(ValueError, match='Predictions have to be made'):
+        nbp_inc.add_transactions(df_raw_delta)
+    nbp_inc.add_data(base_dir).update_predictions()
+    predictions_before = nbp_inc.predictions.copy()
+
+    nbp_inc.add_transactions(df_raw_delta, write_delta=True)
+    assert nbp_inc._update_trainset_needed
+    assert (base_dir / 'transactions_delta' / '000001.npz').exists()
+
+    is_changed = nbp.predictions.uid.isin(changed_user_ids)
+    is_changed_inc = nbp_inc.predictions.uid.isin(changed_user_ids)
+    pd.testing.assert_frame_equal(
+        nbp_inc.predictions[is_changed_inc].reset_index(drop=True),
+        nbp.predictions[is_changed].reset_index(drop=True))
+    pd.testing.assert_frame_equal(
+        nbp_inc.predictions[~is_changed_inc].reset_index(drop=True),
+        predictions_before[~predictions_before.uid.isin(changed_user_ids)]
+            .reset_index(drop=True))
+    assert nbp_inc.predictions.uid.is_monotonic_increasing
+
+
+def test_NextBasketPrediction_scale_features(tmp_dir, test_data_dir):
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model, scale_features=True)
+    nbp.add_data(test_data_dir).train_model().update_predictions()
+    assert nbp.state.bundle.scaler is nbp.scaler
+    assert nbp.scaler.columns == list(nbp.features_predict.df_ui.columns)
+    predictions = nbp.predictions
+
+    # Scaling doesn't depend on rows scored together
+    user_ids = [1, 2]
+    nbp.refresh_users(user_ids)
+    pd.testing.assert_frame_equal(nbp.predictions, predictions)
+    nbp_chunked = NextBasketPrediction(model=nbp.model, chunk_size=50)
+    nbp_chunked.scaler = nbp.scaler
+    nbp_chunked.add_data(test_data_dir).update_predictions()
+    pd.testing.assert_frame_equal(nbp_chunked.predictions, predictions)
+
+    nbp.save_model(tmp_dir / 'model.joblib')
+    nbp_lazy = NextBasketPrediction().add_data(test_data_dir).load_model(
+        path=tmp_dir / 'model.joblib', lazy=True)
+    assert nbp_lazy.scaler.mean.tolist() == nbp.scaler.mean.tolist()
+    pd.testing.assert_frame_equal(nbp_lazy.get_predictions(user_ids),
+        nbp.get_predictions(user_ids))
+
+
+def test_NextBasketPrediction_quantize_features(tmp_dir, test_data_dir):
+    with pytest.raises(ValueError, match='either'):
+        NextBasketPrediction(scale_features=True, quantize_features=True)
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model, quantize_features=True)
+    nbp.add_data(test_data_dir).train_model().update_predictions()
+    assert nbp.state.bundle.quantizer is nbp.quantizer
+    x = nbp.state.bundle.get_x(nbp.features_predict.df_ui)
+    assert x.dtype == np.uint8
+    predictions = nbp.predictions
+    nbp.refresh_users([1, 2])
+    pd.testing.assert_frame_equal(nbp.predictions, predictions)
+
+    nbp.save_model(tmp_dir / 'model.joblib')
+    nbp_loaded = NextBasketPrediction().add_data(test_data_dir).load_model(
+        path=tmp_dir / 'model.joblib')
+    assert nbp_loaded.quantizer.edges.tolist() == nbp.quantizer.edges.tolist()
+    pd.testing.assert_frame_equal(nbp_loaded.predictions, predictions)
+    nbp_loaded.compile_model().update_predictions()
+    pd.testing.assert_frame_equal(nbp_loaded.predictions, predictions)
+
+
+def test_NextBasketPrediction_negative_rate(tmp_dir, test_data_dir):
+    with pytest.raises(ValueError, match='negative_rate'):
+        NextBasketPrediction(negative_rate=1.5)
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model, negative_rate=.5)
+    nbp.add_data(test_data_dir).train_model().update_predictions()
+    assert isinstance(nbp.model, DownsampledModel)
+    assert nbp.model.model is model
+    assert 0 < nbp.model.negative_rate < 1
+    fit_event, = nbp.profiler.get_events('train.fit')
+    assert fit_event.rows_in < .8 * len(nbp.features_train.df_ui)
+
+    # Retrained model is wrapped once
+    nbp.train_model()
+    assert nbp.model.model.__class__ is GradientBoostingClassifier
+    nbp.save_model(tmp_dir / 'model.joblib')
+    nbp_loaded = NextBasketPrediction().add_data(test_data_dir).load_model(
+        path=tmp_dir / 'model.joblib')
+    assert isinstance(nbp_loaded.model, DownsampledModel)
+    predictions = nbp_loaded.predictions
+    nbp_loaded.compile_model()
+    pd.testing.assert_frame_equal(nbp_loaded.predictions, predictions,
+        check_exact=False, rtol=1e-6)
+
+    report = nbp.get_negative_sampling_report(negative_rates=(.5,),
+        holdout=.3)
+    assert report.negative_rate.tolist() == [1., .5]
+    assert report.rows[1] < report.rows[0]
+
+
+def test_NextBasketPrediction_profiler(nbp, tmp_dir):
+    nbp.predictions_to_csv(tmp_dir / 'predictions.csv')
+    names = {event.name for event in nbp.profiler.events}
+    assert {
+        'ingest.transactions',
+        'ingest.products',
+        'preprocess.transactions',
+        'preprocess.order_r',
+        'preprocess.days_until_same_item',
+        'features.ui_index',
+        'features.extractor.001_ui_buy_counts.buy_counts',
+        'dataset.predict',
+        'predict.score',
+        'predict.fallback_fill',
+        'export.csv',
+    } <= names
+
+
+@pytest.mark.parametrize('chunk_size', [1, 50, 10**9])
+def test_NextBasketPrediction_chunked_scoring_same_predictions(nbp,
+        trained_model, test_data_dir, chunk_size):
+    nbp_chunked = NextBasketPrediction(model=trained_model,
+        chunk_size=chunk_size)
+    nbp_chunked.add_data(test_data_dir).update_predictions()
+    pd.testing.assert_frame_equal(nbp_chunked.predictions, nbp.predictions)
+
+
+def test_NextBasketPrediction_top_k_keeps_first_predictions(nbp,
+        trained_model, test_data_dir):
+    nbp_top_k = NextBasketPrediction(model=trained_model, chunk_size=100,
+        top_k=20)
+    nbp_top_k.add_data(test_data_dir).update_predictions()
+    for n_limit in [10, 20]:
+        pd.testing.assert_frame_equal(
+            nbp_top_k.get_predictions(range(1, 11), n_limit=n_limit)
+                .reset_index(drop=True),
+            nbp.get_predictions(range(1, 11), n_limit=n_limit)
+                .reset_index(drop=True))
+    assert nbp_top_k.predictions.groupby('uid').size().max() <= 20 + 16
+
+
+def test_NextBasketPrediction_get_predictions_n_limit(nbp):
+    user_ids = [2, 5, 7]
+    expected = (nbp.predictions[nbp.predictions.uid.isin(user_ids)]
+        .groupby('uid', sort=False).head(3)
+        .reset_index(drop=True))
+    predictions = nbp.get_predictions(user_ids, n_limit=3)
+    pd.testing.assert_frame_equal(predictions.drop(columns='product_name'),
+        expected)
+    for user_ids_like in [set(user_ids), (uid for uid in user_ids)]:
+        pd.testing.assert_frame_equal(
+            nbp.get_predictions(user_ids_like, n_limit=3), predictions)
+
+
+def test_NextBasketPrediction_get_history_predictions(nbp):
+    for uid in [1, 2, 7]:
+        history = nbp.get_user_history(uid)
+        pd.testing.assert_frame_equal(nbp.get_history_predictions(history),
+            nbp.get_predictions(uid))
+    history = nbp.get_user_history(1).add_order([196, 12427], 3)
+    predictions = nbp.get_history_predictions(history, n_limit=5)
+    assert len(predictions) == 5 and (predictions.uid == 1).all()
+    assert nbp.get_user_history(999_999).n_orders == 0
+
+    # The model's extractors are unknown, all registered ones are checked
+    nbp.features_predict.register_feature_extractors({
+        'plugin.extra': lambda **dataframes: None})
+    with pytest.raises(ValueError, match='plugin.extra'):
+        nbp.get_history_predictions(history)
+
+
+def test_NextBasketPrediction_export_predictions(nbp, tmp_dir):
+    nbp.export_predictions(tmp_dir / 'predictions.npz', with_prob=True)
+    assert (tmp_dir / 'predictions.npz').exists()
+    nbp.export_predictions(tmp_dir / 'predictions.csv')
+    assert (tmp_dir / 'predictions.csv').read_text().startswith(
+        'user_id,product_id\n')
+    with pytest.raises(ValueError, match='Unknown format'):
+        nbp.export_predictions(tmp_dir / 'predictions.npz', format='xml')
+    with pytest.raises(ValueError, match=r"\['users_per_chunk'\]"):
+        nbp.export_predictions(tmp_dir / 'predictions.csv',
+            users_per_chunk=10)
+    with pytest.raises(ValueError, match='with_prob'):
+        nbp.export_predictions(tmp_dir / 'predictions.csv', with_prob=True)
+    nbp.export_predictions(tmp_dir / 'predictions.csv.gz', compression='gzip')
+    assert (tmp_dir / 'predictions.csv.gz').exists()
+
+
+def test_NextBasketPrediction_lazy_predictions(nbp, trained_model, tmp_dir,
+        test_data_dir):
+    joblib_path = tmp_dir / 'model.joblib'
+    nbp.save_model(joblib_path)
+    nbp_lazy = NextBasketPrediction().add_data(test_data_dir).load_model(
+        path=joblib_path, lazy=True)
+    assert nbp_lazy.predictions_store.n_users == 0
+    nbp_lazy.get_predictions([])
+    n_events = len(nbp_lazy.profiler.events)
+    nbp_lazy.get_predictions([])
+    assert len(nbp_lazy.profiler.events) == n_events
+
+    user_ids = [2, 5, 7]
+    expected = nbp.get_predictions(user_ids)
+    pd.testing.assert_frame_equal(nbp_lazy.get_predictions(user_ids),
+        expected)
+    assert nbp_lazy.predictions_store.n_users == expected.uid.nunique()
+    assert nbp_lazy._lazy_user_ids == set(user_ids)
+
+    n_events = len(nbp_lazy.profiler.events)
+    pd.testing.assert_frame_equal(nbp_lazy.get_predictions(user_ids[:2]),
+        nbp.get_predictions(user_ids[:2]))
+    assert len(nbp_lazy.profiler.events) == n_events
+
+
+def test_NextBasketPrediction_hot_model_swap(nbp, tmp_dir):
+    model_b = GradientBoostingClassifier(n_estimators=1, random_state=0)
+    model_b.fit(nbp.features_predict.df_ui.values[:200],
+        np.arange(200) % 2)
+    path_a, path_b = tmp_dir / 'model_a.joblib', tmp_dir / 'model_b.joblib'
+    nbp.save_model(path_a)
+    joblib.dump(model_b, path_b)
+
+    user_ids = [1, 2, 3]
+    expected_a = nbp.get_predictions(user_ids)
+    nbp.load_model(path=path_b)
+    expected_b = nbp.get_predictions(user_ids)
+    assert not expected_a.equals(expected_b)
+
+    mismatches = []
+    stop = threading.Event()
+    def read():
+        while not stop.is_set():
+            predictions = nbp.get_predictions(user_ids)
+            if not (predictions.equals(expected_a)
+                    or predictions.equals(expected_b)):
+                mismatches.append(predictions)
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for path in [path_a, path_b, path_a]:
+            version = nbp.state.version
+            nbp.load_model(path=path)
+            assert nbp.state.version == version + 1
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    assert mismatches == []
+    pd.testing.assert_frame_equal(nbp.get_predictions(user_ids), expected_a)
+
+
+def test_NextBasketPrediction_failed_load_keeps_state(nbp, tmp_dir):
+    state = nbp.state
+    with pytest.raises(FileNotFoundError):
+        nbp.load_model(path=tmp_dir / 'missing.joblib')
+    assert nbp.state is state
+
+
+def test_NextBasketPrediction_train_doesnt_change_served_model(nbp):
+    state = nbp.state
+    nbp.model = state.model
+    nbp.train_model()
+    assert nbp.model is not state.model
+    assert nbp.state is state
+
+
+def test_NextBasketPrediction_cold_start(nbp):
+    new_user_id = 10**6
+    assert len(nbp.get_predictions([new_user_id])) == 0
+    popular_products = nbp.state.popular_products
+    assert popular_products is not None
+
+    predictions = nbp.get_predictions([2, new_user_id], n_limit=3,
+        cold_start=True)
+    expected = nbp.get_predictions([2], n_limit=3)
+    pd.testing.assert_frame_equal(predictions[predictions.uid == 2],
+        expected)
+    is_new = predictions.uid == new_user_id
+    assert predictions[is_new].iid.tolist() == (
+        popular_products.top[:3].tolist())
+    assert predictions[is_new].in_target_prob.isna().all()
+    assert predictions.uid.dtype == expected.uid.dtype
+
+    cart = popular_products.top[:2].tolist()
+    predictions = nbp.get_predictions(new_user_id, cold_start=True,
+        cart=cart)
+    assert predictions.iid.tolist() == (
+        popular_products.recommend(cart, n_limit=10).tolist())
+    assert not predictions.iid.isin(cart).any()
+    assert predictions.product_name.notna().all()
+
+
+def test_NextBasketPrediction_model_bundle(nbp, tmp_dir, test_data_dir):
+    model = GradientBoostingClassifier(n_estimators=2, random_state=0)
+    nbp_small = NextBasketPrediction(model=model).add_data(test_data_dir)
+    nbp_small.features_train.use_feature_extractors([
+        '000_ui_in_target.in_target', '002_ui_avg_cart_pos.avg_cart_pos'])
+    nbp_small.train_model().save_model(tmp_dir / 'model.joblib')
+    bundle = nbp_small.model_bundle
+    assert bundle.feature_names == ['ui_avg_cart_pos']
+    assert bundle.extractor_names == ['002_ui_avg_cart_pos.avg_cart_pos']
+    assert bundle.fingerprint['n_rows'] == len(nbp_small.features_train.df_ui)
+
+    # Fresh instance extracts only features the model needs
+    nbp_loaded = NextBasketPrediction().add_data(test_data_dir).load_model(
+        path=tmp_dir / 'model.joblib')
+    assert list(nbp_loaded.features_predict.df_ui.columns) == [
+        'ui_avg_cart_pos']
+    assert nbp_loaded.state.bundle.features == bundle.features
+
+    # Extracted features are pruned, then extracted again when needed
+    nbp.save_model(tmp_dir / 'model_full.joblib')
+    columns = list(nbp.features_predict.df_ui.columns)
+    predictions = nbp.predictions
+    nbp.load_model(path=tmp_dir / 'model.joblib')
+    assert list(nbp.features_predict.df_ui.columns) == ['ui_avg_cart_pos']
+    pd.testing.assert_frame_equal(nbp.predictions, nbp_loaded.predictions)
+    nbp.load_model(path=tmp_dir / 'model_full.joblib')
+    assert list(nbp.features_predict.df_ui.columns) == columns
+    pd.testing.assert_frame_equal(nbp.predictions, predictions)
+
+
+def test_NextBasketPrediction_compile_model(nbp, trained_model, tmp_dir):
+    predictions = nbp.predictions
+    nbp.compile_model()
+    assert nbp.model is trained_model
+    assert nbp.state.model is nbp.compiled_bundle.model
+    assert nbp.state.model.__class__.__name__ == 'TreeEnsemble'
+    nbp.update_predictions()
+    assert nbp.state.model is nbp.compiled_bundle.model
+    pd.testing.assert_frame_equal(nbp.predictions, predictions)
+
+    nbp.save_model(tmp_dir / 'model.joblib')
+    nbp_loaded = NextBasketPrediction().add_data(nbp.path_dir).load_model(
+        path=tmp_dir / 'model.joblib')
+    pd.testing.assert_frame_equal(nbp_loaded.predictions, predictions)
+
+
+def test_NextBasketPrediction_compile_model_retrain(tmp_dir, test_data_dir):
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model).add_data(test_data_dir)
+    nbp.train_model().update_predictions().compile_model()
+    nbp.save_model(tmp_dir / 'model.joblib')
+
+    # The estimator is retrained, the retrained model is served as is
+    nbp.train_model().update_predictions()
+    assert nbp.model is model
+    assert nbp.state.model is model
+    # Compiled model loaded from file is replaced with a default estimator
+    nbp_loaded = NextBasketPrediction().add_data(test_data_dir).load_model(
+        path=tmp_dir / 'model.joblib')
+    nbp_loaded.train_model()
+    assert isinstance(nbp_loaded.model, GradientBoostingClassifier)
+    report = nbp_loaded.get_negative_sampling_report(negative_rates=(.5,),
+        holdout=.3)
+    assert report.negative_rate.tolist() == [1., .5]
+
+
+def test_NextBasketPrediction_early_exit(nbp):
+    report = nbp.get_early_exit_report(margins=[0., 10.], every=2)
+    assert list(report.columns) == ['margin', 'stages', 'seconds', 'speedup',
+        'accuracy', 'max_prob_diff', 'top_k_agreement']
+    assert report.margin.isna().tolist() == [True, False, False]
+    assert report.stages.tolist() == [1., 2 / 5, 1.]
+    assert report.top_k_agreement.iloc[[0, 2]].tolist() == [1., 1.]
+    assert report.max_prob_diff.iloc[2] == 0.
+
+    predictions = nbp.predictions
+    model = nbp.model
+    nbp.update_predictions(early_exit_margin=10.)
+    assert nbp.state.model.early_exit_margin == 10.
+    assert nbp.model is model
+    pd.testing.assert_frame_equal(nbp.predictions, predictions)
+    nbp.update_predictions(early_exit_margin=0., early_exit_every=2)
+    assert not nbp.predictions.equals(predictions)
+
+
+def test_NextBasketPrediction_distill_model(nbp, tmp_dir):
+    report = nbp.distill_model(tmp_dir / 'student.joblib', holdout=.3)
+    assert list(report.index) == ['teacher', 'student']
+    assert nbp.model.__class__.__name__ == 'GradientBoostingClassifier'
+    assert nbp.student_bundle.features == nbp.model_bundle.features
+
+    nbp_student = NextBasketPrediction().add_data(nbp.path_dir).load_model(
+        path=tmp_dir / 'student.joblib')
+    assert nbp_student.model.__class__.__name__ == 'TreeEnsemble'
+    assert len(nbp_student.predictions) == len(nbp.predictions)
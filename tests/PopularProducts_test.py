@@ -0,0 +1,86 @@
+from instacartlib.PopularProducts import PopularProducts
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def df_prod_raw():
+    return pd.DataFrame({
+        'product_id': [1, 2, 3, 4, 5, 6],
+        'aisle_id': [1, 1, 1, 2, 2, 3],
+        'department_id': [1, 1, 1, 1, 1, 2],
+    })
+
+
+@pytest.fixture
+def df_trns_raw():
+    # counts: 1: 1, 2: 3, 3: 3, 4: 2, 5: 5, 6: 1
+    return pd.DataFrame({
+        'product_id': [1, 2, 2, 2, 3, 3, 3, 4, 4, 5, 5, 5, 5, 5, 6],
+    })
+
+
+@pytest.fixture
+def popular(df_trns_raw, df_prod_raw):
+    return PopularProducts(n_top=4, n_top_group=2, n_min=3).fit(
+        df_trns_raw, df_prod_raw)
+
+
+def test_PopularProducts_tables(popular):
+    assert popular.top.tolist() == [5, 2, 3, 4]  # tie 2 - 3: lower id first
+    assert popular.aisle_top[1].tolist() == [2, 3]
+    assert popular.aisle_top[2].tolist() == [5, 4]
+    assert popular.aisle_top[3].tolist() == [6, -1]
+    assert popular.department_top[1].tolist() == [5, 2]
+
+
+def test_PopularProducts_add_transactions(popular):
+    popular.add_transactions(pd.DataFrame({'product_id': [1, 1, 1, 7]}))
+    assert popular.counts[1] == 4
+    assert popular.top.tolist() == [5, 1, 2, 3]
+    assert popular.aisle_top[1].tolist() == [1, 2]
+    assert popular.counts[7] == 1
+
+
+def test_PopularProducts_get_fill(popular):
+    uid = np.array([1, 2, 2, 2, 3], dtype='uint32')
+    iid = np.array([6, 1, 2, 3, 4], dtype='uint32')
+    uid_fill, iid_fill = popular.get_fill(uid, iid)
+    assert uid_fill.dtype == uid.dtype
+    assert iid_fill.dtype == iid.dtype
+    assert list(zip(uid_fill.tolist(), iid_fill.tolist())) == [
+        # user 1: aisle 3, department 2, top
+        (1, 5), (1, 2), (1, 3), (1, 4),
+        # user 3: aisle 2 (without 4), department 1, top
+        (3, 5), (3, 2), (3, 3),
+    ]
+
+
+def test_PopularProducts_get_fill_nothing_to_fill(popular):
+    uid_fill, iid_fill = popular.get_fill(np.array([1, 1, 1]),
+        np.array([1, 2, 3]))
+    assert len(uid_fill) == 0
+    assert len(iid_fill) == 0
+
+
+def test_PopularProducts_recommend(popular):
+    assert popular.recommend().tolist() == [5, 2, 3, 4]
+    assert popular.recommend(n_limit=2).tolist() == [5, 2]
+    # Aisle 3 top (without 6), department 2 top, top
+    assert popular.recommend(cart=[6]).tolist() == [5, 2, 3, 4]
+    # Aisle 2 top, aisle 1 top, department 1 top, top (unknown product 99)
+    assert popular.recommend(cart=[4, 1, 99]).tolist() == [5, 2, 3]
+    assert popular.recommend(cart=[5], n_limit=2).tolist() == [4, 2]
+
+
+def test_PopularProducts_add_transactions_keeps_copies(popular):
+    snapshot = copy.copy(popular)
+    top = popular.top.copy()
+    popular.add_transactions(pd.DataFrame({'product_id': [1, 1, 1, 1, 1]}))
+    np.testing.assert_array_equal(snapshot.top, top)
+    assert popular.top.tolist() != top.tolist()
@@ -0,0 +1,135 @@
+from instacartlib.PredictionServer import PredictionServer, MicroBatcher
+from instacartlib.PredictionServer import HttpJsonClient, ServerMetrics
+from instacartlib.NextBasketPrediction import NextBasketPrediction
+
+import asyncio
+import time
+
+from sklearn.ensemble import GradientBoostingClassifier
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def nbp():
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model)
+    nbp.add_data('tests/testing_data')
+    return nbp.train_model().update_predictions()
+
+
+def test_MicroBatcher_coalesces_requests():
+    batches = []
+    def predict_batch(user_ids, n_limit):
+        batches.append(user_ids)
+        time.sleep(.01)
+        return {uid: list(range(uid, uid + n_limit)) for uid in user_ids}
+
+    async def run():
+        batcher = MicroBatcher(predict_batch, batch_size=8,
+            max_wait=.05).start()
+        results = await asyncio.gather(*(
+            batcher.submit([uid], n_limit=2) for uid in range(20)))
+        await batcher.stop()
+        return results, batcher.metrics
+
+    results, metrics = asyncio.run(run())
+    assert results == [{uid: [uid, uid + 1]} for uid in range(20)]
+    assert max(len(user_ids) for user_ids in batches) == 8
+    assert sum(len(user_ids) for user_ids in batches) == 20
+    assert metrics.n_batches == len(batches) < 20
+
+
+def test_MicroBatcher_propagates_errors():
+    def predict_batch(user_ids, n_limit):
+        raise KeyError('model failure')
+
+    async def run():
+        batcher = MicroBatcher(predict_batch, max_wait=0).start()
+        try:
+            with pytest.raises(KeyError, match='model failure'):
+                await batcher.submit([1])
+        finally:
+            await batcher.stop()
+
+    asyncio.run(run())
+
+
+def test_ServerMetrics_to_dict():
+    metrics = ServerMetrics()
+    assert metrics.to_dict()['latency_ms']['p50'] == 0.
+    metrics.record_request(.01, n_users=2)
+    metrics.record_request(.03, is_error=True)
+    metrics.record_batch(2, .005)
+    output = metrics.to_dict()
+    assert output['n_requests'] == 2
+    assert output['n_errors'] == 1
+    assert output['n_users'] == 2
+    assert output['latency_ms']['max'] == pytest.approx(30.)
+    assert output['batch_requests_mean'] == 2
+
+
+def test_PredictionServer_predict(nbp):
+    user_ids = [1, 2, 3, 4, 5, 100_000]
+
+    async def run():
+        server = await PredictionServer(nbp, port=0, batch_size=4,
+            max_wait=.01).start()
+        try:
+            async def request(uid):
+                async with HttpJsonClient(server.host, server.port) as client:
+                    return await client.request('POST', '/predict',
+                        {'user_ids': [uid], 'n_limit': 3})
+            responses = await asyncio.gather(*map(request, user_ids))
+            async with HttpJsonClient(server.host, server.port) as client:
+                metrics = await client.request('GET', '/metrics')
+                errors = [
+                    await client.request('GET', '/unknown'),
+                    await client.request('GET', '/predict'),
+                    await client.request('POST', '/predict', {'uid': 1}),
+                    await client.request('POST', '/predict', [1, 2]),
+                    await client.request('POST', '/predict', 'x'),
+                    *[await client.request('POST', '/predict',
+                        {'user_ids': [1], 'n_limit': n_limit})
+                        for n_limit in [-1, 2.5, '3', True, None]],
+                    await client.request('GET', '/health'),
+                ]
+        finally:
+            await server.stop()
+        return responses, metrics, errors
+
+    responses, (_, metrics), errors = asyncio.run(run())
+    for uid, (status, payload) in zip(user_ids, responses):
+        assert status == 200
+        expected = nbp.get_predictions([uid], n_limit=3).iid.tolist()
+        assert payload == {
+            'predictions': [{'user_id': uid, 'product_ids': expected}]}
+    assert metrics['n_requests'] == len(user_ids)
+    assert metrics['n_batches'] < len(user_ids)
+    assert [status for status, _ in errors] == [404, 405, *[400] * 8, 200]
+    assert 'JSON object expected' in errors[3][1]['error']
+    assert 'n_limit' in errors[5][1]['error']
+
+
+def test_PredictionServer_cold_start(nbp):
+    cart = nbp.state.popular_products.top[:1].tolist()
+
+    async def run():
+        server = await PredictionServer(nbp, port=0, max_wait=0,
+            cold_start=True).start()
+        try:
+            async with HttpJsonClient(server.host, server.port) as client:
+                return await client.request('POST', '/predict',
+                    {'user_ids': [1, 100_000], 'n_limit': 3, 'cart': cart})
+        finally:
+            await server.stop()
+
+    status, payload = asyncio.run(run())
+    assert status == 200
+    known, new = payload['predictions']
+    assert known['product_ids'] == nbp.get_predictions(
+        [1], n_limit=3).iid.tolist()
+    assert 'cold_start' not in known
+    assert new['cold_start']
+    assert new['product_ids'] == nbp.get_predictions(100_000, n_limit=3,
+        cold_start=True, cart=cart).iid.tolist()
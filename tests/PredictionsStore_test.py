@@ -0,0 +1,77 @@
+from instacartlib.PredictionsStore import PredictionsStore
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def df_predictions():
+    return pd.DataFrame({
+        'uid': np.array([1, 1, 1, 4, 7, 7], dtype='uint32'),
+        'iid': np.array([10, 11, 12, 40, 71, 70], dtype='uint32'),
+        'in_target_prob': [.9, .5, .1, .3, .8, .2],
+    })
+
+
+@pytest.fixture
+def store(df_predictions):
+    return PredictionsStore.from_frame(df_predictions)
+
+
+def test_PredictionsStore_from_frame(store, df_predictions):
+    assert store.uid.tolist() == [1, 4, 7]
+    assert store.offsets.tolist() == [0, 3, 4, 6]
+    assert store.iid.dtype == np.dtype('int32')
+    assert store.prob.dtype == np.dtype('float32')
+    assert store.n_users == 3
+    assert len(store) == 6
+    df = store.to_frame()
+    assert df.iid.tolist() == df_predictions.iid.tolist()
+    assert df.uid.tolist() == df_predictions.uid.tolist()
+    with pytest.raises(ValueError, match='sorted by uid'):
+        PredictionsStore.from_frame(df_predictions[::-1])
+
+
+def test_PredictionsStore_get_frame(store):
+    df = store.get_frame([7, 1, 5], n_limit=2)
+    assert df.uid.tolist() == [1, 1, 7, 7]
+    assert df.iid.tolist() == [10, 11, 71, 70]
+    assert len(store.get_frame([2, 100])) == 0
+    pd.testing.assert_frame_equal(store.get_frame({7, 1, 5}, n_limit=2), df)
+    pd.testing.assert_frame_equal(
+        store.get_frame(iter([7, 1, 5]), n_limit=2), df)
+    assert len(store.get_frame(n_limit=1)) == 3
+
+
+def test_PredictionsStore_get_user(store):
+    iid, prob = store.get_user(7)
+    assert iid.tolist() == [71, 70]
+    assert prob.tolist() == pytest.approx([.8, .2])
+    assert len(store.get_user(5)[0]) == 0
+    assert len(store.get_user(100)[0]) == 0
+
+
+def test_PredictionsStore_iter_users(store):
+    assert [(uid, iid.tolist()) for uid, iid in store.iter_users(n_limit=2)] \
+        == [(1, [10, 11]), (4, [40]), (7, [71, 70])]
+
+
+def test_PredictionsStore_update(store):
+    other = PredictionsStore.from_frame(pd.DataFrame({
+        'uid': [2, 7],
+        'iid': [20, 72],
+        'in_target_prob': [.4, .6],
+    }))
+    updated = store.update(other, user_ids=[2, 4, 7])
+    assert updated.uid.tolist() == [1, 2, 7]
+    assert updated.iid.tolist() == [10, 11, 12, 20, 72]
+    assert updated.uid.dtype == store.uid.dtype
+    assert store.uid.tolist() == [1, 4, 7]  # not changed
+
+
+def test_PredictionsStore_empty():
+    store = PredictionsStore.empty()
+    assert len(store) == 0
+    assert len(store.get_frame([1])) == 0
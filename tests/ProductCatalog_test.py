@@ -0,0 +1,33 @@
+from instacartlib.ProductCatalog import ProductCatalog
+
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def catalog():
+    return ProductCatalog.from_frame(pd.DataFrame({
+        'iid': [30, 10, 20],
+        'product_name': ['Crème fraîche', 'Soda', ''],
+    }))
+
+
+def test_ProductCatalog_from_frame(catalog):
+    assert catalog.iid.tolist() == [10, 20, 30]
+    assert catalog.name_offsets.tolist() == [0, 4, 4, 19]
+    assert len(catalog) == 3
+    assert catalog.nbytes == 3 * 4 + 4 * 8 + 19
+
+
+def test_ProductCatalog_get_names(catalog):
+    assert catalog.get_names([30, 10, 20, 5, 99]) == [
+        'Crème fraîche', 'Soda', '', None, None]
+    assert catalog.get_names([]) == []
+
+
+def test_ProductCatalog_invalid(catalog):
+    with pytest.raises(ValueError, match='sorted'):
+        ProductCatalog(catalog.iid[::-1], catalog.name_offsets, catalog.names)
+    with pytest.raises(ValueError, match='name_offsets'):
+        ProductCatalog(catalog.iid, catalog.name_offsets[:-1], catalog.names)
@@ -0,0 +1,101 @@
+from instacartlib.Profiler import Profiler
+from instacartlib.Profiler import StageEvent
+from instacartlib.Profiler import get_process_memory
+
+import json
+import threading
+import tracemalloc
+
+import pytest
+
+
+def test_Profiler_stage():
+    profiler = Profiler()
+    with profiler.stage('outer', rows_in=10) as outer:
+        with profiler.stage('outer.inner') as inner:
+            inner.rows_out = 5
+        outer.rows_out = 3
+
+    assert profiler.events == [inner, outer]
+    assert (outer.name, outer.rows_in, outer.rows_out) == ('outer', 10, 3)
+    assert (outer.depth, inner.depth) == (0, 1)
+    assert outer.wall_time >= inner.wall_time >= 0
+    assert outer.cpu_time >= 0
+    assert outer.rss_peak_delta >= 0
+    assert outer.tracemalloc_peak is None
+    assert profiler.get_events('outer.') == [inner]
+    assert repr(profiler) == '<Profiler events=2>'
+    assert repr(inner).startswith('<StageEvent name="outer.inner"')
+
+
+def test_Profiler_stage_exception():
+    profiler = Profiler()
+    with pytest.raises(ValueError):
+        with profiler.stage('broken'):
+            raise ValueError
+    assert [event.name for event in profiler.events] == ['broken']
+
+
+def test_Profiler_disabled():
+    profiler = Profiler(enabled=False)
+    with profiler.stage('stage') as event:
+        event.rows_out = 1
+    assert isinstance(event, StageEvent)
+    assert profiler.events == []
+
+
+def test_Profiler_trace_memory():
+    profiler = Profiler(trace_memory=True)
+    with profiler.stage('outer') as outer:
+        with profiler.stage('inner') as inner:
+            data = bytearray(10_000_000)
+            del data
+    assert inner.tracemalloc_peak >= 10_000_000
+    assert outer.tracemalloc_peak >= inner.tracemalloc_peak
+    tracemalloc.stop()
+
+
+def test_Profiler_export(tmp_dir):
+    profiler = Profiler()
+    with profiler.stage('ingest.transactions', rows_in=1):
+        pass
+
+    output = json.loads(profiler.to_json(tmp_dir / 'events.json'))
+    assert output == json.loads((tmp_dir / 'events.json').read_text())
+    assert output[0]['name'] == 'ingest.transactions'
+    assert output[0]['rows_in'] == 1
+
+    trace = json.loads(profiler.to_chrome_trace(tmp_dir / 'trace.json'))
+    assert (tmp_dir / 'trace.json').exists()
+    trace_event = trace['traceEvents'][0]
+    assert trace_event['ph'] == 'X'
+    assert trace_event['cat'] == 'ingest'
+    assert trace_event['args']['rows_in'] == 1
+
+    assert profiler.clear().events == []
+
+
+def test_Profiler_max_events_threads():
+    profiler = Profiler(max_events=50)
+
+    def record():
+        for _ in range(100):
+            with profiler.stage('outer'):
+                with profiler.stage('inner') as inner:
+                    pass
+            assert inner.depth == 1
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(profiler.events) == 50
+    assert {event.depth for event in profiler.events} == {0, 1}
+
+
+def test_get_process_memory():
+    memory = get_process_memory()
+    if memory:
+        assert memory['rss'] > 0
+        assert memory['shared'] + memory['private'] == memory['rss']
@@ -0,0 +1,33 @@
+from instacartlib.ServingState import ServingState
+from instacartlib.PredictionsStore import PredictionsStore
+
+import pandas as pd
+
+import pytest
+
+
+def test_ServingState_empty():
+    state = ServingState()
+    assert state.version == 0
+    assert state.predictions_store.n_users == 0
+    assert len(state.catalog) == 0
+    assert state.catalog.get_names([1]) == [None]
+
+
+def test_ServingState_replace():
+    state = ServingState(model='model_a')
+    store = PredictionsStore.from_frame(pd.DataFrame({
+        'uid': [1], 'iid': [10], 'in_target_prob': [.5]}))
+    new_state = state.replace(predictions_store=store)
+    assert new_state.version == 1
+    assert new_state.model == 'model_a'
+    assert new_state.predictions_store is store
+    assert state.predictions_store.n_users == 0  # not changed
+
+
+def test_ServingState_is_immutable():
+    state = ServingState()
+    with pytest.raises(AttributeError, match='immutable'):
+        state.model = 'model_b'
+    with pytest.raises(AttributeError):
+        state.new_attribute = 1
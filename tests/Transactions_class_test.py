@@ -1,6 +1,7 @@
 
 from unittest.mock import patch
 from instacartlib.Transactions import Transactions
+from instacartlib.Transactions import InvalidTransactionsData
 
 import os
 import numpy as np
@@ -48,3 +49,109 @@ def test_Transactions_load_from_gdrive():
     args, kwargs = mock_method.call_args
     assert 'path' in kwargs
     assert kwargs['path'] == os.path.join('abc', 'transactions.csv.zip')
+
+
+def test_Transactions_append(transactions):
+    df = transactions.df
+    is_first_order = df.order_id == df.order_id.iloc[0]
+    trns = Transactions().append(df[is_first_order])
+    trns.append(df[~is_first_order].astype('float64'))
+    pd.testing.assert_frame_equal(
+        trns.df,
+        pd.concat([df[is_first_order], df[~is_first_order]],
+            ignore_index=True))
+
+    with pytest.raises(InvalidTransactionsData, match='Missing columns'):
+        trns.append(df.drop(columns='order_id'))
+
+
+def test_Transactions_append_first_delta(tmp_dir, transactions):
+    df = transactions.df
+    trns = Transactions().append(df, path_dir=tmp_dir)
+    assert [path.name for path in trns._delta_paths] == ['000001.npz']
+    assert (tmp_dir / 'transactions_delta' / '000001.npz').exists()
+
+
+@pytest.fixture
+def data_dir_last_orders(tmp_dir, transactions):
+    """
+    Directory with transactions.csv without the last order of users 1 and 2;
+    frames with removed orders (one frame per user).
+    """
+    df = transactions.df
+    last_order_ids = (df[df.user_id.isin([1, 2])]
+        .drop_duplicates('user_id', keep='last').order_id)
+    is_last = df.order_id.isin(last_order_ids)
+    df[~is_last].to_csv(tmp_dir / 'transactions.csv', index=False)
+    df_last = df[is_last]
+    return tmp_dir, [df_last[df_last.user_id == uid] for uid in [1, 2]]
+
+
+def test_Transactions_append_invalid_progression(transactions):
+    df = transactions.df
+    df_user_1 = df[df.user_id == 1]
+    with pytest.raises(InvalidTransactionsData, match='progression'):
+        transactions.append(df_user_1.tail(1))
+
+    df_new_user = df_user_1.assign(user_id=999_999)
+    transactions.append(df_new_user)
+    assert transactions._users_last_order_number[999_999] == (
+        df_user_1.order_number.max())
+    with pytest.raises(InvalidTransactionsData, match='progression'):
+        transactions.append(df_new_user.tail(1))
+
+
+def test_Transactions_delta_segments(data_dir_last_orders, transactions):
+    path_dir, dfs_delta = data_dir_last_orders
+    trns = Transactions().read_dir(path_dir)
+    trns.append(dfs_delta[0], path_dir=path_dir)
+    trns.append(dfs_delta[1], path_dir=path_dir)
+    delta_dir = path_dir / 'transactions_delta'
+    assert sorted(p.name for p in delta_dir.iterdir()) == [
+        '000001.npz', '000002.npz']
+
+    trns_read = Transactions(show_progress=True).read_dir(path_dir)
+    pd.testing.assert_frame_equal(trns_read.df, trns.df)
+    pd.testing.assert_frame_equal(
+        trns_read.df.sort_values(['user_id', 'order_number'], kind='stable')
+            .reset_index(drop=True),
+        transactions.df)
+
+    trns_read.compact(path_dir)
+    assert list(delta_dir.iterdir()) == []
+    assert (path_dir / 'transactions_base').exists()
+    (path_dir / 'transactions.csv').unlink()
+    trns_compacted = Transactions().read_dir(path_dir)
+    pd.testing.assert_frame_equal(trns_compacted.df, trns.df)
+
+
+def test_Transactions_compact_interrupted(data_dir_last_orders):
+    path_dir, dfs_delta = data_dir_last_orders
+    trns = Transactions().read_dir(path_dir)
+    trns.append(dfs_delta[0], path_dir=path_dir)
+    delta_dir = path_dir / 'transactions_delta'
+    leftover = (delta_dir / '000001.npz').read_bytes()
+    trns.compact(path_dir)
+    # Crash after the base was written, before the delta was deleted
+    (delta_dir / '000001.npz').write_bytes(leftover)
+
+    trns_read = Transactions().read_dir(path_dir)
+    pd.testing.assert_frame_equal(trns_read.df, trns.df)
+    trns_read.append(dfs_delta[1], path_dir=path_dir)
+    assert sorted(p.name for p in delta_dir.iterdir()) == [
+        '000001.npz', '000002.npz']
+    pd.testing.assert_frame_equal(Transactions().read_dir(path_dir).df,
+        trns_read.df)
+
+    trns_read.compact(path_dir)
+    assert list(delta_dir.iterdir()) == []
+    pd.testing.assert_frame_equal(Transactions().read_dir(path_dir).df,
+        trns_read.df)
+
+
+def test_Transactions_compact_reduced(data_dir_last_orders):
+    path_dir, _ = data_dir_last_orders
+    trns = Transactions().read_dir(path_dir, reduced=True)
+    with pytest.raises(ValueError, match='reduced'):
+        trns.compact(path_dir)
+    assert not (path_dir / 'transactions_base').exists()
@@ -2,6 +2,12 @@
 from instacartlib.Transactions import read_transactions_csv
 from instacartlib.Transactions import get_transactions_csv_path
 from instacartlib.Transactions import InvalidTransactionsData
+from instacartlib.Transactions import write_transactions_npy
+from instacartlib.Transactions import read_transactions_manifest
+from instacartlib.Transactions import read_transactions_npy
+from instacartlib.Transactions import write_transactions_delta
+from instacartlib.Transactions import read_transactions_delta
+from instacartlib.Transactions import validate_orders_progression
 
 import io
 import numpy as np
@@ -85,3 +91,41 @@ def test_get_transactions_csv_path(test_data_dir):
 
     with pytest.raises(FileNotFoundError):
         get_transactions_csv_path('__NON-EXISTENT_PATH__')
+
+
+def test_write_read_transactions_npy(tmp_dir, transactions_csv_path):
+    df_raw = read_transactions_csv(transactions_csv_path)
+    write_transactions_npy(df_raw, tmp_dir / 'base')
+    write_transactions_npy(df_raw, tmp_dir / 'base')  # overwrite
+    pd.testing.assert_frame_equal(
+        read_transactions_npy(tmp_dir / 'base'), df_raw)
+    pd.testing.assert_frame_equal(
+        read_transactions_npy(tmp_dir / 'base', nrows=10), df_raw.head(10))
+
+    write_transactions_npy(df_raw, tmp_dir / 'base', delta_names=['1.npz'])
+    assert read_transactions_manifest(tmp_dir / 'base') == {'1.npz'}
+    assert not (tmp_dir / 'base.old').exists()
+
+    (tmp_dir / 'base' / 'user_id.npy').unlink()
+    with pytest.raises(InvalidTransactionsData):
+        read_transactions_npy(tmp_dir / 'base')
+
+
+def test_write_read_transactions_delta(tmp_dir, transactions_csv_path):
+    df_raw = read_transactions_csv(transactions_csv_path)
+    write_transactions_delta(df_raw, tmp_dir / 'delta.npz')
+    pd.testing.assert_frame_equal(
+        read_transactions_delta(tmp_dir / 'delta.npz'), df_raw)
+
+
+def test_validate_orders_progression():
+    df_raw_new = pd.DataFrame({
+        'order_id':     [10, 10, 11, 12],
+        'user_id':      [ 1,  1,  1,  2],
+        'order_number': [ 3,  3,  4,  1],
+    })
+    last_order_number = pd.Series([2], index=[1])
+    validate_orders_progression(df_raw_new, last_order_number)
+    with pytest.raises(InvalidTransactionsData, match=r'2 users: \[1, 2\]'):
+        validate_orders_progression(df_raw_new, pd.Series([1, 1],
+            index=[1, 2]))
@@ -0,0 +1,120 @@
+from instacartlib.TreeEnsemble import TreeEnsemble
+from instacartlib.TreeEnsemble import _get_float32_threshold
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LogisticRegression
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def xy():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(2000, 6))
+    x[:, 3] = rng.integers(0, 5, len(x))
+    y = x[:, 0] + x[:, 1] * x[:, 2] + rng.normal(size=len(x)) > 0
+    return x, y
+
+
+@pytest.mark.parametrize('params, mask_dtype', [
+    (dict(n_estimators=20), 'uint8'),
+    (dict(n_estimators=5, max_depth=5), 'uint32'),
+    (dict(n_estimators=5, max_depth=None, max_leaf_nodes=40), 'uint64'),
+    (dict(n_estimators=5, loss='exponential'), 'uint8'),
+    (dict(n_estimators=5, init='zero'), 'uint8'),
+])
+def test_TreeEnsemble_same_predictions(xy, params, mask_dtype):
+    x, y = xy
+    model = GradientBoostingClassifier(random_state=0, **params).fit(x, y)
+    compiled = TreeEnsemble.from_sklearn(model, chunk_size=300)
+    assert compiled.node_masks.dtype == mask_dtype
+    assert compiled.n_features_in_ == 6
+    x_test = np.r_[x, np.random.default_rng(1).normal(size=(500, 6))]
+    assert (compiled.predict_proba(x_test) == model.predict_proba(x_test)
+        ).all()
+    assert (compiled.predict(x_test) == model.predict(x_test)).all()
+    assert compiled.predict_proba(x_test[:0]).shape == (0, 2)
+    with pytest.raises(ValueError, match='Expected'):
+        compiled.predict_proba(x_test[:, :5])
+
+
+def test_TreeEnsemble_unsupported(xy):
+    x, y = xy
+    with pytest.raises(ValueError, match='Only fitted'):
+        TreeEnsemble.from_sklearn(LogisticRegression().fit(x, y))
+    with pytest.raises(ValueError, match='Only binary'):
+        TreeEnsemble.from_sklearn(GradientBoostingClassifier(
+            n_estimators=2).fit(x, np.digitize(x[:, 0], [-1, 1])))
+    with pytest.raises(ValueError, match='Init estimator'):
+        TreeEnsemble.from_sklearn(GradientBoostingClassifier(n_estimators=2,
+            init=LogisticRegression()).fit(x, y))
+
+
+def test_get_float32_threshold():
+    x = np.float32([0.1, 0.2, 1/3])
+    for threshold in [0.1, np.nextafter(0.1, 1), np.nextafter(0.1, 0), 1/3]:
+        t32 = _get_float32_threshold(threshold)
+        assert t32.dtype == np.float32
+        assert ((x <= t32) == (x.astype('float64') <= threshold)).all()
+
+
+def test_TreeEnsemble_early_exit(xy):
+    x, y = xy
+    model = GradientBoostingClassifier(n_estimators=30, random_state=0).fit(
+        x, y)
+    compiled = TreeEnsemble.from_sklearn(model)
+    raw_full = compiled.decision_function(x)
+
+    approx = compiled.with_early_exit(np.inf, every=7)
+    assert approx.node_thresholds is compiled.node_thresholds
+    assert compiled.early_exit_margin is None
+    raw, n_stages = approx.score_stages(x)
+    assert (raw == raw_full).all() and (n_stages == 30).all()
+
+    raw, n_stages = compiled.with_early_exit(0., every=7).score_stages(x)
+    assert (n_stages == 7).all()
+
+    approx = compiled.with_early_exit(1., every=7)
+    raw, n_stages = approx.score_stages(x)
+    assert set(n_stages) <= {7, 14, 21, 28, 30}
+    assert 7 < n_stages.mean() < 30
+    exited = n_stages < 30
+    assert (np.abs(raw[exited]) >= 1.).all()
+    assert (raw[~exited] == raw_full[~exited]).all()
+    assert (approx.predict_proba(x)[:, 1] == approx.raw_to_proba(raw)).all()
+
+
+def test_TreeEnsemble_log_odds_regressor(xy):
+    x, y = xy
+    model = GradientBoostingRegressor(n_estimators=10, random_state=0).fit(
+        x, y * 2. - 1)
+    with pytest.raises(ValueError, match='Loss'):
+        TreeEnsemble.from_sklearn(model)
+    compiled = TreeEnsemble.from_sklearn(model, log_odds=True)
+    assert (compiled.decision_function(x) == model.predict(x)).all()
+    assert list(compiled.classes_) == [0, 1]
+
+
+def test_TreeEnsemble_uint8_codes(xy):
+    x, y = xy
+    codes = np.clip(x * 20 + 100, 0, 255).astype('uint8')
+    model = GradientBoostingClassifier(n_estimators=10, random_state=0).fit(
+        codes, y)
+    compiled = TreeEnsemble.from_sklearn(model)
+    assert (compiled.predict_proba(codes) == model.predict_proba(codes)
+        ).all()
+    assert (compiled.predict_proba(codes.astype('float32')) ==
+        compiled.predict_proba(codes)).all()
+
+
+def test_TreeEnsemble_downsampled_model(xy):
+    from instacartlib.sampling import DownsampledModel
+    x, y = xy
+    for loss in ['log_loss', 'exponential']:
+        model = DownsampledModel(GradientBoostingClassifier(n_estimators=5,
+            loss=loss, random_state=0), .3).fit(x, y)
+        compiled = TreeEnsemble.from_sklearn(model)
+        assert np.allclose(compiled.predict_proba(x), model.predict_proba(x),
+            rtol=0, atol=1e-12)
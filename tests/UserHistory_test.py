@@ -0,0 +1,101 @@
+from instacartlib.UserHistory import UserHistory
+from instacartlib.UserHistory import check_extractors
+from instacartlib import UserHistory as user_history
+from instacartlib.FeaturesDataset import FeaturesDataset
+from instacartlib.InstacartDataset import InstacartDataset
+from instacartlib.ItemStats import ItemStats
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def history():
+    return UserHistory.from_orders([
+        (None, [10, 20, 30]),
+        (7, [20, 10]),
+        (14, [40, 20]),
+    ], uid=3)
+
+
+@pytest.mark.parametrize("train, n_orders_limit", [
+    (False, None),
+    (True, 3),
+])
+def test_UserHistory_get_features_same_as_extractors(test_data_dir, train,
+        n_orders_limit):
+    icds = InstacartDataset(train=train,
+        n_orders_limit=n_orders_limit).read_dir(test_data_dir)
+    fsds = FeaturesDataset().extract_features(**icds.dataframes)
+    df_i = ItemStats.from_df_trns(icds.df_trns).get_features()
+    columns = fsds.df_ui.columns.drop('ui_in_target', errors='ignore')
+
+    uids = fsds.df_ui.index.get_level_values('uid')
+    for uid in icds.df_trns.uid.unique():
+        dataframes = icds.get_users_dataframes([uid])
+        history = UserHistory.from_frames(dataframes['df_ord'],
+            dataframes['df_trns'])
+        pd.testing.assert_frame_equal(history.get_features(df_i),
+            fsds.df_ui.loc[uids == uid, columns], check_exact=True)
+
+
+def test_UserHistory_from_orders(history):
+    assert history.n_orders == 3
+    assert history.days_since_prior_order.tolist() == [-1, 7, 14]
+    assert history.order_offsets.tolist() == [0, 3, 5, 7]
+    assert history.cart_pos.tolist() == [1, 2, 3, 1, 2, 1, 2]
+
+
+def test_UserHistory_add_order_and_tail(history):
+    extended = history.add_order([50], days_since_prior_order=3)
+    assert extended.n_orders == 4
+    assert history.n_orders == 3  # not changed
+    assert extended.iid[-1] == 50
+
+    tail = extended.tail(2)
+    assert tail.days_since_prior_order.tolist() == [14, 3]
+    assert tail.order_offsets.tolist() == [0, 2, 3]
+    assert tail.iid.tolist() == [40, 20, 50]
+    assert extended.tail(None) is extended
+
+
+def test_UserHistory_get_days_until_same_item(history):
+    # Target is 10.5 days (median delay) after the last order
+    assert history.get_days_until_same_item().tolist() == [
+        7., 7., 31.5, 14., 24.5, 10.5, 10.5]
+
+
+def test_UserHistory_get_features_unknown_items(history):
+    df_i = ItemStats().get_features()
+    df_ui = history.get_features(df_i)
+    assert df_ui.index.get_level_values('iid').tolist() == [10, 20, 30, 40]
+    assert (df_ui.index.get_level_values('uid') == 3).all()
+    assert (df_ui.i_n_popularity == 0).all()
+    assert (df_ui.i_days_delay_global_mid == 999.).all()
+    assert df_ui.ui_total_buy.tolist() == [2, 3, 1, 1]
+
+
+def test_UserHistory_invalid():
+    with pytest.raises(ValueError, match='at least one product'):
+        UserHistory.from_orders([(None, [1]), (5, [])])
+    with pytest.raises(ValueError, match='single user'):
+        UserHistory.from_frames(pd.DataFrame(),
+            pd.DataFrame({'uid': [1, 2]}))
+
+
+def test_UserHistory_check_extractors(history, monkeypatch):
+    # Built-in extractors are the versions `get_features` reproduces
+    feature_extractors = FeaturesDataset().feature_extractors
+    check_extractors(feature_extractors)
+    df_i = ItemStats().get_features()
+    history.get_features(df_i, feature_extractors)
+
+    with pytest.raises(ValueError, match='plugin.extra'):
+        check_extractors({**feature_extractors,
+            'plugin.extra': lambda **dataframes: None})
+    monkeypatch.setitem(user_history.EXTRACTORS_VERSIONS,
+        '001_ui_buy_counts.buy_counts', '0' * 16)
+    with pytest.raises(ValueError, match='changed'):
+        history.get_features(df_i, feature_extractors)
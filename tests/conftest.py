@@ -5,6 +5,8 @@ from instacartlib.transactions_utils import get_df_trns_from_raw
 from instacartlib.Products import read_products_csv
 from instacartlib.Products import _preprocess_raw_products as prods_preprocess
 
+from instacartlib.InstacartDataset import InstacartDataset
+
 import datetime
 import random
 import shutil
@@ -153,3 +155,18 @@ def dataframes_target(df_trns, df_trns_target, df_prod):
         df_trns_target=df_trns_target,
         df_prod=df_prod,
     )
+
+################################################################################
+# InstacartDataset
+################################################################################
+
+@pytest.fixture
+def icds_train(test_data_dir):
+    return InstacartDataset(train=True, n_orders_limit=5).read_dir(
+        test_data_dir)
+
+
+@pytest.fixture
+def icds_predict(test_data_dir):
+    return InstacartDataset(train=False, n_orders_limit=5).read_dir(
+        test_data_dir)
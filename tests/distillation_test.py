@@ -0,0 +1,54 @@
+from instacartlib.distillation import distill, get_log_odds
+from instacartlib.distillation import get_holdout_mask
+from instacartlib.ModelBundle import ModelBundle
+from instacartlib.TreeEnsemble import TreeEnsemble
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LogisticRegression
+
+import pytest
+
+
+@pytest.fixture
+def df_ui():
+    rng = np.random.default_rng(0)
+    n_rows = 3000
+    index = pd.MultiIndex.from_arrays([np.repeat(np.arange(150), 20),
+        np.tile(np.arange(20), 150)], names=['uid', 'iid'])
+    x = rng.normal(size=(n_rows, 2)).astype('float32')
+    y = x[:, 0] - x[:, 1] + rng.normal(size=n_rows) > 0
+    return pd.DataFrame({'f_a': x[:, 0], 'f_b': x[:, 1],
+        'ui_in_target': y.astype('uint8')}, index=index)
+
+
+def test_get_log_odds():
+    log_odds = get_log_odds(np.array([0., .5, .8, 1.]))
+    assert log_odds[1] == 0. and np.isclose(log_odds[2], np.log(4))
+    assert np.isfinite(log_odds).all()
+
+
+def test_get_holdout_mask():
+    uids = np.repeat(np.arange(100), 3)
+    mask = get_holdout_mask(uids, holdout=.2)
+    assert mask.sum() == 60
+    # Whole users are held out
+    assert (mask.reshape(-1, 3) == mask[::3, None]).all()
+
+
+def test_distill(df_ui):
+    x = df_ui[['f_a', 'f_b']].values
+    teacher = LogisticRegression().fit(x, df_ui.ui_in_target.values)
+    bundle = ModelBundle.from_features(teacher, df_ui)
+    student_bundle, report = distill(bundle, df_ui,
+        student=GradientBoostingRegressor(n_estimators=20, random_state=0))
+    assert isinstance(student_bundle.model, TreeEnsemble)
+    assert student_bundle.features == bundle.features
+    assert list(report.index) == ['teacher', 'student']
+    assert report.loc['teacher', 'teacher_agreement'] == 1.
+    assert report.loc['student', 'teacher_agreement'] > .9
+    assert report.loc['student', 'mean_prob_diff'] < .05
+    assert report.loc['student', 'top_k_agreement'] > .8
+    prob = student_bundle.model.predict_proba(student_bundle.get_x(df_ui))
+    assert np.abs(prob[:, 1] - teacher.predict_proba(x)[:, 1]).mean() < .05
@@ -0,0 +1,140 @@
+from instacartlib.predictions_export import write_predictions_csv
+from instacartlib.predictions_export import format_csv_lines
+from instacartlib.predictions_export import get_format
+from instacartlib.predictions_export import write_predictions_parquet
+from instacartlib.predictions_export import write_predictions_feather
+from instacartlib.predictions_export import write_predictions_npz
+from instacartlib.predictions_export import read_predictions_npz
+from instacartlib.PredictionsStore import PredictionsStore
+from instacartlib.utils import hash_for_file
+
+import gzip
+import io
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def store():
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1, 15, 50)
+    return PredictionsStore(
+        uid=np.arange(1, 51, dtype='uint32') * 997,
+        offsets=np.r_[0, np.cumsum(lengths)],
+        iid=rng.integers(0, 50_000, lengths.sum()).astype('int32'),
+        prob=np.zeros(lengths.sum(), dtype='float32'),
+    )
+
+
+@pytest.fixture
+def expected_csv(store):
+    rows = ['user_id,product_id']
+    for uid, iids in store.iter_users(n_limit=10):
+        rows.append(f'{uid},' + ' '.join(map(str, iids)))
+    return '\n'.join(rows)
+
+
+def test_format_csv_lines():
+    lines = format_csv_lines(np.array([1, 20]), np.array([0, 2, 3]),
+        np.array([0, 305, 1000000]))
+    assert lines == b'\n1,0 305\n20,1000000'
+
+
+@pytest.mark.parametrize('users_per_chunk', [1, 7, 1000])
+def test_write_predictions_csv(store, expected_csv, tmp_dir,
+        users_per_chunk):
+    path = tmp_dir / 'predictions.csv'
+    n_bytes, sha256 = write_predictions_csv(store, path,
+        users_per_chunk=users_per_chunk)
+    assert path.read_text() == expected_csv
+    assert n_bytes == path.stat().st_size
+    assert sha256 == hash_for_file(path)
+
+
+def test_write_predictions_csv_gzip(store, expected_csv, tmp_dir):
+    path = tmp_dir / 'predictions.csv.gz'
+    n_bytes, sha256 = write_predictions_csv(store, path)
+    assert gzip.decompress(path.read_bytes()).decode() == expected_csv
+    assert n_bytes == path.stat().st_size
+    assert sha256 == hash_for_file(path)
+    _, sha256_again = write_predictions_csv(store, path)
+    assert sha256_again == sha256
+
+
+def test_write_predictions_csv_zstd(store, expected_csv, tmp_dir):
+    zstandard = pytest.importorskip('zstandard')
+    path = tmp_dir / 'predictions.csv.zst'
+    write_predictions_csv(store, path)
+    data = zstandard.ZstdDecompressor().stream_reader(path.read_bytes()).read()
+    assert data.decode() == expected_csv
+
+
+def test_write_predictions_csv_file_like(store, expected_csv):
+    buffer = io.StringIO()
+    write_predictions_csv(store, buffer)
+    assert buffer.getvalue() == expected_csv
+
+    buffer = io.BytesIO()
+    write_predictions_csv(store, buffer, compression='gzip')
+    assert gzip.decompress(buffer.getvalue()).decode() == expected_csv
+
+
+def test_write_predictions_csv_unknown_compression(store, tmp_dir):
+    with pytest.raises(ValueError, match='Unknown compression'):
+        write_predictions_csv(store, tmp_dir / 'predictions.csv',
+            compression='lzma')
+
+
+def test_write_predictions_csv_empty(tmp_dir):
+    path = tmp_dir / 'predictions.csv'
+    write_predictions_csv(PredictionsStore.empty(), path)
+    assert path.read_text() == 'user_id,product_id'
+
+
+@pytest.fixture
+def expected_frame(store):
+    df = store.get_frame(n_limit=5)
+    df['rank'] = (df.groupby('uid').cumcount() + 1).astype('uint16')
+    return df.rename(columns={'in_target_prob': 'prob'})
+
+
+def test_get_format():
+    assert get_format('a/predictions.parquet') == 'parquet'
+    assert get_format('predictions.arrow') == 'feather'
+    assert get_format('predictions.csv.gz') == 'csv'
+    with pytest.raises(ValueError, match='infer export format'):
+        get_format('predictions.txt')
+
+
+def test_write_predictions_parquet(store, expected_frame, tmp_dir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_dir / 'predictions.parquet'
+    write_predictions_parquet(store, path, n_limit=5, with_prob=True,
+        with_rank=True, users_per_chunk=20)
+    assert pq.ParquetFile(path).num_row_groups == 3
+    pd.testing.assert_frame_equal(pd.read_parquet(path), expected_frame)
+
+
+def test_write_predictions_feather(store, expected_frame, tmp_dir):
+    pa = pytest.importorskip('pyarrow')
+    path = tmp_dir / 'predictions.feather'
+    write_predictions_feather(store, path, n_limit=5, users_per_chunk=20)
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        assert reader.num_record_batches == 3
+        df = reader.read_pandas()
+    pd.testing.assert_frame_equal(df, expected_frame[['uid', 'iid']])
+
+
+def test_write_predictions_npz(store, tmp_dir):
+    path = tmp_dir / 'predictions.npz'
+    write_predictions_npz(store, path, n_limit=5, with_prob=True)
+    store_read = read_predictions_npz(path)
+    pd.testing.assert_frame_equal(store_read.to_frame(),
+        store.get_frame(n_limit=5))
+
+    write_predictions_npz(store, path, compressed=True)
+    assert np.isnan(read_predictions_npz(path).prob).all()
@@ -0,0 +1,97 @@
+from instacartlib.prefork import pack_arrays, share_serving_state
+from instacartlib.prefork import share_popular_products
+from instacartlib.prefork import get_prefork_server
+from instacartlib.PredictionServer import HttpJsonClient
+from instacartlib.NextBasketPrediction import NextBasketPrediction
+from instacartlib.ProductCatalog import ProductCatalog
+
+import asyncio
+import os
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def nbp():
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model)
+    nbp.add_data('tests/testing_data')
+    return nbp.train_model().update_predictions()
+
+
+def test_pack_arrays():
+    arrays = {
+        'a': np.arange(5, dtype='uint8'),
+        'b': np.ones((2, 3), dtype='float64'),
+        'c': np.array([], dtype='int32'),
+    }
+    views = pack_arrays(arrays)
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(views[name], array)
+        assert views[name].dtype == array.dtype
+        assert not views[name].flags.writeable
+    # Aligned and backed by the same buffer
+    assert views['b'].ctypes.data - views['a'].ctypes.data == 64
+
+
+def test_share_serving_state(nbp):
+    catalog = ProductCatalog.from_frame(nbp.icds_predict.df_prod)
+    store, catalog_shared = share_serving_state(nbp.predictions_store,
+        catalog)
+    assert not store.iid.flags.writeable
+    assert store.prob_name == nbp.predictions_store.prob_name
+    np.testing.assert_array_equal(store.iid, nbp.predictions_store.iid)
+    assert catalog_shared.get_names(catalog.iid[:3]) == catalog.get_names(
+        catalog.iid[:3])
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+def test_PreforkServer(nbp):
+    server = get_prefork_server(nbp, n_workers=2, port=0,
+        max_wait=0).start()
+    assert len(server.pids) == 2
+
+    async def run():
+        responses = []
+        for _ in range(6):
+            async with HttpJsonClient(server.host, server.port) as client:
+                responses.append(await client.request('POST', '/predict',
+                    {'user_ids': [1, 2], 'n_limit': 3, 'with_names': True}))
+                responses.append(await client.request('GET', '/metrics'))
+        return responses
+
+    try:
+        responses = asyncio.run(run())
+    finally:
+        server.stop()
+    assert server.pids == []
+
+    expected = nbp.get_predictions([1, 2], n_limit=3)
+    for status, payload in responses[::2]:
+        assert status == 200
+        for prediction in payload['predictions']:
+            rows = expected[expected.uid == prediction['user_id']]
+            assert prediction['product_ids'] == rows.iid.tolist()
+            assert prediction['product_names'] == rows.product_name.tolist()
+    pids = {payload['pid'] for _, payload in responses[1::2]}
+    assert os.getpid() not in pids
+
+
+def test_get_prefork_server_lazy(nbp):
+    nbp.lazy = True
+    try:
+        with pytest.raises(ValueError, match='all users'):
+            get_prefork_server(nbp)
+    finally:
+        nbp.lazy = False
+
+
+def test_share_popular_products(nbp):
+    popular_products = nbp.state.popular_products
+    shared = share_popular_products(popular_products)
+    assert not shared.top.flags.writeable
+    assert shared.recommend([1, 2]).tolist() == (
+        popular_products.recommend([1, 2]).tolist())
@@ -0,0 +1,103 @@
+from instacartlib.ranking import get_segments_offsets
+from instacartlib.ranking import get_segments_ranks
+from instacartlib.ranking import get_chunks_bounds
+from instacartlib.ranking import select_top_k
+from instacartlib.ranking import get_top_k_agreement
+from instacartlib.ranking import TopKAccumulator
+from instacartlib import ranking
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def scored_rows():
+    uid = np.array([3, 3, 3, 1, 1, 2, 5, 5, 5, 5])
+    iid = np.arange(10, 20)
+    score = np.array([.1, .9, .5, .2, .2, .7, .3, .8, .3, .6])
+    return uid, iid, score
+
+
+def test_get_segments_offsets(scored_rows):
+    uid, _, _ = scored_rows
+    assert get_segments_offsets(uid).tolist() == [0, 3, 5, 6, 10]
+    assert get_segments_offsets([]).tolist() == [0]
+
+
+def test_get_chunks_bounds_aligned_to_segments(scored_rows):
+    offsets = get_segments_offsets(scored_rows[0])
+    assert get_chunks_bounds(offsets, 4) == [(0, 5), (5, 10)]
+    assert get_chunks_bounds(offsets, 1) == [(0, 3), (3, 5), (5, 6), (6, 10)]
+    assert get_chunks_bounds(offsets, 100) == [(0, 10)]
+    assert get_chunks_bounds(get_segments_offsets([]), 10) == []
+
+
+def test_select_top_k(scored_rows):
+    uid, iid, score = scored_rows
+    assert iid[select_top_k(uid, score)].tolist() == [
+        13, 14, 15, 11, 12, 10, 17, 19, 16, 18]
+    assert iid[select_top_k(uid, score, k=2)].tolist() == [
+        13, 14, 15, 11, 12, 17, 19]
+
+
+@pytest.mark.parametrize('bounds', [
+    [(0, 10)],
+    [(0, 3), (3, 5), (5, 6), (6, 10)],
+    [(0, 2), (2, 7), (7, 10)],  # users split between chunks
+])
+def test_TopKAccumulator(scored_rows, bounds):
+    uid, iid, score = scored_rows
+    accumulator = TopKAccumulator(k=2)
+    for start, stop in bounds:
+        accumulator.add(uid[start:stop], iid[start:stop], score[start:stop])
+    uid_top, iid_top, score_top = accumulator.get_arrays()
+
+    positions = select_top_k(uid, score, k=2)
+    assert uid_top.tolist() == uid[positions].tolist()
+    assert iid_top.tolist() == iid[positions].tolist()
+    assert score_top.tolist() == score[positions].tolist()
+    assert list(accumulator.to_frame().columns) == [
+        'uid', 'iid', 'in_target_prob']
+
+
+def test_get_segments_ranks():
+    assert get_segments_ranks([0, 2, 5]).tolist() == [0, 1, 0, 1, 2]
+    assert get_segments_ranks([0]).tolist() == []
+
+
+def test_select_top_k_same_order_as_sort_values():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'uid': np.repeat(rng.permutation(50), rng.integers(1, 30, 50)),
+    })
+    df['score'] = rng.integers(0, 5, len(df)) / 4  # many ties
+    expected = df.sort_values(['uid', 'score'], ascending=[True, False])
+    positions = select_top_k(df.uid.values, df.score.values)
+    assert positions.tolist() == expected.index.to_list()
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 1 << 22])
+def test_select_top_k_partition_same_as_sort(monkeypatch, block_size):
+    monkeypatch.setattr(ranking, 'PARTITION_BLOCK_SIZE', block_size)
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        uid = rng.integers(0, 20, rng.integers(0, 200))
+        score = rng.integers(0, 4, len(uid)) / 4  # many ties
+        score[rng.integers(0, len(uid), 3 * (len(uid) > 0))] = np.nan
+        positions = np.lexsort((-score, uid))
+        ranks = get_segments_ranks(get_segments_offsets(uid[positions]))
+        for k in [0, 1, 3, 10]:
+            assert select_top_k(uid, score, k).tolist() == (
+                positions[ranks < k].tolist())
+
+
+def test_get_top_k_agreement():
+    keys = [1, 1, 1, 2, 2]
+    scores = [.9, .8, .1, .5, .4]
+    assert get_top_k_agreement(keys, scores, scores, k=2) == 1.
+    # User 1: .8 swapped out for .1
+    assert get_top_k_agreement(keys, scores, [.9, .0, .1, .4, .5],
+        k=2) == .75
+    assert get_top_k_agreement([], [], [], k=2) == 1.
@@ -0,0 +1,73 @@
+from instacartlib.sampling import DownsampledModel, correct_probabilities
+from instacartlib.sampling import get_negative_sample_mask, get_negative_rate
+from instacartlib.sampling import get_negative_sampling_report
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+
+import pytest
+
+
+@pytest.fixture
+def xy_uids():
+    rng = np.random.default_rng(0)
+    n_rows = 6000
+    uids = np.repeat(np.arange(200), 30)
+    rng.shuffle(uids)
+    x = rng.normal(size=(n_rows, 2))
+    y = (x[:, 0] - x[:, 1] + rng.normal(size=n_rows) > 2).astype('uint8')
+    return x, y, uids
+
+
+def test_get_negative_sample_mask(xy_uids):
+    _, y, uids = xy_uids
+    mask = get_negative_sample_mask(uids, y, .25)
+    assert mask[y == 1].all()
+    assert np.isclose(get_negative_rate(y, mask), .25, atol=.01)
+    # Every user keeps its share of negatives (up to rounding)
+    for uid in range(200):
+        is_user_negative = (uids == uid) & (y == 0)
+        n_kept = mask[is_user_negative].sum()
+        assert abs(n_kept - is_user_negative.sum() * .25) < 1
+    assert (get_negative_sample_mask(uids, y, .25) == mask).all()
+    assert get_negative_sample_mask(uids, y, 1.).all()
+    with pytest.raises(ValueError, match='negative_rate'):
+        get_negative_sample_mask(uids, y, 0.)
+
+
+def test_correct_probabilities():
+    prob = np.array([0., .2, .5, 1.])
+    assert (correct_probabilities(prob, 1.) == prob).all()
+    # Odds are scaled by the rate
+    corrected = correct_probabilities(prob, .25)
+    assert corrected[0] == 0. and corrected[3] == 1.
+    assert np.isclose(corrected[2] / (1 - corrected[2]), .25)
+
+
+def test_DownsampledModel_calibrated(xy_uids):
+    x, y, uids = xy_uids
+    mask = get_negative_sample_mask(uids, y, .2)
+    model = DownsampledModel(
+        GradientBoostingClassifier(n_estimators=20, random_state=0),
+        get_negative_rate(y, mask)).fit(x[mask], y[mask])
+    prob = model.predict_proba(x)
+    assert prob.shape == (len(x), 2)
+    assert np.allclose(prob.sum(axis=1), 1.)
+    # Sampled model overestimates, the corrected one doesn't
+    assert model.model.predict_proba(x)[:, 1].mean() > 2 * y.mean()
+    assert abs(prob[:, 1].mean() - y.mean()) < .02
+    assert (model.predict(x) == (prob[:, 1] > .5)).all()
+
+
+def test_get_negative_sampling_report(xy_uids):
+    x, y, uids = xy_uids
+    model = GradientBoostingClassifier(n_estimators=20, random_state=0)
+    report = get_negative_sampling_report(model, x, y, uids,
+        negative_rates=(.5, .2), holdout=.2)
+    assert report.negative_rate.tolist() == [1., .5, .2]
+    assert report.rows.is_monotonic_decreasing
+    assert report.speedup[0] == 1. and report.top_k_agreement[0] == 1.
+    assert (report.accuracy > .85).all()
+    assert (abs(report.mean_prob - report.positive_rate) < .03).all()
+    assert (report.top_k_recall > .5).all()
+    assert not hasattr(model, 'estimators_')
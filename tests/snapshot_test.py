@@ -0,0 +1,119 @@
+from instacartlib.snapshot import write_frame, read_frame
+from instacartlib.NextBasketPrediction import NextBasketPrediction
+from instacartlib.utils import get_old_dir_path
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def nbp():
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0)
+    nbp = NextBasketPrediction(model=model, scale_features=True)
+    nbp.add_data('tests/testing_data')
+    # `refresh_users` computes item statistics
+    return nbp.train_model().update_predictions().refresh_users([1])
+
+
+def test_write_read_frame(tmp_dir):
+    df = pd.DataFrame({
+        'a': np.array([1, 2, 3], dtype='uint8'),
+        'name': ['x', None, 'ünï'],
+        'b': np.array([.5, np.nan, 1.], dtype='float16'),
+    })
+    write_frame(df, tmp_dir / 'df')
+    df_read = read_frame(tmp_dir / 'df')
+    pd.testing.assert_frame_equal(df_read, df)
+    # Numeric columns are not copied from the mapped files
+    assert isinstance(df_read['a'].values, np.memmap)
+    assert not df_read['a'].values.flags.writeable
+
+    df = df.set_index(['a', 'name'])
+    write_frame(df, tmp_dir / 'df_index')
+    pd.testing.assert_frame_equal(read_frame(tmp_dir / 'df_index'), df)
+
+
+def test_NextBasketPrediction_snapshot(nbp, tmp_dir):
+    with pytest.raises(ValueError, match='Nothing to snapshot'):
+        NextBasketPrediction().save_snapshot(tmp_dir / 'snapshot')
+    nbp.save_snapshot(tmp_dir / 'snapshot')
+    with pytest.raises(FileNotFoundError, match='Snapshot not found'):
+        NextBasketPrediction().load_snapshot(tmp_dir)
+
+    nbp_restored = NextBasketPrediction().load_snapshot(
+        tmp_dir / 'snapshot')
+    # Nothing is read from csv, preprocessed or extracted
+    assert [event.name for event in nbp_restored.profiler.events] == [
+        'snapshot.load']
+    assert not nbp_restored.predictions_store.iid.flags.writeable
+    pd.testing.assert_frame_equal(nbp_restored.predictions, nbp.predictions)
+    assert isinstance(nbp_restored.icds_predict.df_trns['uid'].values,
+        np.memmap)
+    for name in ['df_ord', 'df_trns', 'df_prod']:
+        pd.testing.assert_frame_equal(getattr(nbp_restored.icds_predict, name),
+            getattr(nbp.icds_predict, name))
+    pd.testing.assert_frame_equal(nbp_restored.features_predict.df_ui,
+        nbp.features_predict.df_ui)
+    pd.testing.assert_series_equal(
+        nbp_restored.features_predict.item_stats.orders_hist,
+        nbp.features_predict.item_stats.orders_hist)
+    assert nbp_restored.scaler.columns == nbp.scaler.columns
+
+    user_ids = [2, 3, 10**6]
+    pd.testing.assert_frame_equal(
+        nbp_restored.get_predictions(user_ids, cold_start=True),
+        nbp.get_predictions(user_ids, cold_start=True))
+    # Incremental updates work on the restored state
+    nbp_restored.refresh_users([2, 3])
+    pd.testing.assert_frame_equal(nbp_restored.predictions, nbp.predictions)
+
+
+def test_NextBasketPrediction_snapshot_replace(nbp, tmp_dir):
+    path_dir = tmp_dir / 'snapshot'
+    nbp.save_snapshot(path_dir)
+    nbp.save_snapshot(path_dir)
+    assert sorted(path.name for path in tmp_dir.iterdir()) == ['snapshot']
+
+    # Interrupted between renames: only the previous snapshot is left
+    path_dir.rename(get_old_dir_path(path_dir))
+    nbp_restored = NextBasketPrediction().load_snapshot(path_dir)
+    pd.testing.assert_frame_equal(nbp_restored.predictions, nbp.predictions)
+    nbp.save_snapshot(path_dir)
+    assert sorted(path.name for path in tmp_dir.iterdir()) == ['snapshot']
+
+
+def test_NextBasketPrediction_snapshot_lazy(nbp, tmp_dir, test_data_dir):
+    nbp.save_model(tmp_dir / 'model.joblib')
+    nbp_lazy = NextBasketPrediction().add_data(test_data_dir).load_model(
+        path=tmp_dir / 'model.joblib', lazy=True)
+    with pytest.raises(ValueError, match='first `.get_predictions'):
+        nbp_lazy.save_snapshot(tmp_dir / 'snapshot')
+    predictions = nbp_lazy.get_predictions([2, 3])
+    nbp_lazy.save_snapshot(tmp_dir / 'snapshot')
+
+    nbp_restored = NextBasketPrediction().load_snapshot(
+        tmp_dir / 'snapshot')
+    assert nbp_restored.lazy
+    assert nbp_restored.predictions_store.n_users == 2
+    pd.testing.assert_frame_equal(nbp_restored.get_predictions([2, 3]),
+        predictions)
+    # Other users are predicted lazily from the restored data
+    pd.testing.assert_frame_equal(nbp_restored.get_predictions([1]),
+        nbp_lazy.get_predictions([1]))
+    assert 'dataset.predict_lazy' not in {
+        event.name for event in nbp_restored.profiler.events}
+
+
+def test_NextBasketPrediction_snapshot_resets_state(nbp, tmp_dir,
+        test_data_dir):
+    nbp.save_snapshot(tmp_dir / 'snapshot')
+    nbp_compiled = NextBasketPrediction(model=nbp.model).add_data(
+        test_data_dir).update_predictions().compile_model()
+    nbp_compiled.icds_predict._transactions._reduced = True
+    nbp_compiled.load_snapshot(tmp_dir / 'snapshot')
+    assert nbp_compiled.compiled_bundle is None
+    assert nbp_compiled._get_model_bundle() is nbp_compiled.model_bundle
+    assert not nbp_compiled.icds_predict._transactions._reduced
@@ -0,0 +1,55 @@
+from instacartlib.synthetic import write_synthetic_dataset
+from instacartlib.synthetic import iter_transactions_chunks
+from instacartlib.synthetic import generate_products
+from instacartlib.Transactions import read_transactions_csv
+from instacartlib.Transactions import validate_orders_progression
+from instacartlib.Products import read_products_csv
+from instacartlib.InstacartDataset import InstacartDataset
+
+import pandas as pd
+
+
+def test_write_synthetic_dataset_raw_schema(tmp_dir):
+    n_rows = write_synthetic_dataset(tmp_dir, 5000, n_products=500)
+
+    df_raw = read_transactions_csv(tmp_dir / 'transactions.csv')
+    df_prod_raw = read_products_csv(tmp_dir / 'products.csv')
+    assert len(df_raw) == n_rows
+    assert n_rows >= 5000
+    assert len(df_prod_raw) == 500
+    assert df_raw.product_id.isin(df_prod_raw.product_id).all()
+    # Written under a temporary name, renamed when complete
+    assert sorted(path.name for path in tmp_dir.iterdir()) == [
+        'products.csv', 'transactions.csv']
+
+
+def test_iter_transactions_chunks_consistent_users_and_orders():
+    df_raw = pd.concat(iter_transactions_chunks(20_000, n_products=1000,
+        users_per_chunk=30))
+
+    assert not df_raw.duplicated(['order_id', 'product_id']).any()
+    assert df_raw.user_id.is_monotonic_increasing
+    assert df_raw.groupby('order_id').user_id.nunique().eq(1).all()
+    validate_orders_progression(df_raw, pd.Series(dtype='int64'))
+    first_order = df_raw.order_number == 1
+    assert df_raw.days_since_prior_order[first_order].isna().all()
+    assert df_raw.reordered[first_order].eq(0).all()
+    assert df_raw.days_since_prior_order[~first_order].between(0, 30).all()
+    assert df_raw.reordered[~first_order].mean() > .3
+
+
+def test_iter_transactions_chunks_is_deterministic():
+    df_a = pd.concat(iter_transactions_chunks(3000, n_products=100, seed=1))
+    df_b = pd.concat(iter_transactions_chunks(3000, n_products=100, seed=1))
+    pd.testing.assert_frame_equal(df_a, df_b)
+
+
+def test_generate_products_aisle_in_single_department():
+    df_prod_raw = generate_products(n_products=1000)
+    assert df_prod_raw.groupby('aisle_id').department_id.nunique().eq(1).all()
+
+
+def test_synthetic_dataset_can_be_read_by_InstacartDataset(tmp_dir):
+    write_synthetic_dataset(tmp_dir, 3000, n_products=300)
+    icds = InstacartDataset(train=True, n_orders_limit=5).read_dir(tmp_dir)
+    assert len(icds.df_trns) > 0
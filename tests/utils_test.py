@@ -6,6 +6,8 @@ from instacartlib.utils import get_df_info
 from instacartlib.utils import split_counter_suffix
 from instacartlib.utils import increment_counter_suffix
 from instacartlib.utils import drop_duplicates
+from instacartlib.utils import replace_dir
+from instacartlib.utils import get_existing_dir_path
 
 import warnings
 
@@ -129,3 +131,17 @@ def test_increment_counter_suffix_2_times(test_input, expected):
 ])
 def test_drop_duplicates(test_input, expected):
     assert drop_duplicates(test_input) == expected
+
+
+def test_replace_dir(tmp_dir):
+    path_dir = tmp_dir / 'data'
+    assert get_existing_dir_path(path_dir) is None
+    for content in ['a', 'b']:
+        (tmp_dir / 'data.tmp').mkdir()
+        (tmp_dir / 'data.tmp' / 'file').write_text(content)
+        replace_dir(tmp_dir / 'data.tmp', path_dir)
+        assert (path_dir / 'file').read_text() == content
+    assert sorted(p.name for p in tmp_dir.iterdir()) == ['data']
+    # Crash between renames: the previous directory is found
+    path_dir.rename(tmp_dir / 'data.old')
+    assert get_existing_dir_path(path_dir) == tmp_dir / 'data.old'